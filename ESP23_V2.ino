@@ -57,14 +57,23 @@ const int maxMillimeters = 1200;
 long maxSteps = 0;
 long currentPosition = 0;
 
-void createJsonResponse(const char* status, const char* message, String &response) {
+// Batch-Modus: ein ganzes Rezept in einer JSON-Zeile
+const size_t COMMAND_JSON_CAPACITY = 8192;
+const int maxBatchSteps = 64;
+
+// id != 0: Kennung des Befehls, wird zur Zuordnung auf dem Raspberry Pi zurückgeschickt
+void createJsonResponse(const char* status, const char* message, String &response, long id = 0) {
     StaticJsonDocument<200> doc;
     doc["status"] = status;
     doc["message"] = message;
+    if (id != 0) {
+        doc["id"] = id;
+    }
     serializeJson(doc, response);
 }
 
 void setup() {
+    Serial.setRxBufferSize(4096);
     Serial.begin(115200);
     Serial.println("DEBUG: ESP32 Initialisierung gestartet");
 
@@ -135,7 +144,7 @@ void handleSerialCommands() {
 }
 
 void processSerialCommand(String commandStr) {
-    StaticJsonDocument<200> doc;
+    DynamicJsonDocument doc(COMMAND_JSON_CAPACITY);
     DeserializationError error = deserializeJson(doc, commandStr);
     if (error) {
         Serial.println("DEBUG: Ungültiges JSON ignoriert.");
@@ -144,6 +153,7 @@ void processSerialCommand(String commandStr) {
 
     const char* cmd = doc["command"];
     if (!cmd) return;
+    long cmdId = doc["id"] | 0L;
 
     String response;
 
@@ -153,33 +163,27 @@ void processSerialCommand(String commandStr) {
         moveToMM(targetMM);
 
         // Jetzt nur JSON, keine weiteren Ausgaben danach
-        createJsonResponse("success", "Bewegung abgeschlossen", response);
+        createJsonResponse("success", "Bewegung abgeschlossen", response, cmdId);
         Serial.println(response);
 
     } else if (strcmp(cmd, "servo") == 0) {
         int delayTime = doc["delay"];
         if (delayTime < 0) {
-            createJsonResponse("error", "Ungültige Verzögerung", response);
+            createJsonResponse("error", "Ungültige Verzögerung", response, cmdId);
             Serial.println(response);
             return; 
         }
 
-        Serial.printf("DEBUG: Servo bewegen (180 Grad), warte %d ms, zurück zu 90 Grad.\n", delayTime);
-        servoDelay = delayTime;
-        myServo.write(180);
-        delay(180);
-        delay(servoDelay);
-        myServo.write(90);
-        delay(180);
+        servoPour(delayTime);
 
-        createJsonResponse("success", "Servo-Bewegung abgeschlossen", response);
+        createJsonResponse("success", "Servo-Bewegung abgeschlossen", response, cmdId);
         Serial.println(response);
 
     } else if (strcmp(cmd, "pump") == 0) {
         int pumpNumber = doc["pump"];
         int duration = doc["duration"];
         if (pumpNumber < 1 || pumpNumber > 4 || duration <= 0) {
-            createJsonResponse("error", "Ungültige Pumpennummer oder Dauer", response);
+            createJsonResponse("error", "Ungültige Pumpennummer oder Dauer", response, cmdId);
             Serial.println(response);
             return;
         }
@@ -191,7 +195,7 @@ void processSerialCommand(String commandStr) {
         Pump &pump = pumps[pumpNumber - 1];
         if (pump.active) {
             Serial.println("DEBUG: Pumpe ist bereits aktiv, ignoriere Aktivierung.");
-            createJsonResponse("error", "Pumpe bereits aktiv", response);
+            createJsonResponse("error", "Pumpe bereits aktiv", response, cmdId);
             Serial.println(response);
             return;
         }
@@ -202,15 +206,18 @@ void processSerialCommand(String commandStr) {
         digitalWrite(pump.pin, LOW);
 
         // Jetzt JSON ausgeben, danach keine Ausgaben mehr
-        createJsonResponse("success", "Pumpe aktiviert", response);
+        createJsonResponse("success", "Pumpe aktiviert", response, cmdId);
         Serial.println(response);
 
         // KEINE weitere Ausgabe nach JSON!
 
     } else if (strcmp(cmd, "status") == 0) {
         // Keine Debug-Ausgabe, direkt JSON
-        StaticJsonDocument<256> statusDoc;
+        StaticJsonDocument<384> statusDoc;
         statusDoc["status"] = "online";
+        if (cmdId != 0) {
+            statusDoc["id"] = cmdId;
+        }
         JsonArray pumpStatuses = statusDoc.createNestedArray("pumps");
         for (int i = 0; i < 4; i++) {
             JsonObject pumpObj = pumpStatuses.createNestedObject();
@@ -218,11 +225,94 @@ void processSerialCommand(String commandStr) {
             pumpObj["active"] = pumps[i].active;
             pumpObj["remainingTime"] = pumps[i].active ? (pumps[i].duration - (millis() - pumps[i].start)) : 0;
         }
+        statusDoc["batch"] = true;
+        statusDoc["maxBatch"] = maxBatchSteps;
         serializeJson(statusDoc, response);
         Serial.println(response);
 
         // Keine weitere Ausgabe nach JSON!
+
+    } else if (strcmp(cmd, "batch") == 0) {
+        runBatch(doc, cmdId);
+    }
+}
+
+void servoPour(int delayTime) {
+    Serial.printf("DEBUG: Servo bewegen (180 Grad), warte %d ms, zurück zu 90 Grad.\n", delayTime);
+    servoDelay = delayTime;
+    myServo.write(180);
+    delay(180);
+    delay(servoDelay);
+    myServo.write(90);
+    delay(180);
+}
+
+// Wartet, ohne die Pumpen-Timer zu blockieren
+void waitWithPumps(unsigned long ms) {
+    unsigned long start = millis();
+    while (millis() - start < ms) {
+        handlePumpDurations();
+        delay(1);
+    }
+}
+
+void sendStepEvent(long id, int index, int total) {
+    StaticJsonDocument<128> eventDoc;
+    eventDoc["event"] = "step";
+    eventDoc["id"] = id;
+    eventDoc["index"] = index;
+    eventDoc["total"] = total;
+    String out;
+    serializeJson(eventDoc, out);
+    Serial.println(out);
+}
+
+// Führt ein komplettes Rezept lokal aus:
+// ["m", mm] Fahrt, ["s", ms] Servo, ["p", pumpe, ms] Pumpe starten, ["w", ms] Warten
+void runBatch(JsonDocument &doc, long cmdId) {
+    String response;
+    JsonArray steps = doc["steps"].as<JsonArray>();
+    int count = doc["count"] | -1;
+    if (steps.isNull() || count < 0 || count > maxBatchSteps || (int)steps.size() != count) {
+        createJsonResponse("error", "Ungültiger Batch", response, cmdId);
+        Serial.println(response);
+        return;
+    }
+
+    Serial.printf("DEBUG: Batch mit %d Schritten gestartet.\n", count);
+    for (int i = 0; i < count; i++) {
+        JsonArray step = steps[i].as<JsonArray>();
+        const char* type = step[0];
+        sendStepEvent(cmdId, i, count);
+        if (!type) {
+            continue;
+        }
+
+        if (strcmp(type, "m") == 0) {
+            moveToMM(step[1].as<int>());
+        } else if (strcmp(type, "s") == 0) {
+            int delayTime = step[1].as<int>();
+            if (delayTime >= 0) {
+                servoPour(delayTime);
+            }
+        } else if (strcmp(type, "p") == 0) {
+            int pumpNumber = step[1].as<int>();
+            int duration = step[2].as<int>();
+            if (pumpNumber < 1 || pumpNumber > 4 || duration <= 0) {
+                Serial.println("DEBUG: Ungültiger Pumpenschritt im Batch.");
+            } else if (pumps[pumpNumber - 1].active) {
+                Serial.println("DEBUG: Pumpe ist bereits aktiv, ignoriere Aktivierung.");
+            } else {
+                Serial.printf("DEBUG: Pumpe %d wird für %d ms aktiviert.\n", pumpNumber, duration);
+                activatePump(pumpNumber, duration);
+            }
+        } else if (strcmp(type, "w") == 0) {
+            waitWithPumps(step[1].as<unsigned long>());
+        }
     }
+
+    createJsonResponse("success", "Batch abgeschlossen", response, cmdId);
+    Serial.println(response);
 }
 
 void connectToWiFi() {
@@ -343,6 +433,7 @@ void moveToMM(int targetMM) {
 
   while (stepper.distanceToGo() != 0) {
     stepper.run();
+    handlePumpDurations();
   }
 
   currentPosition = stepper.currentPosition();
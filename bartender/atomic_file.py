@@ -0,0 +1,29 @@
+"""
+Atomares Schreiben von JSON-Dateien.
+
+Geschrieben wird in eine temporäre Datei im selben Ordner, die nach fsync per
+os.replace an die Stelle der alten tritt. Ein Absturz mitten im Schreiben
+hinterlässt so entweder die alte oder die neue Datei, nie eine halbe.
+"""
+import json
+import os
+import tempfile
+
+
+def atomic_write_json(path, data):
+    """Schreibt data als JSON nach path; bei Fehlern bleibt die alte Datei unverändert und die Ausnahme fliegt weiter."""
+    directory = os.path.dirname(os.path.abspath(path))
+    prefix = "." + os.path.splitext(os.path.basename(path))[0] + "-"
+    fd, tmp_path = tempfile.mkstemp(prefix=prefix, suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as file:
+            json.dump(data, file, indent=4)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
@@ -0,0 +1,138 @@
+"""
+Verfügbarkeitsindex für die Startseite.
+
+Hält für jedes Rezept Gültigkeit, Gründe, geschätzte Dauer und die benutzten
+Getränke/Pumpen, dazu eine Rückwärtszuordnung Konfigurationsschlüssel ->
+Rezepte. Ändert sich eine Flaschenposition oder Pumpenbelegung, werden nur die
+Rezepte neu bewertet, die davon abhängen. Jede Bewertung landet außerdem als
+Metadaten im RecipeStore (für Auflisten und Filtern ohne Kompilieren).
+"""
+from threading import Lock
+
+from recipe_compiler import touched_keys
+
+
+class AvailabilityIndex:
+    def __init__(self, compiler, config_store):
+        self.compiler = compiler
+        self.config_store = config_store
+        self._lock = Lock()
+        self._entries = {}  # Dateiname -> Eintrag (dict)
+        self._dependents = {}  # Schlüssel/Getränk -> Menge von Dateinamen
+        self._generation = None
+
+    # --------------------------------------------------------------- Abfrage
+
+    def entries(self):
+        """Alle Einträge für die Startseite; liest höchstens die Generation des Speichers."""
+        self.check_store()
+        with self._lock:
+            return [
+                {key: (list(value) if key == "reasons" else value) for key, value in entry.items() if key != "deps"}
+                for entry in self._entries.values()
+            ]
+
+    def get(self, name):
+        with self._lock:
+            entry = self._entries.get(name)
+            return dict(entry) if entry else None
+
+    # ------------------------------------------------------------ Pflege
+
+    def check_store(self):
+        """Neu aufbauen, falls im RecipeStore seit dem letzten Aufbau etwas geändert wurde."""
+        generation = self.compiler.store.generation
+        if generation != self._generation:
+            self.rebuild(generation)
+
+    def rebuild(self, generation=None):
+        if generation is None:
+            generation = self.compiler.store.generation
+        names = set(self.compiler.store.names())
+        with self._lock:
+            removed = set(self._entries) - names
+        for name in removed:
+            self._remove(name)
+        for name in names:
+            self.refresh(name)
+        self._generation = generation
+
+    def refresh(self, name, generation=None):
+        """
+        Bewertet ein einzelnes Rezept neu (nach Speichern, Löschen oder Änderung).
+        generation ist die Generation des Speicherns/Löschens; folgt sie direkt
+        auf die bekannte, braucht check_store() danach keinen Neuaufbau.
+        """
+        store = self.compiler.store
+        if not store.exists(name):
+            self._remove(name)
+            self._advance(generation)
+            return
+        version, config = self.config_store.snapshot()
+        revision = None
+        try:
+            revision = self.compiler.load(name).stamp
+            plan = self.compiler.plan(name, config, version)
+            entry = {
+                "name": name,
+                "valid": plan.valid,
+                "reasons": list(plan.reasons),
+                "eta": round(plan.est_ms / 1000),
+                "saved": round(plan.saved_ms / 1000),
+                "drinks": sorted(plan.drinks),
+                "pumps": sorted(plan.pumps),
+            }
+            deps = plan.deps
+            # Ist das Rezept inzwischen neuer, verwirft der Store diese Metadaten
+            store.set_meta(name, revision, plan.valid, plan.est_ms, plan.ingredients,
+                           reasons=list(plan.reasons), saved_ms=plan.saved_ms, peephole_ms=plan.peephole_ms,
+                           drinks=entry["drinks"], pumps=entry["pumps"])
+        except Exception as e:
+            entry = {"name": name, "valid": False, "reasons": [f"Fehler beim Lesen des Rezepts: {e}"],
+                     "eta": 0, "saved": 0, "drinks": [], "pumps": []}
+            deps = frozenset()
+            if revision is not None:
+                store.set_meta(name, revision, False, 0, (), reasons=entry["reasons"])
+        with self._lock:
+            self._unlink(name)
+            self._entries[name] = dict(entry, deps=deps)
+            for key in deps:
+                self._dependents.setdefault(key, set()).add(name)
+        self._advance(generation)
+
+    def on_config_change(self, changed_keys, old_config, new_config):
+        """ConfigStore-Abonnent: nur abhängige Rezepte neu bewerten."""
+        touched = touched_keys(changed_keys, old_config, new_config)
+        with self._lock:
+            if "*" in touched:
+                affected = set(self._entries)
+            else:
+                affected = set()
+                for key in touched:
+                    affected |= self._dependents.get(key, set())
+        for name in affected:
+            self.refresh(name)
+
+    # --------------------------------------------------------------- Intern
+
+    def _advance(self, generation):
+        # Nur lückenlos weiterzählen; dazwischen hat jemand anders geschrieben, dann baut check_store neu auf
+        with self._lock:
+            if generation is not None and self._generation is not None and generation == self._generation + 1:
+                self._generation = generation
+
+    def _remove(self, name):
+        with self._lock:
+            self._unlink(name)
+            self._entries.pop(name, None)
+
+    def _unlink(self, name):
+        entry = self._entries.get(name)
+        if not entry:
+            return
+        for key in entry["deps"]:
+            dependents = self._dependents.get(key)
+            if dependents:
+                dependents.discard(name)
+                if not dependents:
+                    del self._dependents[key]
@@ -0,0 +1,367 @@
+"""
+Durchsatz-Benchmark: Drinks pro Stunde mit der echten Flask-App.
+
+Bestellungen laufen über /run_recipe, /run_custom_recipe und
+/generate_and_run_temp_recipe durch Warteschlange, Planer und Ausführung
+gegen einen ESP-Emulator im selben Prozess. Eine virtuelle Uhr überspringt
+alle Fahr-, Servo- und Wartezeiten; die Rechenzeit des Hosts zählt echt.
+Ein Lauf über viele Drinks dauert so nur Sekunden.
+
+Gemessen wird in virtueller Zeit:
+- Drinks pro Stunde (Bestellungen auf einmal aufgegeben, Warteschlange voll),
+- Dauer pro Drink, aufgeteilt in Fahrt, Ausschenken, Pumpen, Warten und
+  Host (Planung, serielle Übertragung, Verwaltung),
+- Leerlauf zwischen zwei Drinks.
+
+Aufruf (im Ordner bartender):
+    python benchmark.py --output bench.json
+    python benchmark.py --compare bench.json --max-regression 5
+
+Die Ergebnisse (JSON) enthalten den Commit, damit Läufe verschiedener Stände
+verglichen werden können. Standardmäßig wird eine feste Benchmark-
+Konfiguration verwendet, damit Ergebnisse nicht von der Flaschenbelegung
+abhängen.
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+import contextlib
+
+import clock
+from esp_emulator import EspEmulator, LoopbackSerial
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULT_VERSION = 1
+FINISHED = ("done", "failed", "cancelled", "interrupted")
+
+BENCH_CONFIG = {
+    "pour_time": 1000,
+    "move_wait": 500,
+    "drip_wait": 1000,
+    "refill_wait": 2000,
+    "gin": 300,
+    "vodka": 400,
+    "rum": 200,
+    "tequila": 700,
+    "whiskey": 900,
+    "triple_sec": 1100,
+    "pump1": "tonic",
+    "pump1_position": 250,
+    "pump1_time": 1000,
+    "pump2": "cola",
+    "pump2_position": 250,
+    "pump2_time": 1200,
+}
+SYNTHETIC_AMOUNTS = (1, 2, 3, 4, 6)
+
+# Reihenfolge = Vorrang, wenn sich Tätigkeiten überlappen (z.B. Pumpe während der Fahrt)
+CATEGORIES = (("move", "travel"), ("servo", "pour"), ("pump", "pump"), ("wait", "wait"))
+BREAKDOWN_KEYS = ("travel", "pour", "pump", "wait", "host")
+
+
+def breakdown(start, end, intervals):
+    """Teilt [start, end] nach Tätigkeit auf; nicht abgedeckte Zeit zählt als Host."""
+    relevant = [(kind, max(s, start), min(e, end)) for kind, s, e in intervals if e > start and s < end]
+    points = sorted({start, end} | {s for _, s, _ in relevant} | {e for _, _, e in relevant})
+    result = dict.fromkeys(BREAKDOWN_KEYS, 0.0)
+    for a, b in zip(points, points[1:]):
+        mid = (a + b) / 2
+        active = {kind for kind, s, e in relevant if s <= mid < e}
+        name = next((name for kind, name in CATEGORIES if kind in active), "host")
+        result[name] += b - a
+    return {key: round(value, 3) for key, value in result.items()}
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def prepare_workdir(recipe_dir, config):
+    workdir = tempfile.mkdtemp(prefix="barbot-bench-")
+    os.makedirs(os.path.join(workdir, "Rezepte"))
+    for name in sorted(os.listdir(recipe_dir)):
+        if name.endswith(".txt"):
+            shutil.copy(os.path.join(recipe_dir, name), os.path.join(workdir, "Rezepte", name))
+    with open(os.path.join(workdir, "config.json"), "w") as file:
+        json.dump(config, file, indent=4)
+    return workdir
+
+
+def build_workload(server, client, rounds, synthetic, seed):
+    """Liste von (Bezeichnung, Endpunkt, JSON) in Bestellreihenfolge."""
+    library = []
+    for name in server.recipe_store.names():
+        plan = server.get_plan(name)
+        if not plan.valid:
+            print(f"Überspringe '{name}': {'; '.join(plan.reasons)}", file=sys.__stdout__)
+            continue
+        library.append(name)
+
+    workload = []
+    for _ in range(rounds):
+        for name in library:
+            workload.append((f"rezept:{name}", "/run_recipe", {"recipe": name}))
+        for name in library:
+            data = client.get("/get_recipe_ingredients", query_string={"recipe": name}).get_json()
+            ingredients = [{"name": ing["name"], "amount": round(ing["amount"] * 1.5, 1)}
+                           for ing in data.get("ingredients", [])]
+            if ingredients:
+                workload.append((f"angepasst:{name}", "/run_custom_recipe",
+                                 {"recipe": name, "ingredients": ingredients}))
+
+    rng = random.Random(seed)
+    config = server.load_config()
+    drinks = [key for key in server.drink_names(config)]
+    for i in range(synthetic):
+        chosen = rng.sample(drinks, rng.randint(1, min(4, len(drinks))))
+        alcohol_data = [{"alcohol": drink, "amount": rng.choice(SYNTHETIC_AMOUNTS)} for drink in chosen]
+        workload.append((f"synthetisch:{i + 1}", "/generate_and_run_temp_recipe",
+                         {"name": f"bench-{i + 1}", "alcoholData": alcohol_data}))
+    return workload
+
+
+def run(args):
+    recipe_dir = os.path.abspath(args.recipes)
+    if args.config:
+        with open(args.config) as file:
+            config = json.load(file)
+    else:
+        config = dict(BENCH_CONFIG)
+    config["batch_mode"] = args.mode == "batch"
+    config["queue_policy"] = args.policy
+
+    workdir = prepare_workdir(recipe_dir, config)
+    previous_cwd = os.getcwd()
+    os.chdir(workdir)
+    virtual = clock.VirtualClock()
+    clock.install(virtual)
+    log = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else log):
+            import server
+
+            emulator = EspEmulator(write=None, clock=virtual)
+            link = LoopbackSerial(emulator)
+            virtual.add_settle(lambda: link.idle)
+            server.esp_transport.attach(link)
+            emulator.start()
+            emulator.boot()
+            server.esp_health.check_now()
+            server.esp_health.start()
+
+            orders = {}
+
+            def on_order(action, order):
+                entry = orders.setdefault(order["id"], {})
+                if action == "queued":
+                    entry["submitted"] = clock.now()
+                elif action == "running":
+                    entry["start"] = clock.now()
+                elif action in FINISHED:
+                    entry["end"] = clock.now()
+
+            server.order_queue.add_listener(on_order)
+            client = server.app.test_client()
+            workload = build_workload(server, client, args.rounds, args.synthetic, args.seed)
+
+            submitted = []
+            for label, endpoint, payload in workload:
+                response = client.post(endpoint, json=payload)
+                data = response.get_json() or {}
+                if response.status_code != 200 or data.get("status") != "success":
+                    print(f"Bestellung '{label}' abgelehnt: {data.get('message')}", file=sys.__stdout__)
+                    continue
+                submitted.append((label, endpoint, data["order_id"]))
+
+            server.order_queue.start()
+            deadline = time.time() + args.timeout
+            while time.time() < deadline:
+                states = [server.order_queue.get(order_id) for _, _, order_id in submitted]
+                if all(state and state["status"] in FINISHED for state in states):
+                    break
+                time.sleep(0.05)
+            else:
+                print(f"Zeitlimit von {args.timeout} s überschritten.", file=sys.__stdout__)
+            emulator.stop()
+    finally:
+        os.chdir(previous_cwd)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    # Wartezeiten des Hosts (Einzelschritt-Modus) zählen als Warten
+    intervals = list(emulator.activity)
+    intervals += [("wait", s, e) for name, s, e in virtual.sleeps if name != "esp-emulator"]
+
+    drinks = []
+    for label, endpoint, order_id in submitted:
+        order = server.order_queue.get(order_id) or {}
+        times = orders.get(order_id, {})
+        start, end = times.get("start"), times.get("end")
+        drink = {
+            "id": order_id,
+            "label": label,
+            "endpoint": endpoint,
+            "status": order.get("status"),
+            "error": order.get("error"),
+            "est_s": round(order.get("est_ms", 0) / 1000, 3),
+            "start_s": start,
+            "end_s": end,
+            "latency_s": round(end - start, 3) if start is not None and end is not None else None,
+            "turnaround_s": round(end - times["submitted"], 3) if end is not None and "submitted" in times else None,
+            "breakdown_s": breakdown(start, end, intervals) if start is not None and end is not None else None,
+        }
+        drinks.append(drink)
+
+    return {
+        "version": RESULT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "settings": {"mode": args.mode, "policy": args.policy, "rounds": args.rounds,
+                     "synthetic": args.synthetic, "seed": args.seed,
+                     "config": "benchmark" if not args.config else os.path.abspath(args.config)},
+        "emulator": dict(emulator.stats),
+        "summary": summarize(drinks),
+        "drinks": normalize_times(drinks),
+    }
+
+
+def normalize_times(drinks):
+    """Zeitpunkte relativ zum Beginn des ersten Drinks."""
+    starts = [d["start_s"] for d in drinks if d["start_s"] is not None]
+    origin = min(starts) if starts else 0.0
+    for drink in drinks:
+        for key in ("start_s", "end_s"):
+            if drink[key] is not None:
+                drink[key] = round(drink[key] - origin, 3)
+    return drinks
+
+
+def summarize(drinks):
+    done = sorted((d for d in drinks if d["status"] == "done" and d["latency_s"] is not None),
+                  key=lambda d: d["start_s"])
+    latencies = [d["latency_s"] for d in done]
+    gaps = [max(0.0, b["start_s"] - a["end_s"]) for a, b in zip(done, done[1:])]
+    makespan = done[-1]["end_s"] - done[0]["start_s"] if done else 0.0
+    totals = dict.fromkeys(BREAKDOWN_KEYS, 0.0)
+    for drink in done:
+        for key, value in drink["breakdown_s"].items():
+            totals[key] += value
+    busy = sum(totals.values())
+    errors = [(d["latency_s"] - d["est_s"]) / d["est_s"] for d in done if d["est_s"] > 0]
+    return {
+        "drinks": len(done),
+        "failed": len(drinks) - len(done),
+        "makespan_s": round(makespan, 3),
+        "drinks_per_hour": round(len(done) / makespan * 3600, 2) if makespan > 0 else None,
+        "latency_s": {
+            "mean": round(sum(latencies) / len(latencies), 3) if latencies else None,
+            "p50": percentile(latencies, 0.5),
+            "p95": percentile(latencies, 0.95),
+            "max": max(latencies) if latencies else None,
+        },
+        "idle_gap_s": {
+            "mean": round(sum(gaps) / len(gaps), 4) if gaps else 0.0,
+            "max": round(max(gaps), 4) if gaps else 0.0,
+            "total": round(sum(gaps), 4),
+        },
+        "breakdown_s": {key: round(value, 3) for key, value in totals.items()},
+        "breakdown_share": {key: round(value / busy, 4) if busy else 0.0 for key, value in totals.items()},
+        "estimate_error": round(sum(errors) / len(errors), 4) if errors else None,
+    }
+
+
+def print_report(result):
+    summary = result["summary"]
+    latency = summary["latency_s"]
+    print(f"Benchmark ({result['settings']['mode']}, Commit {result['commit'] or '?'}): "
+          f"{summary['drinks']} Drinks, {summary['failed']} fehlgeschlagen, "
+          f"{summary['makespan_s']:.1f} s virtuell -> {summary['drinks_per_hour']} Drinks/h")
+    if latency["mean"] is not None:
+        print(f"Dauer pro Drink: Ø {latency['mean']:.1f} s, p50 {latency['p50']:.1f} s, "
+              f"p95 {latency['p95']:.1f} s, max {latency['max']:.1f} s")
+    print(f"Leerlauf zwischen Drinks: Ø {summary['idle_gap_s']['mean'] * 1000:.1f} ms, "
+          f"max {summary['idle_gap_s']['max'] * 1000:.1f} ms")
+    labels = {"travel": "Fahrt", "pour": "Ausschenken", "pump": "Pumpen", "wait": "Warten", "host": "Host"}
+    print("Aufteilung: " + " | ".join(f"{labels[key]} {summary['breakdown_share'][key] * 100:.1f} %"
+                                      for key in BREAKDOWN_KEYS))
+    if summary["estimate_error"] is not None:
+        print(f"Abweichung von der Schätzung: {summary['estimate_error'] * 100:+.1f} %")
+
+
+def compare(result, baseline_path, max_regression):
+    """Vergleicht mit einem früheren Lauf; liefert False bei zu großem Rückschritt."""
+    with open(baseline_path) as file:
+        baseline = json.load(file)
+    old, new = baseline["summary"], result["summary"]
+    rows = [
+        ("Drinks/h", old["drinks_per_hour"], new["drinks_per_hour"]),
+        ("Ø Dauer (s)", old["latency_s"]["mean"], new["latency_s"]["mean"]),
+        ("p95 Dauer (s)", old["latency_s"]["p95"], new["latency_s"]["p95"]),
+        ("Ø Leerlauf (s)", old["idle_gap_s"]["mean"], new["idle_gap_s"]["mean"]),
+    ]
+    print(f"Vergleich mit {baseline_path} (Commit {baseline.get('commit') or '?'}):")
+    for name, before, after in rows:
+        if before is None or after is None:
+            continue
+        delta = (after - before) / before * 100 if before else 0.0
+        print(f"  {name:<15} {before:>10.3f} -> {after:>10.3f} ({delta:+.1f} %)")
+
+    if max_regression is None or not old["drinks_per_hour"] or not new["drinks_per_hour"]:
+        return True
+    drop = (old["drinks_per_hour"] - new["drinks_per_hour"]) / old["drinks_per_hour"] * 100
+    if drop > max_regression:
+        print(f"Rückschritt: {drop:.1f} % weniger Drinks/h (erlaubt {max_regression} %).")
+        return False
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Drinks-pro-Stunde-Benchmark gegen einen emulierten ESP.")
+    parser.add_argument("--output", default="benchmark_results.json", help="Ergebnisdatei (JSON)")
+    parser.add_argument("--compare", help="Früheres Ergebnis zum Vergleich")
+    parser.add_argument("--max-regression", type=float, help="Exit-Code 1 bei mehr Prozent Rückgang der Drinks/h")
+    parser.add_argument("--recipes", default=os.path.join(BASE_DIR, "Rezepte"), help="Ordner mit Rezepten")
+    parser.add_argument("--config", help="Eigene config.json statt der Benchmark-Konfiguration")
+    parser.add_argument("--mode", choices=("batch", "steps"), default="batch", help="Batch- oder Einzelschritt-Modus")
+    parser.add_argument("--policy", choices=("fifo", "sjf"), default="fifo", help="Warteschlangen-Strategie")
+    parser.add_argument("--rounds", type=int, default=1, help="Wie oft die Rezeptbibliothek bestellt wird")
+    parser.add_argument("--synthetic", type=int, default=20, help="Anzahl zufälliger Rezepte")
+    parser.add_argument("--seed", type=int, default=1, help="Startwert für die zufälligen Rezepte")
+    parser.add_argument("--timeout", type=float, default=600, help="Echtzeit-Limit in s")
+    parser.add_argument("--keep", action="store_true", help="Arbeitsordner nicht löschen")
+    parser.add_argument("--verbose", action="store_true", help="Ausgaben des Servers anzeigen")
+    args = parser.parse_args(argv)
+
+    output = os.path.abspath(args.output)
+    result = run(args)
+    with open(output, "w") as file:
+        json.dump(result, file, indent=4)
+    print_report(result)
+    print(f"Ergebnis gespeichert in {output}")
+
+    if args.compare and not compare(result, args.compare, args.max_regression):
+        return 1
+    return 0 if result["summary"]["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""
+Startablauf des Servers.
+
+Die Bar-Oberfläche kommt zuerst hoch; alles andere (ESP-Suche, WLAN-Prüfung,
+Hotspot und WLAN-Portal) läuft parallel als verwaltete Dienste: Threads für
+Aufgaben im Prozess, Popen-Prozesse für externe Programme. Meilensteine und
+die Zeit bis zur ersten Anfrage werden ab Prozessstart gemessen und geloggt.
+"""
+import os
+import time
+import atexit
+import subprocess
+from threading import Lock, Thread
+
+import logs
+
+log = logs.get("boot")
+
+
+def process_start_time():
+    """Startzeitpunkt dieses Prozesses (Linux: aus /proc), sonst jetzt."""
+    try:
+        with open("/proc/self/stat") as file:
+            fields = file.read().rsplit(")", 1)[1].split()
+        start_ticks = int(fields[19])  # Feld 22 (starttime), gezählt ab Feld 3
+        with open("/proc/uptime") as file:
+            uptime = float(file.read().split()[0])
+        return time.time() - uptime + start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+
+class BootOrchestrator:
+    def __init__(self):
+        self.started = process_start_time()
+        self._lock = Lock()
+        self._milestones = {}
+        self._services = {}
+        self._processes = {}
+        self._first_request = None
+        atexit.register(self.stop_processes)
+
+    # ------------------------------------------------------------ Meilensteine
+
+    def mark(self, name):
+        """Meilenstein mit Zeit seit Prozessstart festhalten (nur beim ersten Mal)."""
+        elapsed = time.time() - self.started
+        with self._lock:
+            if name in self._milestones:
+                return
+            self._milestones[name] = round(elapsed, 3)
+        log.info("%s nach %.2f s", name, elapsed)
+
+    def first_request(self, path):
+        """Für before_request: misst die Zeit bis zur ersten beantworteten Anfrage."""
+        if self._first_request is not None:
+            return
+        with self._lock:
+            if self._first_request is not None:
+                return
+            self._first_request = path
+        self.mark("first_request")
+
+    # ---------------------------------------------------------------- Dienste
+
+    def start(self, name, target, *args):
+        """Führt target in einem eigenen Thread aus; Dauer und Fehler werden erfasst."""
+        with self._lock:
+            self._services[name] = {"state": "starting", "started": time.time(), "duration": None, "error": None}
+
+        def run():
+            try:
+                target(*args)
+                state, error = "ready", None
+            except Exception as e:
+                log.error("Dienst '%s' fehlgeschlagen: %s", name, e)
+                state, error = "failed", str(e)
+            with self._lock:
+                service = self._services[name]
+                service.update(state=state, error=error, duration=round(time.time() - service["started"], 3))
+            if state == "ready":
+                self.mark(name)
+
+        Thread(target=run, name=f"boot-{name}", daemon=True).start()
+
+    def spawn(self, name, command):
+        """Startet ein externes Programm als verwalteten Prozess (blockiert nicht)."""
+        with self._lock:
+            existing = self._processes.get(name)
+            if existing is not None and existing.poll() is None:
+                return existing
+        process = subprocess.Popen(command)
+        with self._lock:
+            self._processes[name] = process
+        log.info("Prozess '%s' gestartet (PID %s).", name, process.pid)
+
+        def watch():
+            code = process.wait()
+            log.info("Prozess '%s' beendet (Code %s).", name, code)
+
+        Thread(target=watch, name=f"watch-{name}", daemon=True).start()
+        return process
+
+    def stop_processes(self):
+        with self._lock:
+            processes = list(self._processes.items())
+        for name, process in processes:
+            if process.poll() is None:
+                log.info("Beende Prozess '%s'.", name)
+                process.terminate()
+                try:
+                    process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+    def status(self):
+        with self._lock:
+            return {
+                "uptime_s": round(time.time() - self.started, 1),
+                "milestones": dict(self._milestones),
+                "services": {name: dict(service) for name, service in self._services.items()},
+                "processes": {name: {"pid": p.pid, "running": p.poll() is None, "returncode": p.returncode}
+                              for name, p in self._processes.items()},
+            }
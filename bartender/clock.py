@@ -0,0 +1,106 @@
+"""
+Zeitquelle für die Rezeptausführung.
+
+Im Betrieb ist das die echte Uhr. Emulator und Benchmark setzen mit install()
+eine andere ein:
+- ScaledClock: Zeitraffer, alle Wartezeiten um einen Faktor verkürzt,
+- VirtualClock: Wartezeiten vergehen sofort und werden nur aufaddiert,
+  Rechenzeit läuft in Echtzeit weiter. Fahr-, Servo- und Wartezeiten sind
+  damit exakt die simulierten, der Aufwand des Hosts bleibt echt.
+
+Nur Wartezeiten, die zur Ausführung gehören, laufen über dieses Modul;
+Timeouts, Heartbeats und Zeitstempel für Logs bleiben in Echtzeit.
+"""
+import time
+from collections import deque
+from threading import Lock, current_thread
+
+
+class RealClock:
+    def now(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+
+class ScaledClock:
+    """Simulationszeit in s; scale > 1 lässt die Zeit schneller laufen."""
+
+    def __init__(self, scale=1.0):
+        self.scale = float(scale)
+        self._origin = time.monotonic()
+
+    def now(self):
+        return (time.monotonic() - self._origin) * self.scale
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds / self.scale)
+
+
+class VirtualClock:
+    """
+    Überspringt Wartezeiten; merkt sich jede (Thread, Beginn, Ende) für Auswertungen.
+
+    Vor jedem Sprung wartet die Uhr (höchstens SETTLE_TIMEOUT_S echt), bis alle
+    mit add_settle() registrierten Prüfungen True liefern, z.B. bis der Host
+    eine gerade gesendete Zeile verarbeitet hat. Sonst bekäme sie einen
+    Zeitstempel nach dem Sprung.
+    """
+    SETTLE_TIMEOUT_S = 0.05
+
+    def __init__(self, history=100000):
+        self._origin = time.monotonic()
+        self._skipped = 0.0
+        self._lock = Lock()
+        self._settle = []
+        self.sleeps = deque(maxlen=history)
+
+    def add_settle(self, callback):
+        self._settle.append(callback)
+
+    def now(self):
+        with self._lock:
+            return time.monotonic() - self._origin + self._skipped
+
+    def sleep(self, seconds):
+        if seconds <= 0:
+            return
+        self._wait_settled()
+        with self._lock:
+            start = time.monotonic() - self._origin + self._skipped
+            self._skipped += seconds
+            self.sleeps.append((current_thread().name, start, start + seconds))
+        # Anderen Threads (z.B. dem Leser) Gelegenheit geben, weiterzuarbeiten
+        time.sleep(0)
+
+    def _wait_settled(self):
+        deadline = time.monotonic() + self.SETTLE_TIMEOUT_S
+        while not all(check() for check in self._settle):
+            if time.monotonic() >= deadline:
+                return
+            time.sleep(0.0001)
+
+
+_clock = RealClock()
+
+
+def install(clock):
+    """Setzt die Uhr für now()/sleep() und liefert die bisherige zurück."""
+    global _clock
+    previous, _clock = _clock, clock
+    return previous
+
+
+def current():
+    return _clock
+
+
+def now():
+    return _clock.now()
+
+
+def sleep(seconds):
+    _clock.sleep(seconds)
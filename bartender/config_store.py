@@ -0,0 +1,197 @@
+"""
+Prozessweiter Speicher für config.json.
+
+Lesezugriffe kommen aus dem Speicher. Schreibzugriffe werden kurz gesammelt
+(Debounce) und dann atomar über eine temporäre Datei + rename geschrieben, damit
+ein Absturz mitten im Schreiben keine leere Konfiguration hinterlässt. Externe
+Änderungen an der Datei werden per Polling erkannt. Abonnenten erfahren, welche
+Schlüssel sich geändert haben.
+"""
+import os
+import copy
+import json
+import time
+import atexit
+from threading import Lock, Thread, Timer
+
+import logs
+from atomic_file import atomic_write_json
+
+log = logs.get("config_store")
+
+
+class ConfigStore:
+    def __init__(self, path, protected_keys=(), debounce=0.5, poll_interval=2.0):
+        self.path = path
+        self.protected_keys = list(protected_keys)
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+
+        self._lock = Lock()
+        self._write_lock = Lock()
+        self._config = {}
+        self._version = 0
+        self._stamp = None  # (mtime_ns, size) der zuletzt gelesenen/geschriebenen Datei
+        self._dirty = False
+        self._timer = None
+        self._subscribers = []
+        self._watcher = None
+
+        self._config = self._read_file() or {}
+        atexit.register(self.flush)
+
+    # ------------------------------------------------------------------ Lesen
+
+    def get(self):
+        """Kopie der aktuellen Konfiguration (ohne Dateizugriff)."""
+        with self._lock:
+            return copy.deepcopy(self._config)
+
+    def snapshot(self):
+        """(Version, Kopie der Konfiguration) als konsistentes Paar."""
+        with self._lock:
+            return self._version, copy.deepcopy(self._config)
+
+    @property
+    def version(self):
+        return self._version
+
+    # ------------------------------------------------------------- Schreiben
+
+    def save(self, new_config):
+        """Ersetzt die Konfiguration; geschützte Schlüssel bleiben erhalten."""
+        new_config = copy.deepcopy(new_config)
+        with self._lock:
+            for key in self.protected_keys:
+                if key in self._config and key not in new_config:
+                    new_config[key] = self._config[key]
+            old = self._config
+            changed = self._diff(old, new_config)
+            if not changed:
+                return set()
+            self._config = new_config
+            self._version += 1
+            self._dirty = True
+            self._schedule_flush()
+        self._notify(changed, old, new_config)
+        return changed
+
+    def update(self, changes):
+        """Ändert nur die übergebenen Schlüssel."""
+        with self._lock:
+            merged = copy.deepcopy(self._config)
+        merged.update(changes)
+        return self.save(merged)
+
+    def flush(self):
+        """Schreibt ausstehende Änderungen sofort."""
+        with self._write_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return
+                data = copy.deepcopy(self._config)
+                self._dirty = False
+            try:
+                self._write_file(data)
+                log.info("Konfiguration erfolgreich gespeichert.")
+            except Exception as e:
+                log.error("Fehler beim Speichern der Konfigurationsdatei: %s", e)
+                with self._lock:
+                    self._dirty = True
+
+    # ------------------------------------------------------------ Abonnenten
+
+    def subscribe(self, callback):
+        """callback(changed_keys, old_config, new_config) bei jeder Änderung."""
+        self._subscribers.append(callback)
+
+    def _notify(self, changed, old, new):
+        for callback in list(self._subscribers):
+            try:
+                callback(changed, old, new)
+            except Exception as e:
+                log.error("Fehler in Konfigurations-Abonnent: %s", e)
+
+    # ------------------------------------------------------- Dateiüberwachung
+
+    def start_watching(self):
+        if self._watcher is None:
+            self._watcher = Thread(target=self._watch, daemon=True)
+            self._watcher.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                stamp = self._file_stamp()
+                with self._lock:
+                    external = stamp is not None and stamp != self._stamp and not self._dirty
+                if external:
+                    self.reload()
+            except Exception as e:
+                log.error("Fehler beim Überwachen der Konfigurationsdatei: %s", e)
+
+    def reload(self):
+        """
+        Liest die Datei neu ein (z.B. nach externer Bearbeitung). Ist sie
+        (noch) kein gültiges JSON, etwa mitten im Speichern eines Editors,
+        bleibt die bisherige Konfiguration bestehen.
+        """
+        data = self._read_file()
+        if data is None:
+            return set()
+        with self._lock:
+            old = self._config
+            changed = self._diff(old, data)
+            if not changed:
+                return set()
+            self._config = data
+            self._version += 1
+        log.info("Konfiguration extern geändert: %s", ', '.join(sorted(changed)))
+        self._notify(changed, old, data)
+        return changed
+
+    # --------------------------------------------------------------- Intern
+
+    @staticmethod
+    def _diff(old, new):
+        keys = set(old) | set(new)
+        return {key for key in keys if old.get(key) != new.get(key) or (key in old) != (key in new)}
+
+    def _schedule_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = Timer(self.debounce, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _read_file(self):
+        """Inhalt der Datei; {} wenn sie fehlt, None wenn sie kein gültiges JSON enthält."""
+        try:
+            with open(self.path, "r") as file:
+                data = json.load(file)
+            self._stamp = self._file_stamp()
+            return data
+        except FileNotFoundError:
+            log.warning("Konfigurationsdatei '%s' nicht gefunden! Erstelle eine neue.", self.path)
+            return {}
+        except json.JSONDecodeError as e:
+            log.error("Fehler beim Lesen der Konfigurationsdatei: %s (bisherige Konfiguration bleibt)", e)
+            # Erst die nächste Änderung der Datei wieder einlesen
+            self._stamp = self._file_stamp()
+            return None
+
+    def _write_file(self, data):
+        atomic_write_json(self.path, data)
+        with self._lock:
+            self._stamp = self._file_stamp()
@@ -0,0 +1,128 @@
+"""
+Portionierer-Profile pro Flasche und zeitoptimale Aufteilung in Portionen.
+
+Ein Profil steht unter "dispensers" in der Konfiguration, z.B.
+    "dispensers": {"rum": {"capacity_cl": 4, "refill_ms": 8000}}
+Fehlende Felder kommen aus den globalen Einstellungen:
+- capacity_cl: größte Portion pro Servo-Hub (Standard 2 cl),
+- refill_ms:   Nachfüllzeit einer vollen Kammer (refill_wait),
+- ms_per_cl:   Servo-Haltezeit pro cl (pour_time / 2),
+- drip_ms:     Abtropfzeit nach der letzten Portion (drip_wait).
+
+Standardmäßig dauert jedes Nachfüllen refill_ms. Mit "proportional_refill":
+true in der Konfiguration läuft die Kammer nur so weit nach, wie entnommen
+wurde: nach einer Portion von c cl dauert das Nachfüllen refill_ms * c /
+capacity_cl. Dann ist es schneller, eine Restmenge zuerst und volle Portionen
+zuletzt auszuschenken. Das gilt auch für "wait refill_wait" in
+handgeschriebenen Rezepten, darum ist es nicht voreingestellt. chunk() sucht
+die Aufteilung mit der kürzesten Gesamtzeit per dynamischer Programmierung auf
+einem Raster von RESOLUTION_CL.
+"""
+import math
+from collections import namedtuple
+
+from estimator import COMMAND_OVERHEAD_MS, SERVO_OVERHEAD_MS
+
+DEFAULT_CAPACITY_CL = 2
+RESOLUTION_CL = 0.1
+
+Dispenser = namedtuple("Dispenser", "capacity_cl refill_ms ms_per_cl drip_ms")
+
+
+def profile(config, bottle):
+    """Profil einer Flasche, ergänzt um die globalen Einstellungen."""
+    defaults = {
+        "capacity_cl": DEFAULT_CAPACITY_CL,
+        "refill_ms": config.get("refill_wait", 5000),
+        "ms_per_cl": config.get("pour_time", 2000) / 2,
+        "drip_ms": config.get("drip_wait", 1000),
+    }
+    own = (config.get("dispensers") or {}).get(bottle) or {}
+    return Dispenser(**{key: own.get(key, value) for key, value in defaults.items()})
+
+
+def validate(values):
+    """Prüft ein (Teil-)Profil aus einer Anfrage; liefert (Profil, Fehlermeldung)."""
+    if not isinstance(values, dict):
+        return None, "Ungültiges Profil."
+    result = {}
+    for key, value in values.items():
+        if key not in Dispenser._fields:
+            return None, f"Unbekanntes Feld: {key}"
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return None, f"Ungültiger Wert für {key}: {value}"
+        if value < 0 or (key == "capacity_cl" and value < RESOLUTION_CL):
+            return None, f"Ungültiger Wert für {key}: {value}"
+        result[key] = value if key == "capacity_cl" else int(value)
+    return result, None
+
+
+def proportional(config):
+    return bool(config.get("proportional_refill", False))
+
+
+def refill_ms(dispenser, cl, proportional=False):
+    """Nachfüllzeit nach einer Portion von cl (ohne proportional immer die volle Nachfüllzeit)."""
+    if not proportional:
+        return int(dispenser.refill_ms)
+    return int(dispenser.refill_ms * min(1.0, cl / dispenser.capacity_cl))
+
+
+def chunk(volume_cl, dispenser, proportional=False):
+    """
+    Aufteilung von volume_cl in Portionen (cl, in Ausschankreihenfolge) mit
+    minimaler Gesamtzeit aus Hüben, Nachfüllpausen und Abtropfzeit. Bei
+    Gleichstand gewinnt die Aufteilung mit weniger Portionen.
+    """
+    # Aufrunden: der Ausgleich am Ende verkleinert höchstens eine Portion
+    units = int(math.ceil(volume_cl / RESOLUTION_CL - 1e-9))
+    capacity = max(1, int(math.floor(dispenser.capacity_cl / RESOLUTION_CL + 1e-9)))
+    if units <= 0:
+        return []
+
+    def cost(cl, last):
+        # Ohne Abschneiden auf ganze ms, sonst entscheiden Rundungsreste
+        if last:
+            pause = dispenser.drip_ms
+        elif proportional:
+            pause = dispenser.refill_ms * min(1.0, cl / dispenser.capacity_cl)
+        else:
+            pause = dispenser.refill_ms
+        return COMMAND_OVERHEAD_MS + SERVO_OVERHEAD_MS + cl * dispenser.ms_per_cl + pause
+
+    # best[r] = (Zeit, Portionen, erste Portion) für noch r Raster-Einheiten; bei
+    # Gleichstand die kleinere erste Portion, also Rest zuerst, volle Portionen danach
+    best = [None] * (units + 1)
+    for remaining in range(1, units + 1):
+        for size in range(1, min(capacity, remaining) + 1):
+            cl = size * RESOLUTION_CL
+            if size == remaining:
+                candidate = (round(cost(cl, True), 6), 1, size)
+            else:
+                rest = best[remaining - size]
+                candidate = (round(cost(cl, False) + rest[0], 6), rest[1] + 1, size)
+            if best[remaining] is None or candidate < best[remaining]:
+                best[remaining] = candidate
+
+    sizes = []
+    remaining = units
+    while remaining:
+        sizes.append(best[remaining][2])
+        remaining -= best[remaining][2]
+    portions = [round(size * RESOLUTION_CL, 3) for size in sizes]
+    # Rundung auf das Raster in der ersten Portion ausgleichen
+    portions[0] = round(portions[0] + volume_cl - units * RESOLUTION_CL, 3)
+    return portions
+
+
+def recipe_lines(volume_cl, dispenser, proportional=False):
+    """Rezeptzeilen für eine Zutat ab der Flasche: Portionen, Nachfüll- und Abtropfzeit."""
+    lines = []
+    for portion in chunk(volume_cl, dispenser, proportional):
+        lines.append(f"servo cl {portion:g}")
+        lines.append("wait refill_wait")
+    if lines:
+        lines[-1] = "wait drip_wait"
+    return lines
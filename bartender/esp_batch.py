@@ -0,0 +1,108 @@
+"""
+Batch-Modus: ein kompletter Plan wird als eine JSON-Nachricht an den ESP
+geschickt und dort ohne Roundtrips zwischen den Schritten ausgeführt.
+
+Format (eine Zeile):
+    {"command": "batch", "id": 7, "count": 4,
+     "steps": [["m", 300], ["s", 1000], ["p", 1, 2000], ["w", 500]]}
+
+m = Fahrt in mm, s = Servo-Verzögerung in ms, p = Pumpe starten (nicht
+blockierend), w = Warten in ms. Vor jedem Schritt sendet der ESP
+{"event": "step", "id": 7, "index": i, "total": n}, am Ende die normale Antwort.
+"""
+
+# Obergrenze pro Nachricht, passend zum JSON-Puffer der Firmware
+MAX_BATCH_STEPS = 64
+BATCH_TIMEOUT_FACTOR = 1.5
+BATCH_TIMEOUT_MARGIN_MS = 5000
+
+
+def encode_steps(steps):
+    """
+    Übersetzt Planschritte in Batch-Schritte. Liefert (wire_steps, index_map),
+    wobei index_map[i] der Planindex des i-ten Batch-Schritts ist.
+    """
+    wire = []
+    index_map = []
+    for idx, step in enumerate(steps):
+        if step.kind == "move":
+            wire.append(["m", int(step.position)])
+            index_map.append(idx)
+        elif step.kind == "servo":
+            wire.append(["s", int(step.duration)])
+            index_map.append(idx)
+        elif step.kind == "pump":
+            # Pumpe läuft auf dem ESP nicht blockierend: Laufzeit + Abtropfzeit abwarten
+            wire.append(["p", int(step.pump), int(step.duration)])
+            wire.append(["w", int(step.duration + step.drip)])
+            index_map.extend((idx, idx))
+        elif step.kind == "pumps":
+            # Alle Pumpen der Station starten, dann auf die längste warten
+            for pump_number, duration in step.pump:
+                wire.append(["p", int(pump_number), int(duration)])
+                index_map.append(idx)
+            wire.append(["w", int(step.duration + step.drip)])
+            index_map.append(idx)
+        elif step.kind == "wait":
+            wire.append(["w", int(step.duration)])
+            index_map.append(idx)
+    return wire, index_map
+
+
+def wire_ms(index_map, step_ms):
+    """
+    Geschätzte Dauer je Batch-Schritt. Ein Planschritt aus mehreren
+    Batch-Schritten (Pumpe starten, dann warten) zählt nur bei seinem letzten,
+    damit er bei einer Aufteilung auf zwei Nachrichten nicht doppelt zählt.
+    """
+    return [step_ms[idx] if k + 1 == len(index_map) or index_map[k + 1] != idx else 0
+            for k, idx in enumerate(index_map)]
+
+
+def split_batches(wire, index_map, limit=MAX_BATCH_STEPS):
+    """Teilt lange Pläne in mehrere Nachrichten auf."""
+    for start in range(0, len(wire), limit):
+        yield wire[start:start + limit], index_map[start:start + limit]
+
+
+def run_batch(transport, steps, step_ms, on_step=None, limit=MAX_BATCH_STEPS):
+    """
+    Führt Planschritte im Batch-Modus aus. on_step(plan_index) wird bei jedem
+    Fortschrittsereignis des ESP aufgerufen. Liefert (erfolgreich, Meldung,
+    gestartet); ist gestartet False, wurde noch kein Schritt ausgeführt und der
+    Aufrufer kann gefahrlos auf den Einzelschritt-Modus zurückfallen.
+    limit: höchstens so viele Batch-Schritte pro Nachricht.
+    """
+    wire, index_map = encode_steps(steps)
+    costs = wire_ms(index_map, step_ms)
+    started = False
+    offset = 0
+    for chunk, chunk_map in split_batches(wire, index_map, limit):
+        expected_ms = sum(costs[offset:offset + len(chunk)])
+        offset += len(chunk)
+        timeout = (expected_ms * BATCH_TIMEOUT_FACTOR + BATCH_TIMEOUT_MARGIN_MS) / 1000.0
+        command = {"command": "batch", "count": len(chunk), "steps": chunk}
+
+        def on_event(event):
+            nonlocal started
+            index = event.get("index", 0)
+            if event.get("event") != "step":
+                return
+            started = True
+            if on_step is not None and 0 <= index < len(chunk_map):
+                on_step(chunk_map[index])
+
+        future, timeout = transport.request(command, timeout, on_event=on_event)
+        try:
+            resp = future.result(timeout=timeout)
+        except Exception:
+            return False, "Keine Antwort vom ESP (Batch)", started
+
+        if resp.get("status") != "success":
+            return False, resp.get("message", "Batch fehlgeschlagen"), started
+
+        started = True
+        moves = [s for s in chunk if s[0] == "m"]
+        if moves:
+            transport.last_position = moves[-1][1]
+    return True, "Batch abgeschlossen", started
@@ -0,0 +1,217 @@
+"""
+Verbindungsaufbau zum ESP im Hintergrund.
+
+Statt fester Wartezeiten beobachtet ein Thread die Liste der seriellen Ports:
+- taucht ein Gerät auf (Hotplug), wird sofort verbunden,
+- schlägt das Öffnen fehl, wird mit exponentiell wachsendem Abstand erneut
+  versucht (jede Änderung der Portliste setzt den Abstand zurück),
+- verschwindet der verbundene Port, wird die Verbindung getrennt.
+
+USB-Kennung (VID/PID/Seriennummer) des zuletzt erfolgreich verbundenen ESP
+wird in esp_device.json gespeichert, damit spätere Starts ihn direkt finden.
+Mit der Umgebungsvariable BARBOT_ESP_PORT lässt sich der Port fest vorgeben.
+"""
+import os
+import json
+import time
+from threading import Event, Lock, Thread
+
+import serial
+import serial.tools.list_ports
+
+import logs
+from atomic_file import atomic_write_json
+
+log = logs.get("esp_connector")
+
+PORT_ENV = "BARBOT_ESP_PORT"
+POLL_INTERVAL_S = 1.0
+BACKOFF_START_S = 1.0
+BACKOFF_MAX_S = 60.0
+
+# Übliche USB-Seriell-Wandler auf ESP32-Boards (CP210x, CH340, FTDI)
+KNOWN_VIDS = {0x10C4, 0x1A86, 0x0403}
+
+
+class EspConnector:
+    def __init__(self, transport, baudrate, device_file="esp_device.json", on_connect=None):
+        """on_connect(port) wird nach jedem erfolgreichen Öffnen aufgerufen."""
+        self.transport = transport
+        self.baudrate = baudrate
+        self.device_file = device_file
+        self.on_connect = on_connect
+        self._lock = Lock()
+        self._wakeup = Event()
+        self._thread = None
+        self._port = None
+        self._known = self._load_device()
+        self._state = "idle"
+        self._attempts = 0
+        self._next_attempt = None
+        self._last_ports = None
+
+    # ------------------------------------------------------------ Abfrage
+
+    def status(self):
+        with self._lock:
+            next_in = None
+            if self._next_attempt is not None:
+                next_in = max(0.0, round(self._next_attempt - time.time(), 1))
+            return {
+                "state": self._state,
+                "port": self._port,
+                "attempts": self._attempts,
+                "next_attempt_in": next_in,
+                "known_device": dict(self._known) if self._known else None,
+            }
+
+    def find_port(self, ports=None):
+        """Bester Kandidat: Umgebungsvariable, gemerktes Gerät, dann bekannte Wandler."""
+        override = os.environ.get(PORT_ENV)
+        if override:
+            return override
+        if ports is None:
+            ports = serial.tools.list_ports.comports()
+
+        known = self._known
+        if known:
+            for port in ports:
+                if (port.vid == known.get("vid") and port.pid == known.get("pid")
+                        and (not known.get("serial_number") or port.serial_number == known.get("serial_number"))):
+                    return port.device
+
+        for port in ports:
+            manufacturer = port.manufacturer or "Unbekannt"
+            product = port.product or "Unbekannt"
+            log.debug("Prüfe Port: %s - Hersteller: %s - Produkt: %s", port.device, manufacturer, product)
+            if port.vid in KNOWN_VIDS or port.device.startswith(("/dev/ttyUSB", "/dev/ttyACM")):
+                log.info("ESP (vermutet) an Port %s", port.device)
+                return port.device
+        return None
+
+    # ------------------------------------------------------------ Steuerung
+
+    def start(self):
+        if self._thread is None:
+            self._thread = Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def trigger(self, reconnect=False):
+        """Sofortigen Verbindungsversuch anstoßen (kehrt sofort zurück)."""
+        if reconnect and self.transport.connected:
+            self.transport.detach("Neuverbindung angefordert")
+        with self._lock:
+            self._next_attempt = None
+            self._attempts = 0
+        self._wakeup.set()
+
+    def remember(self, port_name=None):
+        """USB-Kennung des verbundenen Ports merken (nach bestätigter Antwort)."""
+        port_name = port_name or self._port
+        info = next((p for p in serial.tools.list_ports.comports() if p.device == port_name), None)
+        if info is None or info.vid is None:
+            return
+        device = {"vid": info.vid, "pid": info.pid, "serial_number": info.serial_number,
+                  "description": info.description, "port": info.device}
+        if device == self._known:
+            return
+        self._known = device
+        try:
+            self._save_device(device)
+            log.info("ESP-Gerät gemerkt: %s (%04x:%04x)", info.description, info.vid, info.pid)
+        except Exception as e:
+            log.error("Fehler beim Speichern der ESP-Kennung: %s", e)
+
+    # --------------------------------------------------------------- Intern
+
+    def _run(self):
+        backoff = BACKOFF_START_S
+        while True:
+            backoff, again = self._poll(backoff)
+            if not again:
+                self._wakeup.wait(POLL_INTERVAL_S)
+                self._wakeup.clear()
+
+    def _poll(self, backoff):
+        """Ein Durchlauf; liefert (neuer Abstand, sofort erneut prüfen)."""
+        ports = self._list_ports()
+        names = {p.device for p in ports}
+        hotplug = self._last_ports is not None and names != self._last_ports
+        self._last_ports = names
+
+        if self.transport.connected:
+            self._set_state("connected")
+            if self._port and self._port not in names and not os.environ.get(PORT_ENV):
+                log.warning("ESP-Port %s verschwunden.", self._port)
+                self.transport.detach("Gerät entfernt")
+                return BACKOFF_START_S, True
+            return BACKOFF_START_S, False
+
+        with self._lock:
+            due = self._next_attempt is None or time.time() >= self._next_attempt
+        if not (hotplug or due):
+            return backoff, False
+        if hotplug:
+            backoff = BACKOFF_START_S
+        if self._connect(ports):
+            return BACKOFF_START_S, True
+        with self._lock:
+            self._next_attempt = time.time() + backoff
+        return min(backoff * 2, BACKOFF_MAX_S), False
+
+    def _connect(self, ports):
+        with self._lock:
+            self._attempts += 1
+            attempt = self._attempts
+        port = self.find_port(ports)
+        if port is None:
+            self._set_state("searching")
+            log.info("Kein ESP gefunden, warte auf Gerät... (Versuch %s)", attempt)
+            return False
+
+        self._set_state("connecting")
+        try:
+            # Kurzer Lese-Timeout, damit der Leser-Thread regelmäßig aufwacht
+            self.transport.attach(serial.Serial(port, self.baudrate, timeout=0.2))
+        except (serial.SerialException, OSError) as e:
+            log.warning("ESP nicht verbunden: %s", e)
+            self.transport.detach(str(e))
+            self._set_state("waiting")
+            return False
+
+        log.info("ESP verbunden an %s", port)
+        with self._lock:
+            self._port = port
+            self._attempts = 0
+            self._next_attempt = None
+        self._set_state("connected")
+        if self.on_connect is not None:
+            try:
+                self.on_connect(port)
+            except Exception as e:
+                log.error("Fehler nach dem Verbinden: %s", e)
+        return True
+
+    def _list_ports(self):
+        try:
+            return serial.tools.list_ports.comports()
+        except Exception as e:
+            log.error("Fehler beim Auflisten der seriellen Ports: %s", e)
+            return []
+
+    def _set_state(self, state):
+        with self._lock:
+            self._state = state
+
+    def _load_device(self):
+        try:
+            with open(self.device_file, "r") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+        except (json.JSONDecodeError, OSError) as e:
+            log.error("Fehler beim Lesen von %s: %s", self.device_file, e)
+            return None
+
+    def _save_device(self, device):
+        atomic_write_json(self.device_file, device)
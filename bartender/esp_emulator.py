@@ -0,0 +1,546 @@
+"""
+Virtueller ESP32 hinter einem Pseudo-Terminal (pty).
+
+Bildet das serielle Protokoll von ESP23_V2.ino nach, damit server.py ohne die
+echte Bar getestet und vermessen werden kann:
+- move/servo/pump/status/batch mit denselben Antworten, ids und DEBUG-Zeilen,
+- nicht blockierende Pumpen-Timer ("Pumpe bereits aktiv"), die wie in der
+  Firmware nur während Fahrten, Wartezeiten und zwischen Befehlen geprüft
+  werden (während servoPour() blockiert delay()),
+- Fahrzeiten aus dem Trapezprofil von AccelStepper mit maxSpeed/acceleration
+  der Firmware und der kalibrierten Schienenlänge,
+- Fehlerinjektion: verlorene Zeilen, Verzögerungen, Verbindungsabbrüche.
+
+Start:
+    python esp_emulator.py --link /tmp/barbot-esp
+    BARBOT_ESP_PORT=/tmp/barbot-esp python server.py
+
+Die Verknüpfung (--link) zeigt immer auf das aktuelle pty und wird nach einem
+simulierten Abbruch neu gesetzt, so dass der Server wie beim Einstecken
+wieder verbindet. Mit --time-scale läuft die Zeit schneller (z.B. 10 = zehnfach).
+"""
+import os
+import sys
+import tty
+import json
+import time
+import queue
+import random
+import signal
+import argparse
+from collections import deque
+from threading import Lock, Thread
+
+from clock import ScaledClock
+from estimator import MOVE_MAX_SPEED, MOVE_ACCELERATION, MAX_MILLIMETERS, DEFAULT_STEPS_PER_MM
+
+# Werte aus ESP23_V2.ino
+CALIB_MAX_SPEED = 2600     # Schritte/s bei der Kalibrierung
+SERVO_SETTLE_MS = 180      # delay(180) vor und nach der Servo-Bewegung
+MAX_BATCH_STEPS = 64
+PUMP_COUNT = 4
+BAUDRATE = 115200
+# Wie oft loop() ohne Befehl die Pumpen-Timer prüft (Echtzeit)
+POLL_S = 0.01
+
+
+def move_time_s(distance_steps, max_speed=MOVE_MAX_SPEED, acceleration=MOVE_ACCELERATION):
+    """Dauer einer AccelStepper-Fahrt über distance_steps (Trapez- oder Dreiecksprofil)."""
+    distance = abs(distance_steps)
+    if distance == 0:
+        return 0.0
+    ramp_distance = max_speed ** 2 / (2 * acceleration)
+    if distance >= 2 * ramp_distance:
+        return distance / max_speed + max_speed / acceleration
+    return 2 * (distance / acceleration) ** 0.5
+
+
+def _as_int(value):
+    """Wie ArduinoJson as<int>(): Zahlen werden abgeschnitten, alles andere ist 0."""
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)):
+        return int(value)
+    return 0
+
+
+class EspEmulator:
+    def __init__(self, write, clock=None, rail_mm=MAX_MILLIMETERS, steps_per_mm=DEFAULT_STEPS_PER_MM,
+                 drop_rx=0.0, drop_tx=0.0, delay_ms=0, jitter_ms=0, calibrate=False, seed=None):
+        """
+        write(line) schickt eine Zeile (ohne Zeilenende) an den Host.
+        rail_mm * steps_per_mm ergibt maxSteps wie nach calibratePlatform().
+        drop_rx/drop_tx: Wahrscheinlichkeit, eine empfangene/gesendete Zeile zu
+        verlieren; delay_ms + zufällig bis jitter_ms: Verzögerung jeder Antwort.
+        """
+        self.write = write
+        self.clock = clock or ScaledClock()
+        self.max_steps = int(rail_mm * steps_per_mm)
+        self.drop_rx = drop_rx
+        self.drop_tx = drop_tx
+        self.delay_ms = delay_ms
+        self.jitter_ms = jitter_ms
+        self.calibrate = calibrate
+        self.random = random.Random(seed)
+
+        self.inbox = queue.Queue()
+        self.position = 0  # in Schritten
+        self.servo_angle = 90
+        self.pumps = [{"active": False, "start": 0, "duration": 0} for _ in range(PUMP_COUNT)]
+        self.stats = {"commands": 0, "dropped_rx": 0, "dropped_tx": 0, "boots": 0}
+        # (Art, Beginn, Ende) in Uhrzeit von clock: move, servo, pump, wait
+        self.activity = deque(maxlen=100000)
+        self._thread = None
+        self._running = False
+        # Der ESP hat nur einen Ablauf: setup() und Befehle schließen sich aus
+        self._cpu = Lock()
+
+    # ------------------------------------------------------------ Steuerung
+
+    def start(self):
+        if self._thread is None:
+            self._running = True
+            self._thread = Thread(target=self._loop, name="esp-emulator", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._running = False
+
+    def feed(self, line):
+        """Eine vom Host empfangene Zeile (ohne Zeilenende) in den Empfangspuffer legen."""
+        if self.drop_rx and self.random.random() < self.drop_rx:
+            self.stats["dropped_rx"] += 1
+            return
+        self.inbox.put(line)
+
+    def reset(self):
+        """Stromlos: Empfangspuffer, Pumpen und Servo zurücksetzen (Neustart folgt mit boot())."""
+        while not self.inbox.empty():
+            try:
+                self.inbox.get_nowait()
+            except queue.Empty:
+                break
+        for pump in self.pumps:
+            pump["active"] = False
+        self.servo_angle = 90
+
+    def boot(self):
+        """setup(): Meldungen, Kalibrierung und Fahrt in die Mitte der Schiene."""
+        with self._cpu:
+            self._setup()
+
+    def _setup(self):
+        self.stats["boots"] += 1
+        self.reset()
+        self._debug("ESP32 Initialisierung gestartet")
+        self._debug("Statische IP konfigurieren...")
+        self._debug("Statische IP erfolgreich konfiguriert.")
+        self._debug("WLAN verbunden! IP-Adresse: 192.168.2.236")
+        self._debug("OTA eingerichtet.")
+        if self.calibrate:
+            self._debug("Kalibrierung: Bewege zu Endschalter 1...")
+            self._debug("Treiber aktivieren...")
+            self.clock.sleep(self.position / CALIB_MAX_SPEED + 0.1)
+            self.position = 0
+            self._debug("Kalibrierung: Endschalter 1 erreicht. Position auf 0 gesetzt.")
+            self._debug("Kalibrierung: Bewege zu Endschalter 2...")
+            self.clock.sleep(self.max_steps / CALIB_MAX_SPEED + 0.1)
+            self.position = self.max_steps
+            self._debug(f"Kalibrierung abgeschlossen. Maximale Schritte: {self.max_steps}")
+            self._debug("Treiber deaktivieren...")
+            self._move_to_mm(MAX_MILLIMETERS // 2)
+        else:
+            self.position = self._mm_to_steps(MAX_MILLIMETERS // 2)
+        self._debug("Setup abgeschlossen.")
+
+    @property
+    def position_mm(self):
+        return self.position * MAX_MILLIMETERS / self.max_steps if self.max_steps else 0
+
+    # ------------------------------------------------------------ loop()
+
+    def _loop(self):
+        while self._running:
+            with self._cpu:
+                self._handle_pump_durations()
+            try:
+                line = self.inbox.get(timeout=POLL_S)
+            except queue.Empty:
+                continue
+            if not line:
+                continue
+            with self._cpu:
+                # Übertragungsdauer der Zeile bei 115200 Baud (10 Bit pro Byte)
+                self.clock.sleep(len(line) * 10 / BAUDRATE)
+                self._handle_pump_durations()
+                try:
+                    self.process(line)
+                except Exception as e:
+                    print(f"Fehler im ESP-Emulator: {e}")
+
+    def process(self, line):
+        """processSerialCommand(): genau ein Befehl, Antworten wie die Firmware."""
+        try:
+            doc = json.loads(line)
+        except ValueError:
+            self._debug("Ungültiges JSON ignoriert.")
+            return
+        if not isinstance(doc, dict):
+            return
+        cmd = doc.get("command")
+        if not isinstance(cmd, str):
+            return
+        cmd_id = _as_int(doc.get("id"))
+        self.stats["commands"] += 1
+
+        if cmd == "move":
+            target = _as_int(doc.get("position"))
+            self._debug(f"Bewegung zu {target} mm angefordert.")
+            self._move_to_mm(target)
+            self._respond("success", "Bewegung abgeschlossen", cmd_id)
+
+        elif cmd == "servo":
+            delay = _as_int(doc.get("delay"))
+            if delay < 0:
+                self._respond("error", "Ungültige Verzögerung", cmd_id)
+                return
+            self._servo_pour(delay)
+            self._respond("success", "Servo-Bewegung abgeschlossen", cmd_id)
+
+        elif cmd == "pump":
+            number = _as_int(doc.get("pump"))
+            duration = _as_int(doc.get("duration"))
+            if number < 1 or number > PUMP_COUNT or duration <= 0:
+                self._respond("error", "Ungültige Pumpennummer oder Dauer", cmd_id)
+                return
+            self._debug(f"Pumpe {number} wird für {duration} ms aktiviert.")
+            if self.pumps[number - 1]["active"]:
+                self._debug("Pumpe ist bereits aktiv, ignoriere Aktivierung.")
+                self._respond("error", "Pumpe bereits aktiv", cmd_id)
+                return
+            self._activate_pump(number, duration)
+            self._respond("success", "Pumpe aktiviert", cmd_id)
+
+        elif cmd == "status":
+            now = self._millis()
+            status = {"status": "online"}
+            if cmd_id:
+                status["id"] = cmd_id
+            status["pumps"] = [
+                {"pumpNumber": i + 1, "active": pump["active"],
+                 "remainingTime": max(0, pump["duration"] - (now - pump["start"])) if pump["active"] else 0}
+                for i, pump in enumerate(self.pumps)
+            ]
+            status["batch"] = True
+            status["maxBatch"] = MAX_BATCH_STEPS
+            self._send(json.dumps(status, separators=(",", ":")))
+
+        elif cmd == "batch":
+            self._run_batch(doc, cmd_id)
+
+    def _run_batch(self, doc, cmd_id):
+        steps = doc.get("steps")
+        count = doc.get("count", -1)
+        count = _as_int(count) if count is not None else -1
+        if not isinstance(steps, list) or count < 0 or count > MAX_BATCH_STEPS or len(steps) != count:
+            self._respond("error", "Ungültiger Batch", cmd_id)
+            return
+
+        self._debug(f"Batch mit {count} Schritten gestartet.")
+        for index, step in enumerate(steps):
+            step = step if isinstance(step, list) else []
+            kind = step[0] if step and isinstance(step[0], str) else None
+            self._send(json.dumps({"event": "step", "id": cmd_id, "index": index, "total": count},
+                                  separators=(",", ":")))
+            args = [_as_int(v) for v in step[1:]] + [0, 0]
+            if kind == "m":
+                self._move_to_mm(args[0])
+            elif kind == "s":
+                if args[0] >= 0:
+                    self._servo_pour(args[0])
+            elif kind == "p":
+                number, duration = args[0], args[1]
+                if number < 1 or number > PUMP_COUNT or duration <= 0:
+                    self._debug("Ungültiger Pumpenschritt im Batch.")
+                elif self.pumps[number - 1]["active"]:
+                    self._debug("Pumpe ist bereits aktiv, ignoriere Aktivierung.")
+                else:
+                    self._debug(f"Pumpe {number} wird für {duration} ms aktiviert.")
+                    self._activate_pump(number, duration)
+            elif kind == "w":
+                self._wait_with_pumps(max(0, args[0]) / 1000.0, "wait")
+
+        self._respond("success", "Batch abgeschlossen", cmd_id)
+
+    # ------------------------------------------------------------- Hardware
+
+    def _mm_to_steps(self, mm):
+        # Arduino map() mit Ganzzahlarithmetik
+        return int(mm * self.max_steps / MAX_MILLIMETERS)
+
+    def _move_to_mm(self, target_mm):
+        if target_mm < 0 or target_mm > MAX_MILLIMETERS:
+            self._debug(f"Ungültige Position: {target_mm} mm (Erlaubt: 0-{MAX_MILLIMETERS} mm)")
+            return
+        steps = self._mm_to_steps(target_mm)
+        self._debug(f"Bewege Plattform zu {target_mm} mm ({steps} Schritte)...")
+        self._debug("Treiber aktivieren...")
+        # stepper.run() ruft in jedem Durchlauf handlePumpDurations() auf
+        self._wait_with_pumps(move_time_s(steps - self.position), "move")
+        self.position = steps
+        self._debug(f"Position erreicht: {target_mm} mm ({steps} Schritte).")
+        self._debug("Treiber deaktivieren...")
+
+    def _servo_pour(self, delay_ms):
+        self._debug(f"Servo bewegen (180 Grad), warte {delay_ms} ms, zurück zu 90 Grad.")
+        # delay() blockiert: Pumpen werden währenddessen nicht abgeschaltet
+        started = self.clock.now()
+        self.servo_angle = 180
+        self.clock.sleep((SERVO_SETTLE_MS + delay_ms) / 1000.0)
+        self.servo_angle = 90
+        self.clock.sleep(SERVO_SETTLE_MS / 1000.0)
+        self.activity.append(("servo", started, self.clock.now()))
+
+    def _activate_pump(self, number, duration):
+        pump = self.pumps[number - 1]
+        pump.update(active=True, start=self._millis(), duration=duration, since=self.clock.now())
+
+    def _wait_with_pumps(self, seconds, kind):
+        """Wartet und schaltet Pumpen pünktlich ab (wie waitWithPumps/moveToMM)."""
+        started = self.clock.now()
+        end = started + seconds
+        while True:
+            self._handle_pump_durations()
+            now = self.clock.now()
+            if now >= end:
+                if seconds > 0:
+                    self.activity.append((kind, started, now))
+                return
+            deadline = self._next_pump_deadline()
+            self.clock.sleep(min(end - now, deadline) if deadline is not None else end - now)
+
+    def _handle_pump_durations(self):
+        now = self._millis()
+        for i, pump in enumerate(self.pumps):
+            if pump["active"] and now - pump["start"] >= pump["duration"]:
+                pump["active"] = False
+                since = pump.get("since", now / 1000.0)
+                self.activity.append(("pump", since, min(self.clock.now(), since + pump["duration"] / 1000.0)))
+                self._debug(f"Pumpe {i + 1} deaktiviert.")
+
+    def _next_pump_deadline(self):
+        """Sekunden bis zur nächsten Pumpenabschaltung oder None."""
+        now = self._millis()
+        remaining = [pump["start"] + pump["duration"] - now for pump in self.pumps if pump["active"]]
+        if not remaining:
+            return None
+        return max(0, min(remaining)) / 1000.0
+
+    def _millis(self):
+        return int(self.clock.now() * 1000)
+
+    # --------------------------------------------------------------- Ausgabe
+
+    def _debug(self, text):
+        self._send(f"DEBUG: {text}", delay=False)
+
+    def _respond(self, status, message, cmd_id):
+        response = {"status": status, "message": message}
+        if cmd_id:
+            response["id"] = cmd_id
+        self._send(json.dumps(response, ensure_ascii=False, separators=(",", ":")))
+
+    def _send(self, line, delay=True):
+        if delay and (self.delay_ms or self.jitter_ms):
+            self.clock.sleep((self.delay_ms + self.random.uniform(0, self.jitter_ms)) / 1000.0)
+        if self.drop_tx and self.random.random() < self.drop_tx:
+            self.stats["dropped_tx"] += 1
+            return
+        try:
+            self.write(line)
+        except Exception as e:
+            print(f"Fehler beim Senden des ESP-Emulators: {e}")
+
+
+class LoopbackSerial:
+    """
+    Ersatz für serial.Serial im selben Prozess (Benchmarks): was der Host
+    schreibt, landet beim Emulator, dessen Ausgaben liefert readline().
+    """
+
+    def __init__(self, emulator, timeout=0.2):
+        self.emulator = emulator
+        self.timeout = timeout
+        self.is_open = True
+        self._rx = queue.Queue()
+        self._buffer = b""
+        self._reading = False
+        emulator.write = self._from_device
+
+    @property
+    def idle(self):
+        """True, wenn der Host alle Zeilen abgeholt hat und wieder auf die nächste wartet."""
+        return not self.is_open or (self._reading and self._rx.empty())
+
+    def write(self, data):
+        if not self.is_open:
+            raise OSError("Port geschlossen")
+        self._buffer += data
+        while b"\n" in self._buffer:
+            raw, self._buffer = self._buffer.split(b"\n", 1)
+            self.emulator.feed(raw.decode("utf-8", errors="replace").rstrip("\r"))
+        return len(data)
+
+    def readline(self):
+        if not self.is_open:
+            raise OSError("Port geschlossen")
+        self._reading = True
+        try:
+            return self._rx.get(timeout=self.timeout)
+        except queue.Empty:
+            return b""
+        finally:
+            self._reading = False
+
+    def close(self):
+        self.is_open = False
+
+    def _from_device(self, line):
+        if self.is_open:
+            self._rx.put((line + "\n").encode("utf-8"))
+
+
+class PtyLink:
+    """
+    Verbindet einen EspEmulator mit einem pty. Ein simulierter Abbruch schließt
+    das pty (der Host sieht einen Lesefehler) und stellt nach reconnect_s ein
+    neues bereit; der ESP startet dabei neu.
+    """
+
+    def __init__(self, emulator, link=None, disconnect_after=0, disconnect_rate=0.0, reconnect_s=3.0):
+        self.emulator = emulator
+        self.link = link
+        self.disconnect_after = disconnect_after
+        self.disconnect_rate = disconnect_rate
+        self.reconnect_s = reconnect_s
+        self.port = None
+        self._master = None
+        self._slave = None
+        self._write_lock = Lock()
+        self._commands = 0
+        emulator.write = self.write
+
+    def open(self):
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        # Die Gegenseite bleibt offen, damit Öffnen/Schließen durch den Host
+        # (z.B. beim Neuverbinden) das pty nicht zerstört
+        self._master, self._slave = master, slave
+        self.port = os.ttyname(slave)
+        if self.link:
+            tmp_link = f"{self.link}.tmp"
+            if os.path.lexists(tmp_link):
+                os.remove(tmp_link)
+            os.symlink(self.port, tmp_link)
+            os.replace(tmp_link, self.link)
+        print(f"ESP-Emulator bereit an {self.port}" + (f" (Verknüpfung {self.link})" if self.link else ""))
+        Thread(target=self._read_loop, args=(master,), name="esp-emulator-pty", daemon=True).start()
+        self.emulator.boot()
+
+    def close(self):
+        master, slave = self._master, self._slave
+        self._master = self._slave = None
+        for fd in (master, slave):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        if self.link and os.path.islink(self.link):
+            os.remove(self.link)
+
+    def disconnect(self):
+        """Simuliert das Abziehen des USB-Kabels."""
+        print(f"ESP-Emulator: Verbindung getrennt, neu verfügbar in {self.reconnect_s} s.")
+        self.close()
+        self.emulator.reset()
+
+        def replug():
+            time.sleep(self.reconnect_s)
+            self.open()
+
+        Thread(target=replug, daemon=True).start()
+
+    def write(self, line):
+        with self._write_lock:
+            master = self._master
+            if master is None:
+                return  # Kabel gezogen
+            os.write(master, (line + "\n").encode("utf-8"))
+
+    def _read_loop(self, master):
+        buffer = b""
+        while self._master == master:
+            try:
+                data = os.read(master, 4096)
+            except OSError:
+                return
+            if not data:
+                return
+            buffer += data
+            while b"\n" in buffer:
+                raw, buffer = buffer.split(b"\n", 1)
+                self.emulator.feed(raw.decode("utf-8", errors="replace").rstrip("\r"))
+                self._commands += 1
+                if self._should_disconnect():
+                    self.disconnect()
+                    return
+
+    def _should_disconnect(self):
+        if self.disconnect_after and self._commands % self.disconnect_after == 0:
+            return True
+        return bool(self.disconnect_rate) and self.emulator.random.random() < self.disconnect_rate
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Virtueller ESP32 (ESP23_V2.ino) an einem Pseudo-Terminal.")
+    parser.add_argument("--link", help="Symbolische Verknüpfung auf das pty (für BARBOT_ESP_PORT)")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Zeitraffer-Faktor (Standard 1)")
+    parser.add_argument("--rail-mm", type=int, default=MAX_MILLIMETERS, help="Kalibrierte Schienenlänge in mm")
+    parser.add_argument("--steps-per-mm", type=float, default=DEFAULT_STEPS_PER_MM)
+    parser.add_argument("--calibrate", action="store_true", help="Kalibrierfahrt beim Start mitsimulieren")
+    parser.add_argument("--drop-rx", type=float, default=0.0, help="Anteil verlorener empfangener Zeilen (0-1)")
+    parser.add_argument("--drop-tx", type=float, default=0.0, help="Anteil verlorener gesendeter Zeilen (0-1)")
+    parser.add_argument("--delay-ms", type=int, default=0, help="Zusätzliche Verzögerung jeder Antwort")
+    parser.add_argument("--jitter-ms", type=int, default=0, help="Zufällige Zusatzverzögerung bis zu diesem Wert")
+    parser.add_argument("--disconnect-after", type=int, default=0, help="Nach je N Befehlen trennen")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="Wahrscheinlichkeit einer Trennung pro Befehl")
+    parser.add_argument("--reconnect-s", type=float, default=3.0, help="Pause bis zum Wiedereinstecken")
+    parser.add_argument("--seed", type=int, help="Startwert für reproduzierbare Fehler")
+    args = parser.parse_args(argv)
+
+    emulator = EspEmulator(
+        write=None, clock=ScaledClock(args.time_scale), rail_mm=args.rail_mm,
+        steps_per_mm=args.steps_per_mm, drop_rx=args.drop_rx, drop_tx=args.drop_tx,
+        delay_ms=args.delay_ms, jitter_ms=args.jitter_ms, calibrate=args.calibrate, seed=args.seed)
+    link = PtyLink(emulator, link=args.link, disconnect_after=args.disconnect_after,
+                   disconnect_rate=args.disconnect_rate, reconnect_s=args.reconnect_s)
+    # Auch bei "kill"/systemd sauber beenden (Verknüpfung entfernen)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    emulator.start()
+    link.open()
+    print(f"Server starten mit: BARBOT_ESP_PORT={args.link or link.port} python server.py")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.stop()
+        link.close()
+        print(f"ESP-Emulator beendet: {emulator.stats}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
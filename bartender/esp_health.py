@@ -0,0 +1,152 @@
+"""
+Heartbeat-Überwachung des ESP.
+
+Ein Hintergrund-Thread schickt in Leerlaufphasen (keine offenen Befehle, kein
+laufendes Rezept) einen "status"-Befehl und merkt sich Latenz, Zeitpunkt der
+letzten Antwort und die Pumpenzustände. Routen lesen nur diesen Stand und
+berühren den seriellen Port nicht.
+
+Als Lebenszeichen zählt nur, was wirklich vom ESP kommt: Heartbeat-Antworten
+und jede empfangene Zeile (EspTransport.last_rx). Während ein Befehl läuft
+(z.B. eine lange Fahrt) fällt der Heartbeat aus; der ESP gilt dann bis zur
+Frist dieses Befehls weiter als erreichbar, danach wie sonst nach
+STALE_AFTER_S ohne empfangene Zeile als nicht erreichbar.
+"""
+import time
+from threading import Lock, Thread
+
+import logs
+
+log = logs.get("esp_health")
+
+HEARTBEAT_INTERVAL_S = 5.0
+HEARTBEAT_TIMEOUT_S = 2.0
+# Ohne Lebenszeichen so lange gilt der ESP als nicht erreichbar
+STALE_AFTER_S = 15.0
+# So viele verpasste Heartbeats hintereinander, bis der ESP als offline gilt
+MAX_MISSED = 2
+
+
+class EspHealthMonitor:
+    def __init__(self, transport, is_busy=lambda: False, interval=HEARTBEAT_INTERVAL_S):
+        self.transport = transport
+        self.is_busy = is_busy
+        self.interval = interval
+        self._lock = Lock()
+        self._listeners = []
+        self._thread = None
+        self._online = False
+        self._latency_ms = None
+        self._last_seen = None
+        self._last_check = None
+        self._missed = 0
+        self._pumps = []
+
+    # ------------------------------------------------------------ Abfrage
+
+    @property
+    def online(self):
+        with self._lock:
+            return self._is_online(time.time())
+
+    def snapshot(self):
+        """Gecachter Gesundheitszustand (ohne Zugriff auf den seriellen Port)."""
+        now = time.time()
+        with self._lock:
+            last_seen = max(filter(None, (self._last_seen, self.transport.last_rx)), default=None)
+            return {
+                "connected": self.transport.connected,
+                "online": self._is_online(now),
+                "latency_ms": self._latency_ms,
+                "last_seen": last_seen,
+                "age_s": round(now - last_seen, 1) if last_seen else None,
+                "last_check": self._last_check,
+                "missed": self._missed,
+                "pumps": list(self._pumps),
+                "batch": self.transport.supports_batch,
+                "busy": self.transport.busy,
+                "last_error": self.transport.last_error,
+            }
+
+    def add_listener(self, callback):
+        """callback(snapshot) wenn sich online/offline ändert."""
+        self._listeners.append(callback)
+
+    # ----------------------------------------------------------- Überwachung
+
+    def start(self):
+        if self._thread is None:
+            self._thread = Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def check_now(self):
+        """Sofortiger Heartbeat (z.B. direkt nach dem Verbinden)."""
+        self._beat()
+
+    def _run(self):
+        while True:
+            try:
+                if self.transport.busy or self.is_busy():
+                    # Keinen Status zwischen laufende Befehle schieben
+                    self._update_passive()
+                else:
+                    self._beat()
+            except Exception as e:
+                log.error("Fehler bei der ESP-Überwachung: %s", e)
+            time.sleep(self.interval)
+
+    def _beat(self):
+        if not self.transport.connected:
+            self._record(False)
+            return
+        started = time.time()
+        resp = self.transport.send({"command": "status"}, timeout=HEARTBEAT_TIMEOUT_S)
+        if resp.get("status") == "online":
+            self._record(True, latency_ms=(time.time() - started) * 1000, pumps=resp.get("pumps", []))
+        else:
+            self._record(False)
+
+    def _update_passive(self):
+        was_online = self.online
+        with self._lock:
+            # Kein eigenes Lebenszeichen: nur empfangene Zeilen (last_rx) zählen
+            online = self._is_online(time.time())
+        if online != was_online:
+            self._notify()
+
+    def _record(self, ok, latency_ms=None, pumps=None):
+        now = time.time()
+        with self._lock:
+            was_online = self._is_online(now)
+            self._last_check = now
+            if ok:
+                self._missed = 0
+                self._last_seen = now
+                self._latency_ms = round(latency_ms)
+                self._pumps = pumps
+            else:
+                self._missed += 1
+                if not self.transport.connected:
+                    self._missed = MAX_MISSED
+            self._online = ok or (self._online and self._missed < MAX_MISSED)
+            online = self._is_online(now)
+        if online != was_online:
+            self._notify()
+
+    def _is_online(self, now):
+        if not self.transport.connected:
+            return False
+        last_seen = max(filter(None, (self._last_seen, self.transport.last_rx)), default=None)
+        if not self._online or last_seen is None:
+            return False
+        # Ein laufender Befehl darf bis zu seiner Frist ohne Antwort bleiben
+        deadline = self.transport.pending_deadline
+        return now - last_seen < STALE_AFTER_S or (deadline is not None and now < deadline)
+
+    def _notify(self):
+        snapshot = self.snapshot()
+        for callback in list(self._listeners):
+            try:
+                callback(snapshot)
+            except Exception as e:
+                log.error("Fehler in ESP-Überwachungs-Listener: %s", e)
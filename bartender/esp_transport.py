@@ -0,0 +1,308 @@
+"""
+Serielle Transportschicht zum ESP.
+
+Ein einzelner Leser-Thread liest alle Zeilen vom ESP und verteilt sie:
+- JSON-Antworten erfüllen die Future des passenden Befehls (über die
+  mitgesendete "id", ohne id in Sendereihenfolge),
+- "DEBUG:"-Zeilen landen in einem begrenzten Ringpuffer,
+- alles andere (z.B. {"event": ...}) geht als Ereignis an eine Queue und an
+  registrierte Listener.
+
+Der Aufrufer wartet nicht mehr mit festem 5-s-Limit, sondern mit einem Timeout,
+der sich aus der erwarteten Dauer des Befehls ergibt.
+"""
+import json
+import time
+import queue
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from threading import Lock, Thread
+
+import clock
+from estimator import move_time_ms, SERVO_OVERHEAD_MS, MAX_MILLIMETERS
+
+import logs
+
+log = logs.get("esp_transport")
+
+# Zuschläge für die Timeouts in ms
+TIMEOUT_MARGIN_MS = 2000
+TIMEOUT_FACTOR = 1.5
+# Wie lange eine abgelaufene Anfrage noch auf eine verspätete Antwort wartet,
+# damit die Zuordnung ohne id nicht verrutscht
+LATE_RESPONSE_GRACE = 30.0
+
+
+class _Pending:
+    __slots__ = ("id", "command", "future", "sent_at", "deadline", "on_event", "started")
+
+    def __init__(self, cmd_id, command, future, sent_at, deadline, on_event=None):
+        self.id = cmd_id
+        self.command = command
+        self.future = future
+        self.sent_at = sent_at
+        self.deadline = deadline
+        self.on_event = on_event
+        self.started = clock.now()  # Für Roundtrip-Messungen (auch mit virtueller Uhr)
+
+
+class EspTransport:
+    def __init__(self, debug_lines=500, event_queue_size=1000):
+        self.ser = None
+        self.write_lock = Lock()
+        self._pending_lock = Lock()
+        self._pending = deque()
+        self._next_id = 1
+        self._reader = None
+        self._listeners = []
+        self._timing_listeners = []
+        self.debug_log = deque(maxlen=debug_lines)
+        self.events = queue.Queue(maxsize=event_queue_size)
+        self.last_position = None  # Zuletzt bestätigte Zielposition in mm
+        self.device_info = {}  # Letzte Antwort auf "status" (Pumpen, Fähigkeiten)
+        self.last_error = None
+        self.last_rx = None  # Zeitpunkt der letzten empfangenen Zeile
+
+    # ------------------------------------------------------------ Verbindung
+
+    @property
+    def connected(self):
+        ser = self.ser
+        return ser is not None and ser.is_open
+
+    def attach(self, ser):
+        """Übernimmt einen geöffneten seriellen Port und startet den Leser-Thread."""
+        self.detach("Neue Verbindung")
+        self.ser = ser
+        self.last_error = None
+        self._reader = Thread(target=self._read_loop, args=(ser,), daemon=True)
+        self._reader.start()
+
+    def detach(self, reason="Verbindung getrennt"):
+        ser, self.ser = self.ser, None
+        if ser is not None:
+            try:
+                ser.close()
+            except Exception:
+                pass
+        self.last_error = reason
+        self._fail_all(reason)
+
+    def add_listener(self, callback):
+        """callback(event_dict) für jedes unaufgeforderte Ereignis des ESP."""
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def add_timing_listener(self, callback):
+        """
+        callback(kind, command, seconds, started, status) für Messwerte:
+        "lock_wait" (Warten auf write_lock), "roundtrip" (Senden bis Antwort)
+        und "timeout" (keine Antwort bis zur Frist).
+        """
+        self._timing_listeners.append(callback)
+
+    @property
+    def busy(self):
+        """True, solange ein Befehl auf seine Antwort wartet (der ESP arbeitet)."""
+        with self._pending_lock:
+            return bool(self._pending)
+
+    @property
+    def pending_deadline(self):
+        """Frist des ältesten offenen Befehls (Unix-Zeit) oder None."""
+        with self._pending_lock:
+            return self._pending[0].deadline if self._pending else None
+
+    @property
+    def supports_batch(self):
+        return bool(self.device_info.get("batch"))
+
+    # ------------------------------------------------------------- Befehle
+
+    def expected_duration_ms(self, command):
+        """Erwartete Ausführungsdauer eines Befehls auf dem ESP."""
+        cmd = command.get("command")
+        if cmd == "move":
+            if self.last_position is None:
+                # Unbekannte Startposition: schlimmster Fall über die ganze Schiene
+                return move_time_ms(0, MAX_MILLIMETERS)
+            return move_time_ms(self.last_position, command.get("position", 0))
+        if cmd == "servo":
+            return SERVO_OVERHEAD_MS + max(0, int(command.get("delay", 0)))
+        return 0
+
+    def timeout_for(self, command):
+        return (self.expected_duration_ms(command) * TIMEOUT_FACTOR + TIMEOUT_MARGIN_MS) / 1000.0
+
+    def request(self, command, timeout=None, on_event=None):
+        """
+        Sendet einen Befehl und liefert (Future, Timeout in s). Die Future wird
+        mit dem Antwort-Dict des ESP erfüllt. on_event(event) erhält Ereignisse,
+        die der ESP mit der id dieses Befehls sendet (z.B. Batch-Fortschritt).
+        """
+        if timeout is None:
+            timeout = self.timeout_for(command)
+        future = Future()
+        ser = self.ser
+        if ser is None or not ser.is_open:
+            future.set_result({"status": "error", "message": "ESP nicht verbunden"})
+            return future, timeout
+
+        lock_requested = time.monotonic()
+        with self.write_lock:
+            self._timing("lock_wait", command.get("command"), time.monotonic() - lock_requested)
+            with self._pending_lock:
+                cmd_id = self._next_id
+                self._next_id += 1
+                now = time.time()
+                # Der ESP arbeitet Befehle nacheinander ab: noch offene Befehle
+                # verlängern die Wartezeit dieses Befehls
+                start = max([now] + [p.deadline for p in self._pending if p.deadline > now])
+                pending = _Pending(cmd_id, command, future, now, start + timeout, on_event)
+                self._pending.append(pending)
+                timeout = pending.deadline - now
+            try:
+                payload = dict(command, id=cmd_id)
+                ser.write((json.dumps(payload) + "\n").encode("utf-8"))
+            except Exception as e:
+                log.error("Fehler bei der ESP-Kommunikation: %s", e)
+                self.detach(f"Schreibfehler: {e}")
+        return future, timeout
+
+    def send(self, command, timeout=None):
+        """Sendet einen Befehl und wartet auf die Antwort (Fehler als Dict, wie bisher)."""
+        future, timeout = self.request(command, timeout)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            return {"status": "error", "message": "Keine Antwort vom ESP"}
+
+    def debug_lines(self, limit=100):
+        lines = list(self.debug_log)
+        return lines[-limit:] if limit else lines
+
+    # --------------------------------------------------------------- Leser
+
+    def _read_loop(self, ser):
+        while self.ser is ser:
+            try:
+                raw = ser.readline()
+            except Exception as e:
+                if self.ser is not ser:
+                    # Port wurde absichtlich geschlossen (detach/Neuverbindung)
+                    return
+                log.error("Fehler bei der ESP-Kommunikation: %s", e)
+                self.detach(f"Lesefehler: {e}")
+                return
+            self._expire_pending()
+            if not raw:
+                continue
+            line = raw.decode("utf-8", errors="replace").strip()
+            if line:
+                self._dispatch(line)
+
+    def _dispatch(self, line):
+        self.last_rx = time.time()
+        if line.startswith("DEBUG:"):
+            self.debug_log.append((time.time(), line[len("DEBUG:"):].strip()))
+            return
+
+        if line.startswith("{"):
+            try:
+                msg = json.loads(line)
+            except json.JSONDecodeError as e:
+                log.error("JSON-Fehler beim Parsen der ESP-Antwort: %s, empfangene Daten: %s", e, line)
+                self._resolve(None, {"status": "error", "message": "Ungültige Antwort vom ESP"})
+                return
+            if "event" in msg:
+                if self._route_event(msg):
+                    return
+            elif self._resolve(msg.get("id"), msg):
+                return
+            self._emit(msg)
+            return
+
+        self._emit({"event": "line", "text": line})
+
+    def _resolve(self, cmd_id, msg):
+        """Ordnet eine Antwort der passenden Anfrage zu; False, wenn keine wartet."""
+        with self._pending_lock:
+            if not self._pending:
+                return False
+            pending = None
+            if cmd_id is not None:
+                for candidate in self._pending:
+                    if candidate.id == cmd_id:
+                        pending = candidate
+                        break
+                if pending is None:
+                    return False
+            else:
+                pending = self._pending[0]
+            self._pending.remove(pending)
+        if pending.command.get("command") == "move" and msg.get("status") == "success":
+            self.last_position = pending.command.get("position")
+        elif pending.command.get("command") == "status" and msg.get("status") == "online":
+            self.device_info = msg
+        self._timing("roundtrip", pending.command.get("command"), clock.now() - pending.started,
+                     pending.started, msg.get("status"))
+        if not pending.future.done():
+            pending.future.set_result(msg)
+        return True
+
+    def _route_event(self, msg):
+        """Ereignis mit id an den wartenden Befehl weitergeben."""
+        cmd_id = msg.get("id")
+        if cmd_id is None:
+            return False
+        with self._pending_lock:
+            pending = next((p for p in self._pending if p.id == cmd_id), None)
+        if pending is None or pending.on_event is None:
+            return False
+        try:
+            pending.on_event(msg)
+        except Exception as e:
+            log.error("Fehler in ESP-Ereignis-Listener: %s", e)
+        return True
+
+    def _expire_pending(self):
+        now = time.time()
+        expired = []
+        with self._pending_lock:
+            while self._pending and self._pending[0].deadline + LATE_RESPONSE_GRACE < now:
+                expired.append(self._pending.popleft())
+        for pending in expired:
+            self._timing("timeout", pending.command.get("command"), clock.now() - pending.started, pending.started)
+
+    def _fail_all(self, reason):
+        with self._pending_lock:
+            pending, self._pending = list(self._pending), deque()
+        for entry in pending:
+            if not entry.future.done():
+                entry.future.set_result({"status": "error", "message": "Kommunikationsfehler mit ESP"})
+
+    def _timing(self, kind, command, seconds, started=None, status=None):
+        for callback in list(self._timing_listeners):
+            try:
+                callback(kind, command, seconds, started, status)
+            except Exception as e:
+                log.error("Fehler in ESP-Messwert-Listener: %s", e)
+
+    def _emit(self, event):
+        event.setdefault("received_at", time.time())
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            try:
+                self.events.get_nowait()
+                self.events.put_nowait(event)
+            except (queue.Empty, queue.Full):
+                pass
+        for callback in list(self._listeners):
+            try:
+                callback(event)
+            except Exception as e:
+                log.error("Fehler in ESP-Ereignis-Listener: %s", e)
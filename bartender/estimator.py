@@ -0,0 +1,71 @@
+"""
+Statische Laufzeitabschätzung für kompilierte Rezeptpläne.
+
+Die Fahrzeit wird aus dem Trapezprofil von AccelStepper mit den Grenzwerten der
+Firmware (ESP23_V2.ino) berechnet, Servo-, Pumpen- und Wartezeiten direkt aus
+den Schritten des Plans.
+"""
+import math
+from collections import namedtuple
+
+# Werte aus ESP23_V2.ino
+MOVE_MAX_SPEED = 6000      # Schritte/s
+MOVE_ACCELERATION = 1200   # Schritte/s²
+MAX_MILLIMETERS = 1200
+SERVO_OVERHEAD_MS = 360    # 2x delay(180) um die Servo-Bewegung
+
+# Annahmen für den Host
+DEFAULT_STEPS_PER_MM = 80  # 1/16 Mikroschritt, GT2-Riemen mit 20 Zähnen
+COMMAND_OVERHEAD_MS = 20   # Serieller Roundtrip pro Befehl
+PARK_POSITION = 10
+START_POSITION = MAX_MILLIMETERS // 2  # Position nach setup() des ESP
+
+Estimate = namedtuple("Estimate", "total_ms step_ms breakdown end_position")
+
+
+def move_time_ms(from_mm, to_mm, config=None):
+    """Fahrzeit zwischen zwei Positionen in ms (ohne Befehls-Overhead)."""
+    steps_per_mm = (config or {}).get("steps_per_mm", DEFAULT_STEPS_PER_MM)
+    distance = abs(to_mm - from_mm) * steps_per_mm
+    if distance <= 0:
+        return 0
+    ramp_distance = MOVE_MAX_SPEED ** 2 / (2 * MOVE_ACCELERATION)
+    if distance >= 2 * ramp_distance:
+        seconds = distance / MOVE_MAX_SPEED + MOVE_MAX_SPEED / MOVE_ACCELERATION
+    else:
+        # Dreiecksprofil: Höchstgeschwindigkeit wird nicht erreicht
+        seconds = 2 * math.sqrt(distance / MOVE_ACCELERATION)
+    return int(seconds * 1000)
+
+
+def step_time_ms(step, position, config=None):
+    """Geschätzte Dauer eines Schritts; liefert (ms, neue Position)."""
+    if step.kind == "move":
+        start = position if position is not None else START_POSITION
+        return COMMAND_OVERHEAD_MS + move_time_ms(start, step.position, config), step.position
+    if step.kind == "servo":
+        return COMMAND_OVERHEAD_MS + SERVO_OVERHEAD_MS + step.duration, position
+    if step.kind == "pump":
+        return COMMAND_OVERHEAD_MS + step.duration + step.drip, position
+    if step.kind == "pumps":
+        # Alle Pumpen starten nacheinander, laufen dann gleichzeitig
+        return COMMAND_OVERHEAD_MS * len(step.pump) + step.duration + step.drip, position
+    return step.duration, position
+
+
+def estimate_steps(steps, config=None, start_mm=None):
+    """Schätzt eine Schrittfolge ab, beginnend bei start_mm (Standard: Parkposition)."""
+    position = PARK_POSITION if start_mm is None else start_mm
+    step_ms = []
+    breakdown = {"move": 0, "servo": 0, "pump": 0, "wait": 0}
+    for step in steps:
+        ms, position = step_time_ms(step, position, config)
+        step_ms.append(ms)
+        kind = "pump" if step.kind == "pumps" else step.kind
+        breakdown[kind] = breakdown.get(kind, 0) + ms
+    return Estimate(sum(step_ms), tuple(step_ms), breakdown, position)
+
+
+def estimate_plan(plan, config=None, start_mm=None):
+    """Schätzt die Gesamtdauer eines Plans ab."""
+    return estimate_steps(plan.steps, config, start_mm)
@@ -0,0 +1,90 @@
+"""
+Server-Sent Events: eine Quelle, beliebig viele Browser.
+
+Jeder Client bekommt eine eigene, begrenzte Queue; ist sie voll (langsamer
+Client), wird das älteste Ereignis verworfen. Ereignisse werden nur einmal
+serialisiert. Neue Clients erhalten sofort den letzten Stand jedes
+Zustandsereignisses (z.B. ESP-Status, Warteschlange), damit sie nicht bis
+zur nächsten Änderung warten müssen.
+
+Jeder offene Stream belegt einen Thread des WSGI-Servers. Über max_clients
+hinaus lehnt subscribe() ab (None); die Seite fragt dann per Polling ab.
+"""
+import json
+import queue
+from threading import Lock
+
+HEARTBEAT_S = 15
+CLIENT_QUEUE_SIZE = 100
+
+# Ereignisse, deren letzter Stand an neue Clients geht
+STATE_EVENTS = ("esp", "progress", "queue")
+
+
+class EventBroadcaster:
+    def __init__(self, client_queue_size=CLIENT_QUEUE_SIZE, max_clients=None):
+        self.client_queue_size = client_queue_size
+        self.max_clients = max_clients
+        self._lock = Lock()
+        self._clients = set()
+        self._last = {}
+        self._next_id = 1
+
+    @property
+    def client_count(self):
+        with self._lock:
+            return len(self._clients)
+
+    def subscribe(self):
+        """Neue Client-Queue oder None, wenn schon max_clients verbunden sind."""
+        client = queue.Queue(maxsize=self.client_queue_size)
+        with self._lock:
+            if self.max_clients is not None and len(self._clients) >= self.max_clients:
+                return None
+            for frame in self._last.values():
+                client.put_nowait(frame)
+            self._clients.add(client)
+        return client
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    def publish(self, event, data):
+        """Sendet ein Ereignis an alle verbundenen Clients."""
+        with self._lock:
+            frame = f"id: {self._next_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+            self._next_id += 1
+            if event in STATE_EVENTS:
+                self._last[event] = frame
+            clients = list(self._clients)
+        for client in clients:
+            try:
+                client.put_nowait(frame)
+            except queue.Full:
+                try:
+                    client.get_nowait()
+                    client.put_nowait(frame)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def last(self, event):
+        """Letzter Stand eines Zustandsereignisses als Dict (oder None)."""
+        with self._lock:
+            frame = self._last.get(event)
+        if frame is None:
+            return None
+        data = frame.split("data: ", 1)[1].strip()
+        return json.loads(data)
+
+    def stream(self, client):
+        """Generator für die HTTP-Antwort; hält die Verbindung mit Kommentaren offen."""
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    yield client.get(timeout=HEARTBEAT_S)
+                except queue.Empty:
+                    yield ": ping\n\n"
+        finally:
+            self.unsubscribe(client)
@@ -0,0 +1,150 @@
+"""
+Protokollierung des Servers.
+
+Die Module loggen über logs.get("<modul>") mit %-Platzhaltern statt
+f-Strings: ist eine Stufe abgeschaltet, wird kein Text gebaut. Ein
+QueueHandler nimmt die Einträge nur entgegen; ein eigener Thread
+(QueueListener) formatiert sie und schreibt sie nach stdout (journald, siehe
+debug.py) und in einen Ringpuffer, den /logs ausliefert. Der
+Ausführungs-Thread wartet so nie auf I/O. Läuft die Queue voll, werden
+Einträge verworfen und gezählt, statt zu blockieren.
+
+Die Stufe kommt aus BARBOT_LOG_LEVEL (Standard INFO) und lässt sich zur
+Laufzeit über /log_level ändern, auch für einzelne Module.
+"""
+import os
+import sys
+import time
+import queue
+import atexit
+import logging
+import logging.handlers
+from collections import deque
+from itertools import count
+from threading import Lock
+
+ROOT = "barbot"
+LEVEL_ENV = "BARBOT_LOG_LEVEL"
+DEFAULT_LEVEL = "INFO"
+LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+QUEUE_SIZE = 10000
+RING_SIZE = 1000
+STREAM_FORMAT = "%(levelname)s [%(name)s] %(message)s"
+
+# Felder, die jeder LogRecord hat; alles andere stammt aus extra={...}
+_STANDARD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+
+def get(name):
+    return logging.getLogger(f"{ROOT}.{name}")
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Legt Einträge unformatiert in die Queue; bei voller Queue wird verworfen."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Formatierung erst im Listener-Thread (gleicher Prozess, kein Pickling nötig)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RingBuffer(logging.Handler):
+    """Die letzten Einträge als Dicts, mit fortlaufender Nummer für inkrementelles Abholen."""
+
+    def __init__(self, size=RING_SIZE):
+        super().__init__()
+        self._entries = deque(maxlen=size)
+        self._seq = count(1)
+        self._lock = Lock()
+
+    def emit(self, record):
+        try:
+            entry = {
+                "seq": next(self._seq),
+                "time": record.created,
+                "level": record.levelname,
+                "logger": record.name,
+                "message": record.getMessage(),
+            }
+            extra = {key: value for key, value in vars(record).items() if key not in _STANDARD_FIELDS}
+            if extra:
+                entry["fields"] = extra
+            if record.exc_info:
+                entry["exception"] = logging.Formatter().formatException(record.exc_info)
+            with self._lock:
+                self._entries.append(entry)
+        except Exception:
+            self.handleError(record)
+
+    def entries(self, limit=200, level=None, since=None, logger=None):
+        minimum = logging.getLevelName(level) if level else 0
+        with self._lock:
+            entries = list(self._entries)
+        selected = [e for e in entries
+                    if (since is None or e["seq"] > since)
+                    and logging.getLevelName(e["level"]) >= minimum
+                    and (not logger or e["logger"] == logger or e["logger"].startswith(logger + "."))]
+        return selected[-limit:] if limit else selected
+
+
+ring = RingBuffer()
+_handler = None
+_listener = None
+
+
+def setup(level=None):
+    """Richtet Queue, Listener-Thread, stdout und Ringpuffer ein (nur einmal)."""
+    global _handler, _listener
+    if _listener is not None:
+        return
+    log_queue = queue.Queue(maxsize=QUEUE_SIZE)
+    _handler = _NonBlockingQueueHandler(log_queue)
+    root = logging.getLogger(ROOT)
+    root.addHandler(_handler)
+    root.propagate = False
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(logging.Formatter(STREAM_FORMAT))
+    _listener = logging.handlers.QueueListener(log_queue, stream, ring, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    if not set_level(level or os.environ.get(LEVEL_ENV, DEFAULT_LEVEL)):
+        set_level(DEFAULT_LEVEL)
+
+
+def set_level(level, logger=None):
+    """Setzt die Stufe für barbot oder ein Untermodul; False bei unbekannter Stufe."""
+    level = str(level).upper()
+    if level not in LEVELS:
+        return False
+    name = ROOT if not logger or logger == ROOT else (logger if logger.startswith(ROOT + ".") else f"{ROOT}.{logger}")
+    logging.getLogger(name).setLevel(level)
+    return True
+
+
+def levels():
+    """Gesetzte Stufen: barbot und alle Module mit eigener Stufe."""
+    result = {ROOT: logging.getLevelName(logging.getLogger(ROOT).getEffectiveLevel())}
+    for name, logger in sorted(logging.Logger.manager.loggerDict.items()):
+        if name.startswith(ROOT + ".") and isinstance(logger, logging.Logger) and logger.level:
+            result[name] = logging.getLevelName(logger.level)
+    return result
+
+
+def status():
+    return {
+        "levels": levels(),
+        "queued": _handler.queue.qsize() if _handler else 0,
+        "dropped": _handler.dropped if _handler else 0,
+        "time": time.time(),
+    }
@@ -0,0 +1,291 @@
+"""
+Messwerte und Traces der Rezeptausführung.
+
+Registry sammelt Zähler, Messwerte und Histogramme und gibt sie im
+Textformat von Prometheus aus (/metrics). Tracer hält pro Bestellung einen
+Trace: Rezept-Span, ein Span pro Planschritt (geplante und tatsächliche
+Dauer) und die ESP-Befehle mit ihrer Roundtrip-Zeit. Die letzten Traces
+lassen sich als JSON oder im Chrome-Trace-Format (chrome://tracing,
+Perfetto) herunterladen.
+
+Zeiten kommen aus clock, damit Traces auch im Benchmark (virtuelle Uhr)
+stimmen.
+"""
+from collections import OrderedDict
+from threading import Lock
+
+import clock
+
+import logs
+
+log = logs.get("metrics")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TRACE_HISTORY = 50
+
+
+def _labels(labels, extra=None):
+    items = sorted(labels.items())
+    if extra:
+        items.append(extra)
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._lock = Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        super().__init__(name, help_text)
+        self._values = {}
+
+    def inc(self, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_labels(dict(key))} {_number(value)}" for key, value in sorted(values.items())]
+
+
+class Gauge(_Metric):
+    """Messwert, der beim Abruf über callback() ermittelt wird (Zahl oder {Labels: Zahl})."""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, callback):
+        super().__init__(name, help_text)
+        self.callback = callback
+
+    def render(self):
+        try:
+            value = self.callback()
+        except Exception as e:
+            log.error("Fehler beim Ermitteln von %s: %s", self.name, e)
+            return []
+        if isinstance(value, dict):
+            return [f"{self.name}{_labels(dict(key))} {_number(v)}" for key, v in sorted(value.items())]
+        return [f"{self.name} {_number(value)}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        with self._lock:
+            series = {key: dict(s, counts=list(s["counts"])) for key, s in self._series.items()}
+        lines = []
+        for key, s in sorted(series.items()):
+            labels = dict(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets, s["counts"]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(labels, ('le', _number(float(bound))))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(labels)} {round(s['sum'], 6)}")
+            lines.append(f"{self.name}_count{_labels(labels)} {s['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help_text):
+        return self._add(Counter(name, help_text))
+
+    def gauge(self, name, help_text, callback):
+        return self._add(Gauge(name, help_text, callback))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help_text, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+
+class Tracer:
+    def __init__(self, keep=TRACE_HISTORY, on_step=None):
+        """on_step(span) wird für jeden abgeschlossenen Schritt-Span aufgerufen."""
+        self.keep = keep
+        self.on_step = on_step
+        self._lock = Lock()
+        self._traces = OrderedDict()
+        self._current = None
+
+    def begin(self, trace_id, name, planned_ms, **attrs):
+        now = clock.now()
+        trace = {
+            "id": trace_id,
+            "name": name,
+            "started": now,
+            "planned_ms": int(planned_ms),
+            "actual_ms": None,
+            "status": "running",
+            "error": None,
+            "attrs": attrs,
+            "steps": [],
+            "commands": [],
+        }
+        with self._lock:
+            self._current = trace
+            self._traces[trace_id] = trace
+            while len(self._traces) > self.keep:
+                self._traces.popitem(last=False)
+        return trace
+
+    def step(self, index, kind, target, planned_ms):
+        """Beginn eines Planschritts; beendet den vorherigen. Wiederholungen desselben Index zählen nicht."""
+        now = clock.now()
+        with self._lock:
+            trace = self._current
+            if trace is None:
+                return
+            steps = trace["steps"]
+            if steps and steps[-1]["index"] == index and steps[-1]["actual_ms"] is None:
+                return
+            closed = self._close_step(trace, now)
+            steps.append({"index": index, "kind": kind, "target": target, "planned_ms": int(planned_ms),
+                          "start_ms": self._offset(trace, now), "actual_ms": None})
+        self._notify(closed)
+
+    def command(self, command, started, seconds, status=None):
+        """ESP-Befehl mit Roundtrip-Zeit dem laufenden Trace (und Schritt) zuordnen."""
+        with self._lock:
+            trace = self._current
+            if trace is None or started < trace["started"]:
+                return
+            steps = trace["steps"]
+            trace["commands"].append({
+                "command": command,
+                "step": steps[-1]["index"] if steps else None,
+                "start_ms": self._offset(trace, started),
+                "duration_ms": round(seconds * 1000, 1),
+                "status": status,
+            })
+
+    def annotate(self, **attrs):
+        """Ergänzt Attribute des laufenden Traces (z.B. erst während der Ausführung bekannte)."""
+        with self._lock:
+            if self._current is not None:
+                self._current["attrs"].update(attrs)
+
+    def end(self, status="ok", error=None):
+        now = clock.now()
+        with self._lock:
+            trace = self._current
+            if trace is None:
+                return None
+            closed = self._close_step(trace, now)
+            trace["actual_ms"] = self._offset(trace, now)
+            trace["status"] = status
+            trace["error"] = error
+            self._current = None
+        self._notify(closed)
+        return trace
+
+    def get(self, trace_id):
+        with self._lock:
+            trace = self._traces.get(trace_id)
+            return _copy(trace) if trace else None
+
+    def summaries(self):
+        with self._lock:
+            return [{key: trace[key] for key in ("id", "name", "started", "planned_ms", "actual_ms", "status")}
+                    for trace in reversed(self._traces.values())]
+
+    @staticmethod
+    def chrome(trace):
+        """Trace im Chrome-Trace-Format (Zeiten in µs)."""
+        base = trace["started"] * 1e6
+        events = [{"name": trace["name"], "cat": "recipe", "ph": "X", "pid": 1, "tid": 1, "ts": base,
+                   "dur": (trace["actual_ms"] or 0) * 1000,
+                   "args": dict(trace["attrs"], planned_ms=trace["planned_ms"], status=trace["status"])}]
+        for step in trace["steps"]:
+            events.append({"name": f"{step['kind']} {step['target'] or ''}".strip(), "cat": "step", "ph": "X",
+                           "pid": 1, "tid": 2, "ts": base + step["start_ms"] * 1000,
+                           "dur": (step["actual_ms"] or 0) * 1000,
+                           "args": {"index": step["index"], "planned_ms": step["planned_ms"]}})
+        for command in trace["commands"]:
+            events.append({"name": command["command"], "cat": "esp", "ph": "X", "pid": 1, "tid": 3,
+                           "ts": base + command["start_ms"] * 1000, "dur": command["duration_ms"] * 1000,
+                           "args": {"step": command["step"], "status": command["status"]}})
+        names = {1: "Rezept", 2: "Schritte", 3: "ESP-Befehle"}
+        events.extend({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": name}}
+                      for tid, name in names.items())
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    # --------------------------------------------------------------- Intern
+
+    @staticmethod
+    def _offset(trace, moment):
+        return round((moment - trace["started"]) * 1000, 1)
+
+    def _close_step(self, trace, now):
+        steps = trace["steps"]
+        if not steps or steps[-1]["actual_ms"] is not None:
+            return None
+        step = steps[-1]
+        step["actual_ms"] = round(self._offset(trace, now) - step["start_ms"], 1)
+        return dict(step)
+
+    def _notify(self, span):
+        if span is None or self.on_step is None:
+            return
+        try:
+            self.on_step(span)
+        except Exception as e:
+            log.error("Fehler in Trace-Listener: %s", e)
+
+
+def _copy(trace):
+    return dict(trace, attrs=dict(trace["attrs"]), steps=[dict(s) for s in trace["steps"]],
+                commands=[dict(c) for c in trace["commands"]])
@@ -0,0 +1,149 @@
+"""
+Fahrten über Bestellungen hinweg.
+
+Jedes generierte Rezept endet mit "move 10" (Parkposition). Laufen Drinks
+direkt hintereinander, fährt der Schlitten sonst heim und gleich wieder
+hinaus. Der Executor führt darum die Parkfahrt am Ende (park_index) erst
+aus, wenn keine weitere Bestellung bereitsteht; sonst fährt der nächste
+Drink direkt von der letzten Flasche zur ersten.
+
+Im Leerlauf stellt IdleMotion den Schlitten nach PREPOSITION_DELAY_S an die
+Flasche, mit der die letzten Bestellungen am häufigsten begonnen haben.
+Öffnet jemand die Zutaten eines Rezepts, fährt speculate() (falls aktiviert)
+schon zu dessen erster Flasche. Die dadurch gesparte Fahrzeit landet als
+Attribut im Trace der nächsten Bestellung (negativ, wenn die Vorhersage
+falsch war).
+"""
+from collections import Counter, deque
+from threading import Lock, Timer
+
+from estimator import move_time_ms, COMMAND_OVERHEAD_MS
+import logs
+
+log = logs.get("motion")
+
+PREPOSITION_DELAY_S = 10.0
+# Kurz entprellen, damit ein sofort wieder geschlossener Dialog nichts bewegt
+SPECULATION_DELAY_S = 0.5
+FIRST_MOVE_HISTORY = 20
+
+
+def park_index(steps):
+    """Index der abschließenden Parkfahrt (move auf eine Zahl, danach nur Wartezeiten) oder len(steps)."""
+    for idx in range(len(steps) - 1, -1, -1):
+        step = steps[idx]
+        if step.kind == "move":
+            return idx if str(step.target).isdigit() else len(steps)
+        if step.kind != "wait":
+            return len(steps)
+    return len(steps)
+
+
+def first_move(steps):
+    return next((step for step in steps if step.kind == "move"), None)
+
+
+def last_position(steps, default=None):
+    return next((step.position for step in reversed(steps) if step.kind == "move"), default)
+
+
+def chain_saving_ms(from_mm, park_mm, to_mm, config=None):
+    """Gesparte Fahrzeit, wenn statt über die Parkposition direkt gefahren wird."""
+    via_park = COMMAND_OVERHEAD_MS + move_time_ms(from_mm, park_mm, config) + move_time_ms(park_mm, to_mm, config)
+    return via_park - move_time_ms(from_mm, to_mm, config)
+
+
+class IdleMotion:
+    """Vorpositionieren im Leerlauf anhand der ersten Flaschen der letzten Bestellungen."""
+
+    def __init__(self, move, idle, position, delay_s=PREPOSITION_DELAY_S, history=FIRST_MOVE_HISTORY):
+        """
+        move(mm) fährt den Schlitten (True bei Erfolg), idle() ob keine Bestellung
+        läuft oder wartet, position() die aktuelle Position in mm oder None.
+        """
+        self._move = move
+        self._idle = idle
+        self._position = position
+        self.delay_s = delay_s
+        # Hält der Executor während eines Rezepts; Vorpositionieren nur, wenn frei
+        self.lock = Lock()
+        self._firsts = deque(maxlen=history)  # (Ziel, Position) der ersten Fahrt
+        self._timer = None
+        self._prepositioned = None  # (von mm, nach mm, Anlass)
+        self._state_lock = Lock()
+
+    def record(self, steps):
+        """Merkt sich die erste Flasche eines Plans; liefert Trace-Attribute zum Vorpositionieren."""
+        move = first_move(steps)
+        with self._state_lock:
+            prepositioned, self._prepositioned = self._prepositioned, None
+            if move is not None and not str(move.target).isdigit():
+                self._firsts.append((move.target, move.position))
+        if prepositioned is None or move is None:
+            return {}
+        origin, target, reason = prepositioned
+        saved = move_time_ms(origin, move.position) - move_time_ms(target, move.position)
+        return {"prepositioned_mm": target, "preposition_saved_ms": saved, "preposition": reason}
+
+    def likeliest(self):
+        """(Ziel, Position) der häufigsten ersten Flasche; bei Gleichstand die zuletzt genutzte."""
+        with self._state_lock:
+            firsts = list(self._firsts)
+        if not firsts:
+            return None
+        counts = Counter(firsts)
+        return max(reversed(firsts), key=lambda item: counts[item])
+
+    def schedule(self, enabled=True):
+        """Nach dem Ende einer Bestellung: Vorpositionieren nach delay_s planen (falls dann noch Leerlauf)."""
+        if enabled:
+            self._start(self.delay_s, self._preposition)
+        else:
+            self.cancel()
+
+    def speculate(self, target, position):
+        """
+        Spekulativ zur ersten Flasche eines gerade angesehenen Rezepts fahren.
+        Ersetzt ein geplantes Vorpositionieren; wie dieses nur im Leerlauf.
+        """
+        self._start(SPECULATION_DELAY_S, self._preposition, (target, position), "speculative")
+
+    def cancel(self):
+        """Verwirft ein geplantes Vorpositionieren (True, falls eins anstand); eine laufende Fahrt endet regulär."""
+        with self._state_lock:
+            timer, self._timer = self._timer, None
+        if timer is None:
+            return False
+        pending = not timer.finished.is_set()
+        timer.cancel()
+        return pending
+
+    def _start(self, delay_s, function, *args):
+        self.cancel()
+        with self._state_lock:
+            self._timer = Timer(delay_s, function, args)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _preposition(self, guess=None, reason="idle"):
+        guess = guess or self.likeliest()
+        if guess is None or not self.lock.acquire(blocking=False):
+            return
+        try:
+            if not self._idle():
+                return
+            target, position = guess
+            origin = self._position()
+            if origin is None or origin == position:
+                return
+            log.info("Leerlauf (%s): fahre zu '%s' (%s mm) vor.", reason, target, position)
+            if self._move(position):
+                with self._state_lock:
+                    # Mehrfach vorpositioniert: gespart wird gegenüber der ursprünglichen Position
+                    if self._prepositioned is not None:
+                        origin = self._prepositioned[0]
+                    self._prepositioned = (origin, position, reason)
+        except Exception as e:
+            log.error("Fehler beim Vorpositionieren: %s", e)
+        finally:
+            self.lock.release()
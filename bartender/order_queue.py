@@ -0,0 +1,251 @@
+"""
+Bestellwarteschlange.
+
+Bestellungen bekommen eine fortlaufende id und werden von genau einem
+Arbeiter-Thread nacheinander ausgeführt. Die Reihenfolge ist FIFO oder
+"kürzeste zuerst" (SJF, nach geschätzter Dauer); damit bei SJF lange Drinks
+nicht ewig warten, rücken Bestellungen nach STARVATION_S nach vorne.
+
+Offene Bestellungen werden atomar nach orders.json geschrieben und beim Start
+wieder geladen. Eine Bestellung, die beim Absturz gerade lief, wird nicht
+wiederholt (das Glas ist halb voll), sondern als "interrupted" markiert.
+"""
+import json
+import time
+from collections import deque
+from threading import Condition, Thread
+
+import logs
+from atomic_file import atomic_write_json
+
+log = logs.get("order_queue")
+
+POLICIES = ("fifo", "sjf")
+STARVATION_S = 600
+HISTORY_SIZE = 50
+READY_POLL_S = 2.0
+
+
+class OrderQueue:
+    def __init__(self, path, runner, policy=lambda: "fifo", ready=lambda: True):
+        """
+        runner(order) führt eine Bestellung aus; wirft es eine Exception, gilt
+        sie als fehlgeschlagen. policy() liefert "fifo" oder "sjf", ready()
+        ob der Automat bereit ist (z.B. ESP verbunden).
+        """
+        self.path = path
+        self.runner = runner
+        self.policy = policy
+        self.ready = ready
+
+        self._cond = Condition()
+        self._queued = []
+        self._running = None
+        self._history = deque(maxlen=HISTORY_SIZE)
+        self._next_id = 1
+        self._worker = None
+        self._listeners = []
+
+        self._load()
+
+    # ------------------------------------------------------------ Abfragen
+
+    def get(self, order_id):
+        with self._cond:
+            for order in self._all():
+                if order["id"] == order_id:
+                    return dict(order)
+        return None
+
+    def snapshot(self):
+        """Laufende und wartende Bestellungen in Ausführungsreihenfolge."""
+        with self._cond:
+            running = dict(self._running) if self._running else None
+            queued = [dict(order) for order in self._ordered()]
+            history = [dict(order) for order in self._history]
+        return running, queued, history
+
+    def position(self, order_id, running_remaining_ms=0):
+        """(Platz ab 1, geschätzte Wartezeit in ms) oder None, wenn nicht wartend."""
+        with self._cond:
+            waited = running_remaining_ms if self._running else 0
+            for index, order in enumerate(self._ordered()):
+                if order["id"] == order_id:
+                    return index + 1, waited
+                waited += order.get("est_ms", 0)
+        return None
+
+    def peek(self):
+        """Die als nächstes startende wartende Bestellung (Kopie) oder None."""
+        with self._cond:
+            ordered = self._ordered()
+            return dict(ordered[0]) if ordered else None
+
+    @property
+    def started(self):
+        return self._worker is not None and self._worker.is_alive()
+
+    @property
+    def busy(self):
+        with self._cond:
+            return self._running is not None or bool(self._queued)
+
+    # ------------------------------------------------------------ Ändern
+
+    def enqueue(self, kind, recipe, name=None, params=None, est_ms=0):
+        """Nimmt eine Bestellung auf und liefert sie (als Kopie) zurück."""
+        with self._cond:
+            order = {
+                "id": self._next_id,
+                "kind": kind,
+                "recipe": recipe,
+                "name": name or recipe,
+                "params": params or {},
+                "est_ms": int(est_ms),
+                "status": "queued",
+                "created": time.time(),
+                "started": None,
+                "finished": None,
+                "error": None,
+            }
+            self._next_id += 1
+            self._queued.append(order)
+            self._persist()
+            self._cond.notify_all()
+            result = dict(order)
+        self._notify("queued", result)
+        return result
+
+    def cancel(self, order_id):
+        """Storniert eine wartende Bestellung; laufende können nicht storniert werden."""
+        with self._cond:
+            order = next((o for o in self._queued if o["id"] == order_id), None)
+            if order is None:
+                return False
+            self._queued.remove(order)
+            order["status"] = "cancelled"
+            order["finished"] = time.time()
+            self._history.append(order)
+            self._persist()
+            result = dict(order)
+        self._notify("cancelled", result)
+        return True
+
+    def add_listener(self, callback):
+        """callback(action, order) bei jeder Zustandsänderung einer Bestellung."""
+        self._listeners.append(callback)
+
+    # ------------------------------------------------------------ Arbeiter
+
+    def start(self):
+        if self._worker is None:
+            self._worker = Thread(target=self._work, daemon=True)
+            self._worker.start()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._queued:
+                    self._cond.wait()
+            if not self._is_ready():
+                time.sleep(READY_POLL_S)
+                continue
+
+            with self._cond:
+                ordered = self._ordered()
+                if not ordered:
+                    continue
+                order = ordered[0]
+                self._queued.remove(order)
+                order["status"] = "running"
+                order["started"] = time.time()
+                self._running = order
+                self._persist()
+                started = dict(order)
+            self._notify("running", started)
+
+            try:
+                self.runner(started)
+                status, error = "done", None
+            except Exception as e:
+                log.error("Bestellung %s fehlgeschlagen: %s", order["id"], e, extra={"order": order["id"]})
+                status, error = "failed", str(e)
+
+            with self._cond:
+                order["status"] = status
+                order["error"] = error
+                order["finished"] = time.time()
+                self._running = None
+                self._history.append(order)
+                self._persist()
+                finished = dict(order)
+            self._notify(status, finished)
+
+    def _is_ready(self):
+        try:
+            return self.ready()
+        except Exception as e:
+            log.warning("Bereitschaftsprüfung fehlgeschlagen: %s", e)
+            return False
+
+    # --------------------------------------------------------------- Intern
+
+    def _all(self):
+        if self._running:
+            yield self._running
+        yield from self._queued
+        yield from self._history
+
+    def _ordered(self):
+        """Wartende Bestellungen in der Reihenfolge, in der sie drankommen."""
+        policy = self.policy() if callable(self.policy) else self.policy
+        if policy != "sjf":
+            return list(self._queued)
+        now = time.time()
+        starving = [o for o in self._queued if now - o["created"] >= STARVATION_S]
+        rest = sorted((o for o in self._queued if now - o["created"] < STARVATION_S),
+                      key=lambda o: (o.get("est_ms", 0), o["id"]))
+        return starving + rest
+
+    def _notify(self, action, order):
+        for callback in list(self._listeners):
+            try:
+                callback(action, order)
+            except Exception as e:
+                log.error("Fehler in Warteschlangen-Listener: %s", e)
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return
+        except (json.JSONDecodeError, OSError) as e:
+            log.error("Fehler beim Lesen der Warteschlange: %s", e)
+            return
+
+        self._next_id = data.get("next_id", 1)
+        self._queued = [o for o in data.get("queued", []) if o.get("status") == "queued"]
+        self._history.extend(data.get("history", []))
+        running = data.get("running")
+        if running:
+            running["status"] = "interrupted"
+            running["finished"] = time.time()
+            self._history.append(running)
+            log.warning("Bestellung %s ('%s') wurde durch einen Neustart unterbrochen.", running["id"], running["name"])
+        if self._queued:
+            log.info("%s offene Bestellung(en) aus der Warteschlange geladen.", len(self._queued))
+        self._persist()
+
+    def _persist(self):
+        """Schreibt den Zustand atomar (temporäre Datei + rename); Aufruf mit gehaltenem Lock."""
+        data = {
+            "next_id": self._next_id,
+            "running": self._running,
+            "queued": self._queued,
+            "history": list(self._history),
+        }
+        try:
+            atomic_write_json(self.path, data)
+        except Exception as e:
+            log.error("Fehler beim Speichern der Warteschlange: %s", e)
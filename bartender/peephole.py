@@ -0,0 +1,108 @@
+"""
+Peephole-Optimierer für Rezeptzeilen.
+
+Entfernt offensichtliche Verschwendung, ohne die Wirkung des Rezepts zu ändern:
+- derselbe Platzhalter zweimal hintereinander ("wait drip_wait" doppelt):
+  beide warten auf dasselbe Ereignis, die zweite ist überflüssig. Zahlen-waits
+  sind bewusste Pausen und bleiben, auch doppelt,
+- "wait move_wait" direkt nach einem move: der ESP bestätigt eine Fahrt erst,
+  wenn sie beendet ist,
+- ein move zum Getränk, an dem der Schlitten schon steht (dieselbe Flasche
+  zweimal hintereinander). Feste Punkte bleiben erhalten: ein "fixed"- oder
+  Zahlen-move entfällt nur, wenn auch der vorige einer war.
+
+Wartezeiten addieren sich bei der Ausführung. Zwei verschiedene Wartezeiten
+hintereinander auf die längere zusammenzufassen verkürzt das Rezept also und
+geschieht nur mit merge_waits (Schalter "peephole_merge_waits", aus).
+
+optimize() arbeitet auf den geparsten Zeilen und liefert zu jeder Änderung
+die geschätzte Ersparnis; diff() zeigt das Ergebnis als Probelauf für /rezepte.
+drop_idle_moves() entfernt nach dem Kompilieren Fahrten ohne Weg, die erst
+durch Umsortieren entstehen.
+"""
+import difflib
+from collections import namedtuple
+
+from estimator import COMMAND_OVERHEAD_MS
+
+# Eine Änderung: Index der Zeile im Original, Beschreibung, geschätzte Ersparnis in ms
+Rewrite = namedtuple("Rewrite", "index rule saved_ms")
+
+
+def _is_barrier(args):
+    return len(args) > 1 or args[0].isdigit()
+
+
+def optimize(instrs, wait_ms, merge_waits=False):
+    """
+    Liefert (Zeilen, [Rewrite, ...]). wait_ms(wert, ziel) löst eine Wartezeit
+    für das aktuelle Getränk in ms auf, None wenn sie nicht vorab bekannt ist.
+    merge_waits: von zwei verschiedenen Wartezeiten hintereinander nur die
+    längere behalten.
+    """
+    kept = []  # (Index im Original, Instr)
+    rewrites = []
+    move_args = None  # Argumente des letzten move
+    previous = None  # op der letzten Zeile (Notizen zählen nicht)
+
+    for idx, instr in enumerate(instrs):
+        op, args = instr.op, instr.args
+        if op == "note":
+            kept.append((idx, instr))
+            continue
+
+        if op == "move" and args:
+            if (move_args is not None and args[0] == move_args[0]
+                    and (not _is_barrier(args) or _is_barrier(move_args))):
+                rewrites.append(Rewrite(idx, f"Zweite Fahrt zu '{args[0]}' entfernt", COMMAND_OVERHEAD_MS))
+                previous = "move"
+                continue
+            move_args = args
+
+        elif op == "wait" and len(args) == 1:
+            target = move_args[0] if move_args else None
+            if previous == "move" and args[0] == "move_wait":
+                rewrites.append(Rewrite(idx, "move_wait nach Fahrt entfernt", wait_ms(args[0], target) or 0))
+                continue
+            if previous == "wait":
+                last = next(i for i in range(len(kept) - 1, -1, -1) if kept[i][1].op == "wait")
+                last_idx, last_instr = kept[last]
+                if last_instr.args == args and not args[0].isdigit():
+                    rewrites.append(Rewrite(idx, f"Doppelte Wartezeit '{args[0]}' entfernt",
+                                            wait_ms(args[0], target) or 0))
+                    continue
+                before, current = wait_ms(last_instr.args[0], target), wait_ms(args[0], target)
+                if merge_waits and before is not None and current is not None:
+                    if current > before:
+                        kept[last] = (idx, instr)
+                        rewrites.append(Rewrite(last_idx, "Kürzere von zwei Wartezeiten entfernt", before))
+                    else:
+                        rewrites.append(Rewrite(idx, "Kürzere von zwei Wartezeiten entfernt", current))
+                    continue
+
+        kept.append((idx, instr))
+        previous = op
+
+    kept.sort(key=lambda item: item[0])
+    return tuple(instr for _, instr in kept), rewrites
+
+
+def drop_idle_moves(steps):
+    """Entfernt Fahrten zur Position, an der der Schritt davor schon steht; liefert (Schritte, ms)."""
+    result = []
+    saved = 0
+    position = None  # Erst ab der ersten Fahrt im Plan bekannt
+    for step in steps:
+        if step.kind == "move":
+            if step.position == position:
+                saved += COMMAND_OVERHEAD_MS
+                continue
+            position = step.position
+        result.append(step)
+    return tuple(result), saved
+
+
+def diff(instrs, optimized, name=""):
+    """Unified Diff zwischen Original- und optimierten Zeilen."""
+    return list(difflib.unified_diff([i.text for i in instrs], [i.text for i in optimized],
+                                     fromfile=name, tofile=f"{name} (optimiert)", lineterm=""))
@@ -0,0 +1,176 @@
+"""
+Reihenfolgeplaner: sortiert die Ausschank-Blöcke eines Rezepts so um, dass der
+Schlitten möglichst wenig fährt (inklusive der Rückfahrt zur Parkposition).
+
+Ein Block beginnt mit einem move und reicht bis zum nächsten move. Feste
+Punkte, über die nicht hinweg sortiert wird, sind
+- move auf eine Zahl (z.B. "move 10" am Ende),
+- "move <Getränk> fixed" für reihenfolgeabhängige Schritte (Schichtgetränke).
+
+Kosten sind Fahrzeiten aus dem Trapezprofil des Estimators. Bis EXACT_LIMIT
+Blöcke wird exakt (Held-Karp) optimiert, darüber Nächster-Nachbar + 2-opt.
+"""
+from estimator import move_time_ms, estimate_steps, PARK_POSITION
+
+EXACT_LIMIT = 10
+
+
+def _route_cost(order, positions, start_mm, end_mm, config):
+    cost = 0
+    position = start_mm
+    for i in order:
+        cost += move_time_ms(position, positions[i], config)
+        position = positions[i]
+    if end_mm is not None:
+        cost += move_time_ms(position, end_mm, config)
+    return cost
+
+
+def _exact_order(positions, start_mm, end_mm, config):
+    """Held-Karp über alle Teilmengen; O(2^n * n^2)."""
+    n = len(positions)
+    full = (1 << n) - 1
+    # best[(maske, letzter)] = (kosten, vorgänger)
+    best = {}
+    for i in range(n):
+        best[(1 << i, i)] = (move_time_ms(start_mm, positions[i], config), None)
+    for mask in range(1, full + 1):
+        for last in range(n):
+            entry = best.get((mask, last))
+            if entry is None:
+                continue
+            for nxt in range(n):
+                if mask & (1 << nxt):
+                    continue
+                key = (mask | (1 << nxt), nxt)
+                cost = entry[0] + move_time_ms(positions[last], positions[nxt], config)
+                if key not in best or cost < best[key][0]:
+                    best[key] = (cost, last)
+
+    last, total = None, None
+    for i in range(n):
+        cost = best[(full, i)][0]
+        if end_mm is not None:
+            cost += move_time_ms(positions[i], end_mm, config)
+        if total is None or cost < total:
+            last, total = i, cost
+
+    order = []
+    mask = full
+    while last is not None:
+        order.append(last)
+        prev = best[(mask, last)][1]
+        mask &= ~(1 << last)
+        last = prev
+    order.reverse()
+    return order
+
+
+def _heuristic_order(positions, start_mm, end_mm, config):
+    """Nächster Nachbar als Start, danach 2-opt bis keine Verbesserung mehr."""
+    remaining = list(range(len(positions)))
+    order = []
+    position = start_mm
+    while remaining:
+        nxt = min(remaining, key=lambda i: move_time_ms(position, positions[i], config))
+        remaining.remove(nxt)
+        order.append(nxt)
+        position = positions[nxt]
+
+    best_cost = _route_cost(order, positions, start_mm, end_mm, config)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(len(order) - 1):
+            for j in range(i + 1, len(order)):
+                candidate = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+                cost = _route_cost(candidate, positions, start_mm, end_mm, config)
+                if cost < best_cost:
+                    order, best_cost = candidate, cost
+                    improved = True
+    return order
+
+
+def best_order(positions, start_mm=PARK_POSITION, end_mm=None, config=None):
+    """
+    Reihenfolge (Indizes) mit minimaler Fahrzeit über alle Positionen.
+    end_mm ist die Position nach dem letzten Block (None = keine Rückfahrt).
+    Bei Gleichstand bleibt die ursprüngliche Reihenfolge erhalten.
+    """
+    identity = list(range(len(positions)))
+    if len(positions) < 2:
+        return identity
+    if len(positions) <= EXACT_LIMIT:
+        order = _exact_order(positions, start_mm, end_mm, config)
+    else:
+        order = _heuristic_order(positions, start_mm, end_mm, config)
+    if _route_cost(order, positions, start_mm, end_mm, config) < _route_cost(identity, positions, start_mm, end_mm, config):
+        return order
+    return identity
+
+
+def _split_blocks(steps, fixed):
+    """Teilt Schritte in (Vorspann, [(fest, Blockschritte), ...])."""
+    prefix = []
+    blocks = []
+    for idx, step in enumerate(steps):
+        if step.kind == "move":
+            barrier = idx in fixed or str(step.target).isdigit()
+            blocks.append((barrier, [step]))
+        elif blocks:
+            blocks[-1][1].append(step)
+        else:
+            prefix.append(step)
+    return prefix, blocks
+
+
+def order_blocks(positions, barriers, config=None, start_mm=PARK_POSITION, end_mm=None):
+    """
+    Reihenfolge (Indizes) für Blöcke an den gegebenen Positionen. Blöcke mit
+    barriers[i] bleiben an ihrem Platz und trennen die Abschnitte, innerhalb
+    derer umsortiert wird. end_mm ist die Position nach dem letzten Block.
+    """
+    order = []
+    run = []
+    position = start_mm
+
+    def flush(end):
+        if run:
+            order.extend(run[i] for i in best_order([positions[j] for j in run], position, end, config))
+            run.clear()
+
+    for idx, pos in enumerate(positions):
+        if barriers[idx]:
+            flush(pos)
+            order.append(idx)
+            position = pos
+        else:
+            run.append(idx)
+    flush(end_mm)
+    return order
+
+
+def plan_blocks(steps, fixed=(), config=None, start_mm=PARK_POSITION):
+    """
+    Wie plan_order, liefert aber (Vorspann, [(fest, Blockschritte), ...]) in der
+    neuen Reihenfolge, damit der Scheduler die festen Punkte weiter kennt.
+    """
+    prefix, blocks = _split_blocks(steps, set(fixed))
+    positions = [block[0].position for _, block in blocks]
+    barriers = [barrier for barrier, _ in blocks]
+    return prefix, [blocks[idx] for idx in order_blocks(positions, barriers, config, start_mm)]
+
+
+def plan_order(steps, fixed=(), config=None, start_mm=PARK_POSITION):
+    """
+    Sortiert die Blöcke zwischen festen Punkten um. fixed enthält die Indizes der
+    move-Schritte, die als "fixed" markiert sind. Liefert (Schritte, gesparte ms).
+    """
+    prefix, blocks = plan_blocks(steps, fixed, config, start_mm)
+    result = list(prefix)
+    for _, block in blocks:
+        result.extend(block)
+
+    result = tuple(result)
+    saved = estimate_steps(steps, config, start_mm).total_ms - estimate_steps(result, config, start_mm).total_ms
+    return result, max(0, saved)
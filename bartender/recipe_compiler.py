@@ -0,0 +1,544 @@
+"""
+Rezept-Compiler: übersetzt Rezeptdateien (start/move/servo/wait/note/done) in
+einen kompakten Ausführungsplan mit aufgelösten Positionen, Pumpennummern und
+Zeiten in ms. Geparste Dateien und fertige Pläne werden im Speicher gehalten,
+damit Routen und Executor weder lesen noch parsen müssen.
+"""
+import json
+from collections import namedtuple
+from threading import Lock
+
+from estimator import estimate_steps
+import dispensers
+import peephole
+from planner import plan_blocks, plan_order
+from scheduler import interleave_refills
+
+# Schlüssel in der Konfiguration, die keine Getränkepositionen sind
+SETTINGS_KEYS = ["pour_time", "pump_time", "pumpen", "move_wait", "drip_wait", "refill_wait",
+                 "steps_per_mm", "batch_mode", "parallel_pumps", "queue_policy", "interleave_refills",
+                 "dispensers", "peephole", "peephole_merge_waits", "chain_orders", "idle_preposition",
+                 "speculative_preposition", "proportional_refill", "reorder_recipes"]
+# Davon nur für die Ausführung relevant: ändern weder Pläne noch Schätzungen
+RUNTIME_SETTINGS = ["batch_mode", "queue_policy", "chain_orders", "idle_preposition", "speculative_preposition"]
+# Davon auf der Konfigurationsseite bearbeitbar; die übrigen bleiben beim Speichern erhalten
+EDITABLE_SETTINGS = ["pour_time", "move_wait", "drip_wait", "refill_wait"]
+
+WAIT_DEFAULTS = {"move_wait": 500, "drip_wait": 1000, "refill_wait": 5000}
+UNKNOWN_WAIT = 500
+
+# Eine Zeile der Rezeptdatei: Befehl, Argumente und Originaltext
+Instr = namedtuple("Instr", "op args text")
+
+# Ein ausführbarer Schritt. kind ist "move", "servo", "pump", "pumps" oder "wait".
+# duration ist in ms, drip ist die Abtropfzeit nach einem Pumpenlauf.
+# Bei "pumps" (gleichzeitig laufende Pumpen einer Station) ist pump ein Tupel
+# aus (Pumpennummer, Dauer), duration die längste Laufzeit. Bei "wait" ist
+# target der Platzhalter (z.B. "refill_wait"), falls die Zeile einen verwendet.
+Step = namedtuple("Step", "kind target position pump duration drip")
+
+# Fertiger Ausführungsplan eines Rezepts; est_ms ist die geschätzte Dauer ab Parkposition,
+# deps die Konfigurationsschlüssel (und Getränkenamen), von denen der Plan abhängt,
+# saved_ms die durch Umsortieren, verschränkte Nachfüllpausen und parallele Pumpen gesparte Zeit,
+# peephole_ms die durch den Peephole-Optimierer gesparte (est_ms ohne Optimierer minus est_ms)
+Plan = namedtuple("Plan", "name steps ingredients notes valid reasons drinks pumps est_ms deps saved_ms peephole_ms")
+
+# Markiert gecachte Pläne, die eine Konfigurationsänderung unverändert überstanden haben
+_CURRENT = object()
+
+# Geparstes Rezept: Quelltext, Zeilen und Revision im RecipeStore
+Program = namedtuple("Program", "source instrs stamp")
+
+
+def drink_names(config):
+    """Alle Getränkenamen aus der Konfiguration (Positionen und Pumpen)."""
+    names = [
+        key for key in config.keys()
+        if not key.startswith("pump") and key not in SETTINGS_KEYS
+    ]
+    for i in range(1, 5):
+        pump_drink = config.get(f"pump{i}")
+        if pump_drink and pump_drink not in names:
+            names.append(pump_drink)
+    return names
+
+
+def pump_for(config, target):
+    """Pumpennummer für ein Getränk oder None."""
+    if not target:
+        return None
+    return next((i for i in range(1, 5) if config.get(f"pump{i}") == target), None)
+
+
+def drink_position(config, target):
+    """Position eines Getränks in mm (Flasche oder Pumpe) oder None."""
+    if target.isdigit():
+        return int(target)
+    if target in config:
+        return config[target]
+    pump_number = pump_for(config, target)
+    if pump_number is None:
+        return None
+    return config.get(f"pump{pump_number}_position", 250)
+
+
+def resolve_wait(value, config):
+    """Löst einen wait-Wert (Zahl oder Platzhalter) in ms auf."""
+    if value.isdigit():
+        return int(value)
+    if value in WAIT_DEFAULTS:
+        return config.get(value, WAIT_DEFAULTS[value])
+    return UNKNOWN_WAIT
+
+
+def touched_keys(changed_keys, old_config, new_config):
+    """
+    Übersetzt geänderte Konfigurationsschlüssel in die Abhängigkeiten, die sie
+    berühren. Bei einer geänderten Pumpenbelegung (pumpN) sind auch das alte
+    und das neue Getränk betroffen. "*" steht für eine globale Einstellung, die
+    Pläne oder Schätzungen ändert; RUNTIME_SETTINGS berühren keinen Plan.
+    """
+    touched = set(changed_keys)
+    for key in changed_keys:
+        if key in RUNTIME_SETTINGS:
+            continue
+        if key in SETTINGS_KEYS:
+            touched.add("*")
+        elif key.startswith("pump") and key[4:].isdigit():
+            for value in (old_config.get(key), new_config.get(key)):
+                if value:
+                    touched.add(value)
+    return touched
+
+
+def is_affected(plan, touched):
+    return "*" in touched or not plan.deps.isdisjoint(touched)
+
+
+def parse_recipe(source):
+    """Zerlegt den Quelltext eines Rezepts in Instr-Tupel (ohne Konfiguration)."""
+    instrs = []
+    for line in source.splitlines():
+        text = line.strip()
+        if not text:
+            continue
+        parts = text.split()
+        op = parts[0]
+        if op == "note":
+            instrs.append(Instr("note", (text[len("note"):].strip(),), text))
+        else:
+            instrs.append(Instr(op, tuple(parts[1:]), text))
+    return tuple(instrs)
+
+
+def _ingredient_totals(instrs):
+    totals = {}
+    current = None
+    for instr in instrs:
+        if instr.op == "move" and instr.args:
+            current = instr.args[0]
+        elif instr.op == "servo" and len(instr.args) >= 2 and instr.args[0] == "cl" and current:
+            try:
+                totals[current] = totals.get(current, 0.0) + float(instr.args[1])
+            except ValueError:
+                pass
+    return totals
+
+
+def _cl_amount(instr):
+    """Menge einer "servo cl"-Zeile oder None."""
+    if instr.op != "servo" or len(instr.args) < 2 or instr.args[0] != "cl":
+        return None
+    try:
+        return float(instr.args[1])
+    except ValueError:
+        return None
+
+
+def rechunk(instrs, scale, config):
+    """
+    Teilt Blöcke skalierter Zutaten aus Flaschen neu in Portionen auf, damit
+    keine Portion die Kammer des Portionierers übersteigt. Umgeschrieben werden
+    nur Blöcke aus servo cl und Wartezeiten (wie von generate_recipe erzeugt).
+    Liefert (Zeilen, neu aufgeteilte Zutaten).
+    """
+    # Vorspann und Blöcke (move-Zeile, Zeilen bis zum nächsten move), Rest ab done
+    head, blocks, tail = [], [], []
+    for instr in instrs:
+        if tail or instr.op == "done":
+            tail.append(instr)
+        elif instr.op == "move":
+            blocks.append((instr, []))
+        elif blocks:
+            blocks[-1][1].append(instr)
+        else:
+            head.append(instr)
+
+    plain = {}
+    for move, body in blocks:
+        target = move.args[0] if move.args else None
+        if target in scale and pump_for(config, target) is None:
+            simple = all(i.op == "wait" or _cl_amount(i) is not None for i in body)
+            plain[target] = plain.get(target, True) and simple
+    targets = {target for target, simple in plain.items() if simple}
+
+    output = list(head)
+    for move, body in blocks:
+        output.append(move)
+        target = move.args[0] if move.args else None
+        if target not in targets:
+            output.extend(body)
+            continue
+        lead = []
+        for instr in body:
+            if instr.op != "wait":
+                break
+            lead.append(instr)
+        volume = sum(_cl_amount(i) for i in body if i.op == "servo") * scale[target]
+        lines = dispensers.recipe_lines(volume, dispensers.profile(config, target), dispensers.proportional(config))
+        output.extend(lead)
+        output.extend(parse_recipe("\n".join(lines)))
+    output.extend(tail)
+    return tuple(output), targets
+
+
+def wait_resolver(config):
+    """wait_ms(wert, ziel) für peephole: Wartezeit am aktuellen Getränk, None falls erst beim Kompilieren bekannt."""
+    def wait_ms(value, target):
+        bottle = target and not target.isdigit() and pump_for(config, target) is None
+        if bottle and value == "refill_wait":
+            # Hängt von der Menge der vorigen Portion ab (siehe dispensers)
+            return None
+        if bottle and value == "drip_wait":
+            return dispensers.profile(config, target).drip_ms
+        return resolve_wait(value, config)
+    return wait_ms
+
+
+def optimize_program(instrs, config):
+    """Peephole-Optimierung der Zeilen, falls eingeschaltet; liefert (Zeilen, [Rewrite, ...])."""
+    if not config.get("peephole", True):
+        return instrs, []
+    return peephole.optimize(instrs, wait_resolver(config), config.get("peephole_merge_waits", False))
+
+
+def compile_program(instrs, config, name="", amount_overrides=None, skip_targets=None, plan=None):
+    """
+    Erzeugt einen Plan aus geparsten Zeilen.
+
+    amount_overrides: {Getränk: cl} setzt die Gesamtmenge einer Zutat neu. Blöcke
+    aus Flaschen, die nur aus servo cl und Wartezeiten bestehen, werden nach dem
+    Portionierer-Profil neu aufgeteilt (siehe dispensers), bei allen anderen
+    werden die einzelnen servo-cl-Portionen anteilig skaliert.
+    skip_targets: Getränke, deren Block (move bis zum nächsten move) entfällt.
+    plan: Blöcke zwischen festen Punkten nach Fahrweg umsortieren (siehe planner)
+    und Nachfüllpausen verschränken (siehe scheduler). Standard ist der Schalter
+    "reorder_recipes" (aus): gespeicherte Rezepte ohne "fixed" behalten so ihre
+    Reihenfolge, generierte sind schon beim Erzeugen nach Fahrweg sortiert.
+    Vorher entfernt der Peephole-Optimierer überflüssige Zeilen (Schalter "peephole").
+    """
+    names = drink_names(config)
+    if plan is None:
+        plan = config.get("reorder_recipes", False)
+
+    original = instrs
+    scale = {}
+    if amount_overrides:
+        for ing, total in _ingredient_totals(instrs).items():
+            if ing in amount_overrides and total > 0:
+                scale[ing] = float(amount_overrides[ing]) / total
+        instrs, rechunked = rechunk(instrs, scale, config)
+        for ing in rechunked:
+            del scale[ing]
+    instrs, rewrites = optimize_program(instrs, config)
+
+    steps = []
+    ingredients = {}
+    notes = []
+    reasons = []
+    drinks = set()
+    pumps = set()
+    deps = set()
+    has_move_to_drink = False
+    fixed = set()  # Indizes der move-Schritte mit "fixed"
+
+    current_target = None
+    last_cl = None  # Menge der letzten Portion an der aktuellen Flasche
+    skipping = False
+    pending_pump = None  # [pump_number, dauer, abtropfzeit, ziel]
+
+    def flush_pump():
+        nonlocal pending_pump
+        if pending_pump and pending_pump[1] > 0:
+            pump_number, duration, drip, target = pending_pump
+            steps.append(Step("pump", target, None, pump_number, duration, drip))
+        pending_pump = None
+
+    for instr in instrs:
+        op, args = instr.op, instr.args
+
+        if op == "done":
+            break
+
+        if op == "note":
+            if args[0]:
+                notes.append(args[0])
+            continue
+
+        if op == "move":
+            flush_pump()
+            last_cl = None
+            if not (len(args) == 1 or (len(args) == 2 and args[1] == "fixed")):
+                reasons.append(f"Ungültiger move-Befehl: {instr.text}")
+                skipping = False
+                continue
+            target = args[0]
+            skipping = bool(skip_targets) and target in skip_targets
+            if skipping:
+                continue
+
+            if target in names:
+                has_move_to_drink = True
+            if len(args) == 2:
+                fixed.add(len(steps))
+
+            if not target.isdigit():
+                deps.add(target)
+
+            if target.isdigit():
+                steps.append(Step("move", target, int(target), None, 0, 0))
+                current_target = None
+            elif target in config:
+                drinks.add(target)
+                steps.append(Step("move", target, config[target], None, 0, 0))
+                current_target = target
+            else:
+                pump_number = pump_for(config, target)
+                if pump_number is None:
+                    reasons.append(f"Kein Eintrag für '{target}' in der Konfiguration")
+                    continue
+                drinks.add(target)
+                deps.update((f"pump{pump_number}", f"pump{pump_number}_position", f"pump{pump_number}_time"))
+                position = config.get(f"pump{pump_number}_position", 250)
+                steps.append(Step("move", target, position, None, 0, 0))
+                current_target = target
+            continue
+
+        if skipping:
+            continue
+
+        if op == "servo":
+            if len(args) < 2:
+                reasons.append(f"Ungültiger servo-Befehl: {instr.text}")
+                continue
+            mode, value = args[0], args[1]
+            if mode == "ms":
+                if not value.isdigit():
+                    reasons.append(f"Ungültiger servo ms-Wert: {instr.text}")
+                    continue
+                if current_target:
+                    steps.append(Step("servo", current_target, None, None, int(value), 0))
+            elif mode == "cl":
+                try:
+                    cl = float(value)
+                except ValueError:
+                    reasons.append(f"Ungültiger servo cl-Wert: {instr.text}")
+                    continue
+                if "pour_time" not in config:
+                    reasons.append("Kein 'pour_time' in der Konfiguration für 'servo cl'")
+                if not current_target:
+                    continue
+                cl *= scale.get(current_target, 1.0)
+                ingredients[current_target] = ingredients.get(current_target, 0.0) + cl
+                pump_number = pump_for(config, current_target)
+                if pump_number:
+                    pumps.add(pump_number)
+                    pump_time_specific = config.get(f"pump{pump_number}_time", 1000)
+                    if pending_pump is None:
+                        pending_pump = [pump_number, 0, 0, current_target]
+                    pending_pump[1] += int(cl * pump_time_specific)
+                else:
+                    delay = int(cl * dispensers.profile(config, current_target).ms_per_cl)
+                    steps.append(Step("servo", current_target, None, None, delay, 0))
+                    last_cl = cl
+            else:
+                reasons.append(f"Unbekannter servo Modus: {mode}")
+            continue
+
+        if op == "wait":
+            if len(args) != 1:
+                continue
+            duration = resolve_wait(args[0], config)
+            if (current_target and not pending_pump and args[0] in ("refill_wait", "drip_wait")
+                    and pump_for(config, current_target) is None):
+                # Nachfüll- und Abtropfzeit aus dem Profil der Flasche
+                dispenser = dispensers.profile(config, current_target)
+                if args[0] == "drip_wait":
+                    duration = dispenser.drip_ms
+                elif last_cl is not None:
+                    duration = dispensers.refill_ms(dispenser, last_cl, dispensers.proportional(config))
+                else:
+                    duration = dispenser.refill_ms
+            if pending_pump:
+                # Während einer Pumpenaggregation gilt die Wartezeit als Abtropfzeit
+                pending_pump[2] = duration
+            else:
+                steps.append(Step("wait", args[0] if args[0] in WAIT_DEFAULTS else None, None, None, duration, 0))
+            continue
+
+    flush_pump()
+
+    if not has_move_to_drink:
+        reasons.append("Keine 'move' Befehle zu gültigen Getränken vorhanden.")
+
+    steps = tuple(steps)
+    saved_ms = 0
+    idle_ms = 0
+    if not reasons:
+        unplanned_ms = estimate_steps(steps, config).total_ms
+        if plan and config.get("interleave_refills", True):
+            # Umsortieren und Nachfüllpausen mit anderen Zutaten füllen (siehe scheduler)
+            steps = interleave_refills(*plan_blocks(steps, fixed, config), config=config)
+        elif plan:
+            steps, _ = plan_order(steps, fixed, config)
+        if config.get("parallel_pumps", True):
+            steps = merge_pump_groups(steps)
+        saved_ms = max(0, unplanned_ms - estimate_steps(steps, config).total_ms)
+        if config.get("peephole", True):
+            steps, idle_ms = peephole.drop_idle_moves(steps)
+    est_ms = estimate_steps(steps, config).total_ms
+
+    peephole_ms = 0
+    if rewrites or idle_ms:
+        # Gleiche Schätzung wie est_ms: derselbe Plan ohne Optimierer, damit Anzeige und Schätzung übereinstimmen
+        unoptimized = compile_program(original, dict(config, peephole=False), name=name,
+                                      amount_overrides=amount_overrides, skip_targets=skip_targets, plan=plan)
+        peephole_ms = max(0, unoptimized.est_ms - est_ms)
+    return Plan(
+        name=name,
+        steps=steps,
+        ingredients=tuple(ingredients.items()),
+        notes=tuple(notes),
+        valid=not reasons,
+        reasons=tuple(reasons),
+        drinks=frozenset(drinks),
+        pumps=frozenset(pumps),
+        est_ms=est_ms,
+        deps=frozenset(deps),
+        saved_ms=saved_ms,
+        peephole_ms=peephole_ms,
+    )
+
+
+def merge_pump_groups(steps):
+    """
+    Fasst Pumpenläufe an derselben Station zu einem "pumps"-Schritt zusammen:
+    alle Pumpen starten gleichzeitig, gewartet wird nur auf die längste.
+    Dazwischenliegende Fahrten ohne Weg und deren Wartezeiten entfallen.
+    """
+    merged = []
+    position = None
+    group = None  # Index des letzten Pumpenschritts in merged
+    pending = []  # Schritte seit dem letzten Pumpenschritt (nur Waits/Fahrten ohne Weg)
+
+    for step in steps:
+        if step.kind == "move":
+            if group is not None and step.position == position:
+                pending.append(step)
+                continue
+            position = step.position
+            group = None
+        elif step.kind == "wait" and group is not None:
+            pending.append(step)
+            continue
+        elif step.kind == "pump" and group is not None:
+            current = merged[group]
+            runs = current.pump if current.kind == "pumps" else ((current.pump, current.duration),)
+            if step.pump not in {number for number, _ in runs}:
+                runs = runs + ((step.pump, step.duration),)
+                targets = current.target.split(" + ") + [step.target]
+                merged[group] = Step("pumps", " + ".join(targets), None, runs,
+                                     max(duration for _, duration in runs), max(current.drip, step.drip))
+                pending = []
+                continue
+
+        merged.extend(pending)
+        pending = []
+        merged.append(step)
+        group = len(merged) - 1 if step.kind == "pump" else None
+
+    merged.extend(pending)
+    return tuple(merged)
+
+
+class RecipeCompiler:
+    """Cache für geparste Rezepte aus dem RecipeStore und kompilierte Pläne."""
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = Lock()
+        self._programs = {}  # Rezeptname -> Program
+        self._plans = {}  # Rezeptname -> (stamp, config_key, Plan)
+        self._latest_version = None  # Neueste Konfigurationsversion, die plan() gesehen hat
+
+    def load(self, name):
+        """Liefert das geparste Programm; neu gelesen wird nur bei geänderter Revision (KeyError, wenn unbekannt)."""
+        stamp = self.store.revision(name)
+        with self._lock:
+            program = self._programs.get(name)
+            if program is not None and program.stamp == stamp:
+                return program
+        stamp, source = self.store.source(name)
+        program = Program(source, parse_recipe(source), stamp)
+        with self._lock:
+            self._programs[name] = program
+        return program
+
+    def plan(self, name, config, config_version=None):
+        """
+        Liefert den (gecachten) Plan eines Rezepts für die aktuelle Konfiguration.
+        Mit config_version (aus dem ConfigStore) entfällt das Serialisieren der
+        Konfiguration als Cache-Schlüssel.
+        """
+        program = self.load(name)
+        config_key = config_version if config_version is not None else json.dumps(config, sort_keys=True)
+        with self._lock:
+            if config_version is not None and (self._latest_version is None or config_version > self._latest_version):
+                self._latest_version = config_version
+            cached = self._plans.get(name)
+            if (cached is not None and cached[0] == program.stamp
+                    and (cached[1] == config_key or (config_version is not None and cached[1] is _CURRENT))):
+                return cached[2]
+        plan = compile_program(program.instrs, config, name=name)
+        with self._lock:
+            self._plans[name] = (program.stamp, config_key, plan)
+        return plan
+
+    def variant(self, name, config, amount_overrides=None, skip_targets=None):
+        """Einmaliger Plan mit angepassten Mengen oder ausgelassenen Zutaten (nicht gecacht)."""
+        program = self.load(name)
+        return compile_program(program.instrs, config, name=name,
+                               amount_overrides=amount_overrides, skip_targets=skip_targets)
+
+    def on_config_change(self, changed_keys, old_config, new_config):
+        """
+        ConfigStore-Abonnent: betroffene Pläne verwerfen, alle anderen bleiben
+        für die neue Konfigurationsversion gültig.
+        """
+        touched = touched_keys(changed_keys, old_config, new_config)
+        with self._lock:
+            for name, (stamp, key, plan) in list(self._plans.items()):
+                fresh = key is _CURRENT or (key is not None and key == self._latest_version)
+                if not fresh or is_affected(plan, touched):
+                    del self._plans[name]
+                else:
+                    self._plans[name] = (stamp, _CURRENT, plan)
+
+    def invalidate(self, name=None):
+        with self._lock:
+            if name is None:
+                self._programs.clear()
+                self._plans.clear()
+            else:
+                self._programs.pop(name, None)
+                self._plans.pop(name, None)
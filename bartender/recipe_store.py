@@ -0,0 +1,302 @@
+"""
+Rezeptspeicher in SQLite.
+
+Jedes Rezept ist eine Zeile mit Quelltext (im bisherigen .txt-Format) und
+einer Revision; daneben liegen die zuletzt kompilierten Metadaten (gültig,
+geschätzte Dauer, Gesamtmenge, Zutaten). Zutaten stehen zusätzlich in einer
+eigenen, indizierten Tabelle, damit Auflisten und Filtern nach Name oder
+Zutat auch bei Tausenden Rezepten ohne Lesen der Quelltexte auskommt.
+
+Schreiben läuft in Transaktionen. Jeder Schreibvorgang erhöht die Generation
+(PRAGMA user_version); die Revision eines Rezepts ist die Generation seines
+letzten Speicherns, damit eignet sie sich als Cache-Stempel.
+
+Der Rezeptname bleibt der bisherige Dateiname ("Mojito.txt"). Import und
+Export von/in einen Ordner mit .txt-Dateien:
+    python recipe_store.py import Rezepte
+    python recipe_store.py export Rezepte
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+import logs
+
+log = logs.get("recipe_store")
+
+SUFFIX = ".txt"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recipes (
+    name     TEXT PRIMARY KEY,
+    source   TEXT NOT NULL,
+    revision INTEGER NOT NULL,
+    updated  REAL NOT NULL,
+    -- Metadaten der letzten Bewertung (NULL, solange nicht kompiliert)
+    meta_revision INTEGER,
+    valid    INTEGER,
+    est_ms   INTEGER,
+    total_cl REAL,
+    meta     TEXT
+);
+CREATE TABLE IF NOT EXISTS recipe_ingredients (
+    recipe     TEXT NOT NULL REFERENCES recipes(name) ON DELETE CASCADE,
+    ingredient TEXT NOT NULL,
+    amount_cl  REAL NOT NULL,
+    PRIMARY KEY (recipe, ingredient)
+);
+CREATE INDEX IF NOT EXISTS recipe_ingredients_by_ingredient ON recipe_ingredients (ingredient);
+CREATE INDEX IF NOT EXISTS recipes_by_valid ON recipes (valid, name);
+"""
+
+
+class RecipeStore:
+    def __init__(self, path):
+        self.path = path
+        self._lock = Lock()
+        # Transaktionen explizit über _transaction(), sonst Autocommit
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA foreign_keys=ON")
+            self._db.executescript(SCHEMA)
+
+    # --------------------------------------------------------------- Abfrage
+
+    @property
+    def generation(self):
+        """Steigt bei jeder Änderung; zum günstigen Erkennen neuer oder gelöschter Rezepte."""
+        with self._lock:
+            return self._db.execute("PRAGMA user_version").fetchone()[0]
+
+    def names(self):
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT name FROM recipes ORDER BY name")]
+
+    def exists(self, name):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM recipes WHERE name = ?", (name,)).fetchone() is not None
+
+    def revision(self, name):
+        """Revision eines Rezepts; KeyError, wenn es nicht existiert."""
+        with self._lock:
+            row = self._db.execute("SELECT revision FROM recipes WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            raise KeyError(name)
+        return row[0]
+
+    def source(self, name):
+        """(Revision, Quelltext); KeyError, wenn es nicht existiert."""
+        with self._lock:
+            row = self._db.execute("SELECT revision, source FROM recipes WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            raise KeyError(name)
+        return row["revision"], row["source"]
+
+    def listing(self, ingredient=None, search=None, valid=None):
+        """
+        Rezepte mit Metadaten, ohne Quelltext. Filter: enthält die Zutat,
+        Name enthält search (ohne Groß-/Kleinschreibung), gültig ja/nein.
+        """
+        query = "SELECT name, revision, updated, meta_revision, valid, est_ms, total_cl, meta FROM recipes"
+        where, args = [], []
+        if ingredient:
+            where.append("name IN (SELECT recipe FROM recipe_ingredients WHERE ingredient = ?)")
+            args.append(ingredient)
+        if search:
+            where.append("name LIKE ? ESCAPE '\\'")
+            args.append("%" + search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        if valid is not None:
+            where.append("valid = ?")
+            args.append(int(bool(valid)))
+        condition = " WHERE " + " AND ".join(where) if where else ""
+        with self._lock:
+            rows = self._db.execute(query + condition + " ORDER BY name", args).fetchall()
+            amounts = {}
+            for row in self._db.execute("SELECT recipe, ingredient, amount_cl FROM recipe_ingredients"
+                                        f" WHERE recipe IN (SELECT name FROM recipes{condition}) ORDER BY rowid", args):
+                amounts.setdefault(row[0], []).append((row[1], row[2]))
+        return [_entry(row, amounts.get(row["name"], [])) for row in rows]
+
+    def ingredients(self):
+        """Alle Zutaten mit der Anzahl Rezepte, in denen sie vorkommen."""
+        with self._lock:
+            return {row[0]: row[1] for row in self._db.execute(
+                "SELECT ingredient, COUNT(*) FROM recipe_ingredients GROUP BY ingredient ORDER BY ingredient")}
+
+    def healthy(self):
+        try:
+            with self._lock:
+                self._db.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    # ------------------------------------------------------------ Ändern
+
+    def save(self, name, source):
+        """Legt ein Rezept an oder ersetzt es; liefert die neue Revision."""
+        with self._transaction():
+            revision = self._bump()
+            self._db.execute(
+                "INSERT INTO recipes (name, source, revision, updated) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(name) DO UPDATE SET source = excluded.source, revision = excluded.revision,"
+                " updated = excluded.updated",
+                (name, source, revision, time.time()))
+        return revision
+
+    def delete(self, name):
+        """Löscht ein Rezept; liefert die neue Generation oder None, wenn es nicht existiert."""
+        with self._transaction():
+            if self._db.execute("DELETE FROM recipes WHERE name = ?", (name,)).rowcount == 0:
+                return None
+            return self._bump()
+
+    def set_meta(self, name, revision, valid, est_ms, ingredients, **extra):
+        """
+        Kompilierte Metadaten zu einer Revision ablegen. Ist das Rezept
+        inzwischen neuer oder stehen genau diese Werte schon da, wird nichts
+        geschrieben (False).
+        """
+        ingredients = list(ingredients)
+        values = (revision, int(bool(valid)), int(est_ms), round(sum(cl for _, cl in ingredients), 3),
+                  json.dumps(extra, sort_keys=True))
+        with self._lock:
+            row = self._db.execute("SELECT meta_revision, valid, est_ms, total_cl, meta FROM recipes"
+                                   " WHERE name = ?", (name,)).fetchone()
+        # Zutaten hängen nur am Quelltext, sind bei gleicher Revision also unverändert
+        if row is None or tuple(row) == values:
+            return False
+        with self._transaction():
+            updated = self._db.execute(
+                "UPDATE recipes SET meta_revision = ?, valid = ?, est_ms = ?, total_cl = ?, meta = ?"
+                " WHERE name = ? AND revision = ?", values + (name, revision)).rowcount > 0
+            if updated:
+                self._db.execute("DELETE FROM recipe_ingredients WHERE recipe = ?", (name,))
+                # Gleiche Zutat mehrfach im Rezept: Mengen zusammenzählen
+                self._db.executemany(
+                    "INSERT INTO recipe_ingredients (recipe, ingredient, amount_cl) VALUES (?, ?, ?)"
+                    " ON CONFLICT(recipe, ingredient) DO UPDATE SET amount_cl = amount_cl + excluded.amount_cl",
+                    [(name, ingredient, cl) for ingredient, cl in ingredients])
+        return updated
+
+    # --------------------------------------------------- Import und Export
+
+    def import_folder(self, folder, overwrite=True):
+        """Liest alle .txt-Dateien eines Ordners in einer Transaktion ein; liefert die Anzahl."""
+        recipes = {}
+        for filename in sorted(os.listdir(folder)):
+            if filename.endswith(SUFFIX):
+                with open(os.path.join(folder, filename), "r") as file:
+                    recipes[filename] = file.read()
+        if not recipes:
+            return 0
+        with self._transaction():
+            if not overwrite:
+                existing = {row[0] for row in self._db.execute("SELECT name FROM recipes")}
+                recipes = {name: source for name, source in recipes.items() if name not in existing}
+                if not recipes:
+                    return 0
+            revision = self._bump()
+            now = time.time()
+            self._db.executemany(
+                "INSERT INTO recipes (name, source, revision, updated) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(name) DO UPDATE SET source = excluded.source, revision = excluded.revision,"
+                " updated = excluded.updated",
+                [(name, source, revision, now) for name, source in recipes.items()])
+        log.info("%d Rezepte aus '%s' importiert.", len(recipes), folder)
+        return len(recipes)
+
+    def newer_files(self, folder):
+        """
+        .txt-Dateien im Ordner, die nach dem letzten Speichern ihres Rezepts
+        geändert wurden (neue Dateien: nach dem letzten Speichern überhaupt).
+        Sie werden nicht automatisch übernommen.
+        """
+        with self._lock:
+            updated = {row[0]: row[1] for row in self._db.execute("SELECT name, updated FROM recipes")}
+        since = max(updated.values(), default=0)
+        return sorted(filename for filename in os.listdir(folder) if filename.endswith(SUFFIX)
+                      and os.path.getmtime(os.path.join(folder, filename)) > updated.get(filename, since))
+
+    def export_folder(self, folder):
+        """
+        Schreibt jedes Rezept als .txt-Datei in den Ordner; liefert die Anzahl.
+        Änderungszeit der Datei ist die des Rezepts, damit newer_files sie nicht meldet.
+        """
+        os.makedirs(folder, exist_ok=True)
+        with self._lock:
+            rows = self._db.execute("SELECT name, source, updated FROM recipes ORDER BY name").fetchall()
+        for name, source, updated in rows:
+            filename = os.path.basename(name)
+            if not filename.endswith(SUFFIX):
+                filename += SUFFIX
+            path = os.path.join(folder, filename)
+            with open(path, "w") as file:
+                file.write(source)
+            os.utime(path, (updated, updated))
+        return len(rows)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    # --------------------------------------------------------------- Intern
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def _bump(self):
+        """Neue Generation innerhalb der laufenden Transaktion (Lock gehalten)."""
+        generation = self._db.execute("PRAGMA user_version").fetchone()[0] + 1
+        self._db.execute(f"PRAGMA user_version = {generation:d}")
+        return generation
+
+
+def _entry(row, ingredients):
+    entry = {
+        "name": row["name"],
+        "revision": row["revision"],
+        "updated": row["updated"],
+        "compiled": row["meta_revision"] == row["revision"],
+        "valid": None if row["valid"] is None else bool(row["valid"]),
+        "est_ms": row["est_ms"],
+        "total_cl": row["total_cl"],
+        "ingredients": [{"name": name, "amount": cl} for name, cl in ingredients],
+    }
+    entry.update(json.loads(row["meta"]) if row["meta"] else {})
+    return entry
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rezepte zwischen SQLite-Speicher und .txt-Dateien übertragen")
+    parser.add_argument("action", choices=("import", "export"))
+    parser.add_argument("folder", help="Ordner mit .txt-Rezepten")
+    parser.add_argument("--db", default="recipes.db", help="Pfad der Datenbank")
+    parser.add_argument("--keep", action="store_true", help="Beim Import vorhandene Rezepte nicht überschreiben")
+    args = parser.parse_args()
+
+    store = RecipeStore(args.db)
+    if args.action == "import":
+        count = store.import_folder(args.folder, overwrite=not args.keep)
+    else:
+        count = store.export_folder(args.folder)
+    store.close()
+    print(f"{count} Rezepte {'importiert' if args.action == 'import' else 'exportiert'}.")
+
+
+if __name__ == "__main__":
+    main()
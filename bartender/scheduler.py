@@ -0,0 +1,205 @@
+"""
+Nachfüll-Scheduler: nutzt die Nachfüllzeiten der Portionierer für andere Zutaten.
+
+Mengen über 2 cl werden als mehrere "servo cl 2" ausgeschenkt, nach jeder
+Portion folgt "wait refill_wait", bis der Portionierer wieder voll ist. Statt
+so lange an der Flasche zu stehen, fährt der Schlitten zu einer anderen
+offenen Zutat, schenkt dort aus und kommt zurück, sobald die erste Flasche
+wieder bereit ist.
+
+Zerlegt werden nur Blöcke der Form
+    move, Wartezeiten, servo, wait refill_wait, servo, ..., servo, Wartezeiten
+mit einer Abtropfzeit (drip_wait) am Ende. Alles andere (Pumpen, servo ms,
+eigene Wartezeiten) bleibt ein unteilbarer Block, kann aber eine Lücke füllen.
+Verlässt der Schlitten eine Flasche vor der letzten Portion, wird vorher die
+Abtropfzeit des Blocks abgewartet; bei der Rückkehr kommt die Wartezeit nach
+der Fahrt (move_wait) erneut dazu. Die Nachfüllzeit läuft pro Flasche ab dem
+Ende der Portion, auch über mehrere Blöcke derselben Flasche hinweg.
+
+Feste Punkte (siehe planner) bleiben an ihrem Platz; verschränkt wird nur
+innerhalb der Abschnitte dazwischen. Die Reihenfolge wählt eine Vorausschau:
+für jeden möglichen nächsten Schritt wird der Rest gierig (frühestes Ende)
+zu Ende geplant und der Kandidat mit der kürzesten Gesamtzeit genommen. Das
+Ergebnis wird nur übernommen, wenn es laut Estimator schneller ist.
+"""
+from collections import namedtuple
+
+from estimator import step_time_ms, estimate_steps, PARK_POSITION
+
+# Darüber (Portionen pro Abschnitt) nur noch gierig ohne Vorausschau
+LOOKAHEAD_LIMIT = 40
+
+# Eine Flasche im Abschnitt: Fahrt, Wartezeiten danach, Portionen (je ein Tupel
+# von Schritten), Nachfüllzeiten zwischen den Portionen in ms, Schritte nach der
+# letzten Portion und der Warteschritt, der als Vorlage für Nachfüllpausen dient
+Station = namedtuple("Station", "move head units gaps tail refill")
+
+# Zustand der Simulation: Zeit in ms, aktuelle Station (None = Startposition),
+# nächste Portion je Station, Zeitpunkt je Flasche, ab dem sie wieder bereit ist
+State = namedtuple("State", "t at next ready")
+
+
+def _is_wait(step, name=None):
+    return step.kind == "wait" and (name is None or step.target == name)
+
+
+def station(block):
+    """Zerlegt einen Block (move bis zum nächsten move) in Portionen."""
+    move, rest = block[0], tuple(block[1:])
+    atomic = Station(move, (), (rest,), (), (), None)
+
+    i = 0
+    while i < len(rest) and _is_wait(rest[i]):
+        i += 1
+    head = rest[:i]
+    units, gaps, refill = [], [], None
+    while i < len(rest) and rest[i].kind == "servo":
+        units.append((rest[i],))
+        i += 1
+        if i + 1 < len(rest) and _is_wait(rest[i], "refill_wait") and rest[i + 1].kind == "servo":
+            gaps.append(rest[i].duration)
+            refill = refill or rest[i]
+            i += 1
+    tail = rest[i:]
+    if (len(units) < 2 or not all(_is_wait(step) for step in tail)
+            or not any(_is_wait(step, "drip_wait") for step in tail)):
+        return atomic
+    return Station(move, head, tuple(units), tuple(gaps), tail, refill)
+
+
+class _Segment:
+    """Verschränkt die Stationen zwischen zwei festen Punkten."""
+
+    def __init__(self, stations, start_mm, end_move, config):
+        self.stations = stations
+        self.config = config
+        count = len(stations)
+        # Gleiche Flasche -> gleicher Nachfüll-Timer
+        targets = []
+        for st in stations:
+            if st.move.target not in targets:
+                targets.append(st.move.target)
+        self.bottle = [targets.index(st.move.target) for st in stations]
+        self.refill = {}
+        for idx, st in enumerate(stations):
+            if st.refill is not None:
+                self.refill.setdefault(self.bottle[idx], st.refill)
+
+        positions = [st.move.position for st in stations] + [start_mm]
+        # travel[von][nach]; Index count steht für die Startposition
+        self.travel = [[self._ms(stations[to].move, positions[frm]) for to in range(count)]
+                       for frm in range(count + 1)]
+        self.finish = [self._ms(end_move, positions[frm]) if end_move is not None else 0
+                       for frm in range(count + 1)]
+        self.head_ms = [sum(self._ms(step) for step in st.head) for st in stations]
+        self.tail_ms = [sum(self._ms(step) for step in st.tail) for st in stations]
+        self.unit_ms = [[sum(self._ms(step) for step in unit) for unit in st.units] for st in stations]
+        self.start = State(0, None, tuple(0 for _ in stations), tuple(0 for _ in targets))
+
+    def _ms(self, step, position=None):
+        return step_time_ms(step, position, self.config)[0]
+
+    def _open(self, state):
+        return [idx for idx, st in enumerate(self.stations) if state.next[idx] < len(st.units)]
+
+    def visit(self, state, idx, out=None):
+        """Nächste Portion an Station idx; hängt die Schritte an out an, falls angegeben."""
+        t, at = state.t, state.at
+        st = self.stations[idx]
+        if at != idx:
+            if at is not None and state.next[at] < len(self.stations[at].units):
+                # Flasche vor der letzten Portion verlassen: erst abtropfen lassen
+                t += self.tail_ms[at]
+                if out is not None:
+                    out.extend(self.stations[at].tail)
+            t += self.travel[len(self.stations) if at is None else at][idx] + self.head_ms[idx]
+            if out is not None:
+                out.append(st.move)
+                out.extend(st.head)
+
+        bottle = self.bottle[idx]
+        wait = state.ready[bottle] - t
+        if wait > 0:
+            t += wait
+            if out is not None:
+                out.append(self.refill[bottle]._replace(duration=wait))
+
+        k = state.next[idx]
+        t += self.unit_ms[idx][k]
+        if out is not None:
+            out.extend(st.units[k])
+        ready = list(state.ready)
+        if st.gaps:
+            ready[bottle] = t + st.gaps[min(k, len(st.gaps) - 1)]
+        if k + 1 == len(st.units):
+            t += self.tail_ms[idx]
+            if out is not None:
+                out.extend(st.tail)
+        nxt = list(state.next)
+        nxt[idx] = k + 1
+        return State(t, idx, tuple(nxt), tuple(ready))
+
+    def _greedy(self, state, candidates):
+        """Kandidat mit dem frühesten Ende; bei Gleichstand bleiben, sonst Planreihenfolge."""
+        return min(candidates, key=lambda idx: (self.visit(state, idx).t, idx != state.at, idx))
+
+    def rollout(self, state):
+        """Gesamtzeit, wenn ab state gierig zu Ende geplant wird."""
+        candidates = self._open(state)
+        while candidates:
+            state = self.visit(state, self._greedy(state, candidates))
+            candidates = self._open(state)
+        return state.t + self.finish[len(self.stations) if state.at is None else state.at]
+
+    def schedule(self):
+        state = self.start
+        lookahead = sum(len(st.units) for st in self.stations) <= LOOKAHEAD_LIMIT
+        out = []
+        candidates = self._open(state)
+        while candidates:
+            if lookahead:
+                choice = min(candidates,
+                             key=lambda idx: (self.rollout(self.visit(state, idx)), idx != state.at, idx))
+            else:
+                choice = self._greedy(state, candidates)
+            state = self.visit(state, choice, out)
+            candidates = self._open(state)
+        return out
+
+
+def interleave_refills(prefix, blocks, config=None, start_mm=PARK_POSITION):
+    """
+    Verschränkt die Portionen der Blöcke aus planner.plan_blocks. Liefert die
+    Schritte; ist die Verschränkung laut Estimator nicht schneller, die Blöcke
+    in der geplanten Reihenfolge.
+    """
+    planned = tuple(prefix) + tuple(step for _, block in blocks for step in block)
+    result = list(prefix)
+    segment = []
+
+    def position():
+        return next((step.position for step in reversed(result) if step.kind == "move"), start_mm)
+
+    def flush(end_move):
+        if any(st.gaps for st in segment):
+            result.extend(_Segment(segment, position(), end_move, config).schedule())
+        else:
+            for st in segment:
+                result.append(st.move)
+                result.extend(st.head)
+                result.extend(step for unit in st.units for step in unit)
+                result.extend(st.tail)
+        segment.clear()
+
+    for barrier, block in blocks:
+        if barrier:
+            flush(block[0])
+            result.extend(block)
+        else:
+            segment.append(station(block))
+    flush(None)
+
+    result = tuple(result)
+    if estimate_steps(result, config, start_mm).total_ms < estimate_steps(planned, config, start_mm).total_ms:
+        return result
+    return planned
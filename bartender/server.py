@@ -1,69 +1,112 @@
 import os
-import json
 import time
-import serial
-from flask import Flask, jsonify, render_template, request, redirect, url_for
+import clock
+from flask import Flask, Response, jsonify, render_template, request, stream_with_context
 from threading import Thread, Lock
 import serial.tools.list_ports
 import subprocess
+from esp_transport import EspTransport
+from esp_batch import run_batch
+from recipe_compiler import (RecipeCompiler, drink_names, drink_position, pump_for, compile_program,
+                             parse_recipe, optimize_program, SETTINGS_KEYS, EDITABLE_SETTINGS)
+from estimator import estimate_plan, PARK_POSITION
+from planner import order_blocks
+from config_store import ConfigStore
+from recipe_store import RecipeStore
+from availability import AvailabilityIndex
+from order_queue import OrderQueue, POLICIES
+from events import EventBroadcaster
+from esp_health import EspHealthMonitor
+from esp_connector import EspConnector
+from boot import BootOrchestrator
+from metrics import Registry, Tracer
+from serving import serve, install_http_cache, SSE_CLIENT_LIMIT
+import dispensers
+import peephole
+import motion
+import logs
+
+# Vor Konfiguration, Queue und ESP, damit auch deren erste Meldungen erfasst werden
+logs.setup()
+log = logs.get("server")
 
 app = Flask(__name__)
+# Misst Meilensteine ab Prozessstart (u.a. Zeit bis zur ersten Anfrage)
+boot = BootOrchestrator()
+# ETag/304 für die großen, selten geänderten Seiten; gzip für große Antworten
+install_http_cache(app, ["index", "manage_recipes", "get_recipe_content"])
 
 RECIPE_FOLDER = "Rezepte"
+RECIPE_DB = "recipes.db"
 CONFIG_FILE = "config.json"
+ORDERS_FILE = "orders.json"
+
+# Einstellungen ohne Eingabefeld auf /config gehen beim Speichern der Seite nicht verloren
+PROTECTED_KEYS = ["wlan_ssid", "wlan_password"] + [key for key in SETTINGS_KEYS if key not in EDITABLE_SETTINGS]
+
+config_store = ConfigStore(CONFIG_FILE, protected_keys=PROTECTED_KEYS)
+recipe_store = RecipeStore(RECIPE_DB)
+# Erster Start mit dem Speicher: bisherige .txt-Rezepte übernehmen
+if not recipe_store.names() and os.path.isdir(RECIPE_FOLDER):
+    recipe_store.import_folder(RECIPE_FOLDER)
+elif os.path.isdir(RECIPE_FOLDER):
+    # Danach ist recipes.db maßgeblich; spätere Änderungen an den .txt-Dateien nur per Import
+    newer = recipe_store.newer_files(RECIPE_FOLDER)
+    if newer:
+        log.warning("%d Rezeptdatei(en) in '%s' sind neuer als %s und werden ignoriert (z.B. '%s'). "
+                    "Übernehmen mit: python recipe_store.py import %s",
+                    len(newer), RECIPE_FOLDER, RECIPE_DB, newer[0], RECIPE_FOLDER)
+recipe_compiler = RecipeCompiler(recipe_store)
+availability_index = AvailabilityIndex(recipe_compiler, config_store)
+# Reihenfolge wichtig: erst veraltete Pläne verwerfen, dann den Index neu bewerten
+config_store.subscribe(recipe_compiler.on_config_change)
+config_store.subscribe(availability_index.on_config_change)
 
 # SERIAL_PORT wird nicht mehr fest vorgegeben, sondern automatisch ermittelt
 BAUDRATE = 115200
 
-ser = None
-esp_connected = False
-serial_lock = Lock()
+# Ein Leser-Thread verteilt Antworten, DEBUG-Zeilen und Ereignisse des ESP
+esp_transport = EspTransport()
+serial_lock = esp_transport.write_lock
+
+# Heartbeat in Leerlaufphasen; Routen lesen nur den gecachten Zustand
+esp_health = EspHealthMonitor(esp_transport, is_busy=lambda: is_running)
+# Verbindungsaufbau im Hintergrund (Backoff, Hotplug, gemerktes Gerät)
+def on_esp_connect(port):
+    boot.mark("esp_connected")
+    esp_health.check_now()
+
+esp_connector = EspConnector(esp_transport, BAUDRATE, on_connect=on_esp_connect)
+
+def remember_esp_device(health):
+    # Erst wenn der ESP antwortet, ist der Port sicher der richtige
+    if health["online"]:
+        boot.mark("esp_online")
+        esp_connector.remember()
+
+esp_health.add_listener(remember_esp_device)
+
+# Push-Kanal (SSE) für Fortschritt, ESP-Status, Notizen und Warteschlange
+events = EventBroadcaster(max_clients=SSE_CLIENT_LIMIT)
+EVENT_TICK_S = 1.0
 
 # **Globale Variablen Definieren**
 active_recipe = None
 is_running = False
 current_progress = 0
 
+# Zeitgewichteter Fortschritt: geschätzte Gesamtdauer, bereits erledigte Zeit
+# und Schätzung/Startzeit des laufenden Schritts (alles in ms bzw. time.time())
+progress_total_ms = 0
+progress_done_ms = 0
+progress_step_ms = 0
+progress_step_started = 0.0
+
 current_recipe_notes = {"recipe_name": "", "notes": []}
 current_recipe_notes_lock = Lock()
 
 def find_esp_port():
-    ports = serial.tools.list_ports.comports()
-    for port in ports:
-        manufacturer = port.manufacturer or "Unbekannt"
-        product = port.product or "Unbekannt"
-        print(f"Prüfe Port: {port.device} - Hersteller: {manufacturer} - Produkt: {product}")
-        if port.device.startswith("/dev/ttyUSB"):
-            print(f"ESP (vermutet) an Port {port.device}")
-            return port.device
-    return None
-
-def init_serial():
-    global ser, esp_connected
-    max_retries = 10
-    retry_interval = 10  # in Sekunden
-
-    for attempt in range(max_retries):
-        esp_port = find_esp_port()
-        if esp_port is None:
-            print(f"Kein ESP gefunden. Warte {retry_interval} Sekunden und versuche es erneut... ({attempt+1}/{max_retries})")
-            time.sleep(retry_interval)
-            continue
-
-        try:
-            ser = serial.Serial(esp_port, BAUDRATE, timeout=2)
-            esp_connected = True
-            print(f"ESP verbunden an {esp_port}")
-            return
-        except serial.SerialException as e:
-            print(f"ESP nicht verbunden: {e}")
-            esp_connected = False
-            ser = None
-
-        print(f"Verbindung fehlgeschlagen. Warte {retry_interval} Sekunden und versuche es erneut... ({attempt+1}/{max_retries})")
-        time.sleep(retry_interval)
-
-    print("Nach mehreren Versuchen konnte keine Verbindung zum ESP hergestellt werden.")
+    return esp_connector.find_port()
 
 def is_wifi_connected():
     """
@@ -77,182 +120,99 @@ def is_wifi_connected():
         return False
 
 
-def send_command_to_esp(command_dict):
-    global ser, esp_connected
-    with serial_lock:
-        if not esp_connected or ser is None or not ser.is_open:
-            return {"status": "error", "message": "ESP nicht verbunden"}
-
-        try:
-            cmd_str = json.dumps(command_dict) + "\n"
-            ser.write(cmd_str.encode('utf-8'))
-
-            start_time = time.time()
-            while True:
-                line = ser.readline().decode('utf-8', errors='replace').strip()
-                if not line:
-                    if time.time() - start_time > 5:
-                        return {"status": "error", "message": "Keine Antwort vom ESP"}
-                    continue
-
-                # Debug-Zeilen ignorieren
-                if line.startswith("DEBUG:"):
-                    continue
-
-                # Nur JSON-Linien verarbeiten
-                if line.startswith("{"):
-                    try:
-                        resp = json.loads(line)
-                        return resp
-                    except json.JSONDecodeError as e:
-                        print(f"JSON-Fehler beim Parsen der ESP-Antwort: {e}, empfangene Daten: {line}")
-                        return {"status": "error", "message": "Ungültige Antwort vom ESP"}
-
-        except Exception as e:
-            print(f"Fehler bei der ESP-Kommunikation: {e}")
-            esp_connected = False
-            return {"status": "error", "message": "Kommunikationsfehler mit ESP"}
+def send_command_to_esp(command_dict, timeout=None):
+    # Timeout ergibt sich ohne Angabe aus der erwarteten Dauer des Befehls
+    return esp_transport.send(command_dict, timeout)
 
 def load_config():
-    try:
-        with open(CONFIG_FILE, "r") as file:
-            return json.load(file)
-    except FileNotFoundError:
-        print(f"Konfigurationsdatei '{CONFIG_FILE}' nicht gefunden! Erstelle eine neue.")
-        return {}
-    except json.JSONDecodeError as e:
-        print(f"Fehler beim Lesen der Konfigurationsdatei: {e}")
-        return {}
+    # Kommt aus dem Speicher; config_store überwacht die Datei auf externe Änderungen
+    return config_store.get()
 
 def save_config(new_config):
-    try:
-        # Alte Konfiguration laden
-        existing_config = load_config()
-
-        # Geschützte Schlüssel bewahren
-        protected_keys = ["wlan_ssid", "wlan_password"]
-        for key in protected_keys:
-            if key in existing_config and key not in new_config:
-                new_config[key] = existing_config[key]
-
-        # Neue Konfiguration speichern
-        with open(CONFIG_FILE, "w") as file:
-            json.dump(new_config, file, indent=4)
-        print("Konfiguration erfolgreich gespeichert.")
-    except Exception as e:
-        print(f"Fehler beim Speichern der Konfigurationsdatei: {e}")
+    # Geschützte Schlüssel (WLAN-Daten usw.) bewahrt der config_store,
+    # geschrieben wird verzögert und atomar
+    config_store.save(new_config)
+
+def recipe_changed(recipe_file, generation=None):
+    """Nach Speichern/Löschen eines Rezepts: Cache und Verfügbarkeitsindex nur für dieses Rezept aktualisieren."""
+    recipe_compiler.invalidate(recipe_file)
+    availability_index.refresh(recipe_file, generation)
+
+def get_plan(recipe_file):
+    """Kompilierter Plan eines Rezepts für die aktuelle Konfiguration."""
+    version, config = config_store.snapshot()
+    return recipe_compiler.plan(recipe_file, config, version)
+
+def plan_for_order(order):
+    """Kompiliert den Plan einer Bestellung erst bei der Ausführung (aktuelle Konfiguration)."""
+    config = load_config()
+    kind, params = order["kind"], order["params"]
+    if kind == "temp":
+        # Temporäre Rezepte liegen nur in der Bestellung, nicht im Rezeptordner
+        return compile_program(parse_recipe(params["source"]), config, name=order["recipe"])
+    if kind == "custom":
+        return recipe_compiler.variant(order["recipe"], config, amount_overrides=params.get("amounts"))
+    if kind == "without_missing":
+        return recipe_compiler.variant(order["recipe"], config, skip_targets=set(params.get("missing", [])))
+    return get_plan(order["recipe"])
+
+def run_order(order):
+    # Fehler müssen bis zur Warteschlange durch, sonst gilt die Bestellung als "done"
+    status, error = execute_plan(plan_for_order(order), order["name"], order["id"])
+    if status == "error":
+        raise RuntimeError(error or "Rezeptausführung fehlgeschlagen")
+
+order_queue = OrderQueue(
+    ORDERS_FILE,
+    run_order,
+    policy=lambda: config_store.get().get("queue_policy", "fifo"),
+    ready=lambda: esp_health.online,
+)
+
+def enqueue_order(kind, recipe, plan, name=None, params=None):
+    """Nimmt eine Bestellung auf und liefert die Antwort für den Client."""
+    order = order_queue.enqueue(kind, recipe, name=name, params=params, est_ms=plan.est_ms)
+    position = order_queue.position(order["id"], progress_snapshot()[1] * 1000)
+    if position is None:
+        message = f"Rezept '{order['name']}' gestartet."
+        place, eta_ms = 0, order["est_ms"]
+    else:
+        place, wait_ms = position
+        eta_ms = wait_ms + order["est_ms"]
+        if place == 1 and not is_running:
+            message = f"Rezept '{order['name']}' gestartet."
+        else:
+            message = f"Rezept '{order['name']}' in der Warteschlange (Platz {place})."
+    return jsonify({"status": "success", "message": message, "order_id": order["id"],
+                    "position": place, "eta": round(eta_ms / 1000)})
 
 def check_esp_connection():
-    global esp_connected
-    if not esp_connected or ser is None or not ser.is_open:
-        return False
-    with serial_lock:
-        try:
-            ser.write(b'{"command":"status"}\n')
-            line = ser.readline().decode('utf-8').strip()
-            if not line:
-                return False
-
-            if line.startswith("DEBUG:"):
-                start = time.time()
-                while line.startswith("DEBUG:"):
-                    if time.time() - start > 2:
-                        return False
-                    line = ser.readline().decode('utf-8').strip()
-                    if not line:
-                        return False
-
-            if line.startswith("{"):
-                try:
-                    resp_json = json.loads(line)
-                    return resp_json.get("status") == "online"
-                except json.JSONDecodeError as e:
-                    print(f"JSON-Fehler beim Überprüfen des ESP-Status: {e}, Daten: {line}")
-                    return False
-            else:
-                return False
-        except Exception as e:
-            print(f"Fehler bei der ESP-Kommunikation: {e}")
-            esp_connected = False
-            return False
+    # Gecachter Stand des Heartbeats, kein Roundtrip zum ESP
+    return esp_health.online
+
+@app.before_request
+def track_first_request():
+    boot.first_request(request.path)
+
+@app.route("/ready")
+def ready():
+    """Bereitschaft für Service-Manager/Load-Balancer; der ESP ist keine Voraussetzung."""
+    checks = {
+        "recipes": recipe_store.healthy(),
+        "order_queue": order_queue.started,
+        "esp": esp_health.online,
+    }
+    is_ready = checks["recipes"] and checks["order_queue"]
+    return jsonify({"ready": is_ready, "checks": checks}), (200 if is_ready else 503)
+
+@app.route("/boot_status")
+def boot_status():
+    return jsonify(dict(boot.status(), status="success"))
 
 @app.route("/")
 def index():
-    recipes = []
-    config = load_config()
-
-    # Extrahiere gültige Getränkenamen aus der Konfiguration
-    # Ausschluss von Schlüsseln, die mit 'pump' beginnen oder spezielle Parameter sind
-    excluded_keys = ["pour_time", "pump_time", "pumpen", "move_wait", "drip_wait", "refill_wait"]
-    drink_names = [
-        key for key in config.keys()
-        if not key.startswith("pump") and key not in excluded_keys
-    ]
-
-    # Füge Pumpengetränke hinzu, falls vorhanden
-    for i in range(1, 5):
-        pump_drink = config.get(f"pump{i}")
-        if pump_drink and pump_drink not in drink_names:
-            drink_names.append(pump_drink)
-
-    for filename in os.listdir(RECIPE_FOLDER):
-        if filename.endswith(".txt"):
-            recipe_path = os.path.join(RECIPE_FOLDER, filename)
-            is_valid = True
-            invalid_reasons = []
-            has_move_to_drink = False  # Flag zur Überprüfung, ob ein gültiger 'move' vorhanden ist
-
-            try:
-                with open(recipe_path, "r") as file:
-                    for line in file:
-                        command = line.strip()
-                        if not command:
-                            continue
-                        if command.startswith("move"):
-                            args = command.split()
-                            if len(args) != 2:
-                                is_valid = False
-                                invalid_reasons.append(f"Ungültiger move-Befehl: {command}")
-                                continue
-                            target = args[1]
-                            if target in drink_names:
-                                has_move_to_drink = True  # Gültiger 'move' zu einem Getränk gefunden
-                            if not target.isdigit() and target not in config:
-                                is_valid = False
-                                invalid_reasons.append(f"Kein Eintrag für '{target}' in der Konfiguration")
-                        elif command.startswith("servo"):
-                            args = command.split()
-                            if len(args) >= 3:
-                                mode = args[1]
-                                value = args[2]
-                                if mode == "ms":
-                                    if not value.isdigit():
-                                        is_valid = False
-                                        invalid_reasons.append(f"Ungültiger servo ms-Wert: {command}")
-                                elif mode == "cl":
-                                    try:
-                                        float(value)
-                                        if "pour_time" not in config:
-                                            is_valid = False
-                                            invalid_reasons.append("Kein 'pour_time' in der Konfiguration für 'servo cl'")
-                                    except ValueError:
-                                        is_valid = False
-                                        invalid_reasons.append(f"Ungültiger servo cl-Wert: {command}")
-                                else:
-                                    is_valid = False
-                                    invalid_reasons.append(f"Unbekannter servo Modus: {mode}")
-                            else:
-                                is_valid = False
-                                invalid_reasons.append(f"Ungültiger servo-Befehl: {command}")
-                # Nach der Verarbeitung aller Zeilen überprüfen, ob ein gültiger 'move' gefunden wurde
-                if not has_move_to_drink:
-                    is_valid = False
-                    invalid_reasons.append("Keine 'move' Befehle zu gültigen Getränken vorhanden.")
-            except Exception as e:
-                is_valid = False
-                invalid_reasons.append(f"Fehler beim Lesen des Rezepts: {e}")
-
-            recipes.append({"name": filename, "valid": is_valid, "reasons": invalid_reasons})
+    # Direkt aus dem Verfügbarkeitsindex, ohne Rezepte zu lesen oder zu prüfen
+    recipes = availability_index.entries()
 
     esp_connected_local = check_esp_connection()
     return render_template("index.html", recipes=recipes, esp_connected=esp_connected_local, active_recipe=active_recipe, is_running=is_running)
@@ -260,10 +220,17 @@ def index():
 
 @app.route("/esp_status")
 def esp_status():
-    global esp_connected
-    esp_connected = check_esp_connection()
-    status_message = "ESP verbunden" if esp_connected else "ESP nicht verbunden"
-    return jsonify({"connected": esp_connected, "status": status_message})
+    health = esp_health.snapshot()
+    connected = health["online"]
+    status_message = "ESP verbunden" if connected else "ESP nicht verbunden"
+    return jsonify({"connected": connected, "status": status_message, "health": health,
+                    "connector": esp_connector.status()})
+
+@app.route("/esp_debug", methods=["GET"])
+def esp_debug():
+    limit = request.args.get("limit", 100, type=int)
+    lines = [{"time": ts, "line": line} for ts, line in esp_transport.debug_lines(limit)]
+    return jsonify({"status": "success", "lines": lines, "last_error": esp_transport.last_error})
 
 @app.route("/generate_and_run_temp_recipe", methods=["POST"])
 def generate_and_run_temp_recipe():
@@ -277,29 +244,27 @@ def generate_and_run_temp_recipe():
         if not alcohol_data or not isinstance(alcohol_data, list):
             return jsonify({"status": "error", "message": "Ungültige Zutatenliste."}), 400
 
-        generate_response = generate_recipe(data)
-        if generate_response.status_code != 200:
-            return generate_response
+        if not recipe_name.endswith(".txt"):
+            recipe_name += ".txt"
 
-        recipe_path = os.path.join(RECIPE_FOLDER, f"{recipe_name}.txt")
-        try:
-            thread = Thread(target=execute_recipe, args=(f"{recipe_name}.txt", True))
-            thread.start()
-            thread.join()
-        finally:
-            if os.path.exists(recipe_path):
-                os.remove(recipe_path)
-
-        return jsonify({"status": "success", "message": f"Temporäres Rezept '{recipe_name}.txt' wurde ausgeführt und gelöscht."})
+        config = load_config()
+        commands, _, error_msg = build_recipe_commands(alcohol_data, config)
+        if error_msg:
+            return jsonify({"status": "error", "message": error_msg}), 400
+
+        # Das Rezept wird nicht gespeichert, sondern nur mit der Bestellung abgelegt
+        source = "\n".join(commands)
+        plan = compile_program(parse_recipe(source), config, name=recipe_name)
+        return enqueue_order("temp", recipe_name, plan, params={"source": source})
     except Exception as e:
-        print(f"Fehler bei generate_and_run_temp_recipe: {e}")
+        log.error("Fehler bei generate_and_run_temp_recipe: %s", e)
         return jsonify({"status": "error", "message": "Fehler bei der Ausführung des temporären Rezepts."}), 500
 
 @app.route("/config", methods=["GET", "POST"])
 def manage_config():
     if request.method == "GET":
         config = load_config()
-        return render_template("config.html", config=config)
+        return render_template("config.html", config=config, settings_keys=SETTINGS_KEYS)
     elif request.method == "POST":
         new_config = request.json.get("config")
         if not isinstance(new_config, dict):
@@ -310,24 +275,14 @@ def manage_config():
 @app.route("/rezepte", methods=["GET", "POST", "DELETE"])
 def manage_recipes():
     if request.method == "GET":
-        recipes = {}
-        for filename in os.listdir(RECIPE_FOLDER):
-            if filename.endswith(".txt"):
-                with open(os.path.join(RECIPE_FOLDER, filename), "r") as file:
-                    recipes[filename] = file.read()
+        # Nur Namen und Metadaten aus dem Speicher; den Quelltext lädt erst der Bearbeiten-Dialog
+        availability_index.check_store()
+        recipes = recipe_store.listing()
+        drinks = drink_names(load_config())
+        # Geschätzte Ersparnis durch den Peephole-Optimierer pro Rezept (aus der letzten Bewertung)
+        savings = {entry["name"]: round(entry.get("peephole_ms", 0) / 1000, 1) for entry in recipes}
 
-        config = load_config()
-        drinks = [
-            key for key in config.keys()
-            if not key.startswith("pump") and key not in ["pour_time", "pump_time", "pumpen", "move_wait", "drip_wait", "refill_wait"]
-        ]
-
-        for i in range(1, 5):
-            pump_drink = config.get(f"pump{i}")
-            if pump_drink and pump_drink not in drinks:
-                drinks.append(pump_drink)
-
-        return render_template("rezepte.html", recipes=recipes, configured_alcohols=drinks)
+        return render_template("rezepte.html", recipes=recipes, configured_alcohols=drinks, savings=savings)
 
     elif request.method == "POST":
         data = request.json
@@ -340,8 +295,7 @@ def manage_recipes():
             name += ".txt"
 
         try:
-            with open(os.path.join(RECIPE_FOLDER, name), "w") as file:
-                file.write(content)
+            recipe_changed(name, recipe_store.save(name, content))
             return jsonify({"status": "success", "message": f"Rezept '{name}' gespeichert."})
         except Exception as e:
             return jsonify({"status": "error", "message": f"Fehler beim Speichern des Rezepts: {e}"}), 500
@@ -352,35 +306,58 @@ def manage_recipes():
         if not name or not name.endswith(".txt"):
             return jsonify({"status": "error", "message": "Ungültiger Rezeptname"}), 400
 
-        filepath = os.path.join(RECIPE_FOLDER, name)
-        if os.path.exists(filepath):
-            try:
-                os.remove(filepath)
-                return jsonify({"status": "success", "message": f"Rezept '{name}' gelöscht."})
-            except Exception as e:
-                return jsonify({"status": "error", "message": f"Fehler beim Löschen des Rezepts: {e}"}), 500
-        else:
+        try:
+            generation = recipe_store.delete(name)
+        except Exception as e:
+            return jsonify({"status": "error", "message": f"Fehler beim Löschen des Rezepts: {e}"}), 500
+        if generation is None:
             return jsonify({"status": "error", "message": f"Rezept '{name}' nicht gefunden."}), 404
+        recipe_changed(name, generation)
+        return jsonify({"status": "success", "message": f"Rezept '{name}' gelöscht."})
+
+@app.route("/rezepte/list", methods=["GET"])
+def list_recipes():
+    """Rezepte mit Metadaten, gefiltert nach Zutat (?ingredient=), Namensteil (?q=) und Gültigkeit (?valid=1/0)."""
+    availability_index.check_store()
+    valid = request.args.get("valid")
+    if valid not in (None, "", "0", "1"):
+        return jsonify({"status": "error", "message": "valid muss 0 oder 1 sein"}), 400
+    recipes = recipe_store.listing(ingredient=request.args.get("ingredient") or None,
+                                   search=request.args.get("q") or None,
+                                   valid=None if not valid else valid == "1")
+    return jsonify({"status": "success", "recipes": recipes, "ingredients": recipe_store.ingredients()})
+
+@app.route("/rezepte/peephole", methods=["GET"])
+def recipe_peephole():
+    """Probelauf des Peephole-Optimierers: Diff, Änderungen und optimierter Quelltext (nichts wird gespeichert)."""
+    recipe_name = request.args.get("recipe", "")
+    if not recipe_name or not recipe_store.exists(recipe_name):
+        return jsonify({"status": "error", "message": "Rezept nicht gefunden"}), 404
+
+    program = recipe_compiler.load(recipe_name)
+    config = dict(load_config(), peephole=True)
+    optimized, rewrites = optimize_program(program.instrs, config)
+    # Ersparnis wie in der Schätzung: Plan mit gegen ohne Optimierer
+    plan = compile_program(program.instrs, config, name=recipe_name)
+    return jsonify({
+        "status": "success",
+        "diff": peephole.diff(program.instrs, optimized, recipe_name),
+        "changes": [{"line": program.instrs[r.index].text, "rule": r.rule, "saved_ms": r.saved_ms}
+                    for r in sorted(rewrites)],
+        "saved_seconds": round(plan.peephole_ms / 1000, 1),
+        "optimized": "\n".join(instr.text for instr in optimized),
+    })
 
 @app.route("/run_recipe", methods=["POST"])
 def run_recipe():
-    global is_running
-    if is_running:
-        return jsonify({"status": "error", "message": "Ein Rezept wird bereits ausgeführt."}), 400
-
     if not check_esp_connection():
         return jsonify({"status": "error", "message": "ESP ist nicht verbunden."}), 400
 
     recipe_file = request.json.get("recipe")
-    if not recipe_file or not os.path.exists(os.path.join(RECIPE_FOLDER, recipe_file)):
+    if not recipe_file or not recipe_store.exists(recipe_file):
         return jsonify({"status": "error", "message": "Ungültiges Rezept."}), 400
 
-    thread = Thread(target=execute_recipe, args=(recipe_file,))
-    thread.start()
-    return jsonify({"status": "success", "message": f"Rezept '{recipe_file}' gestartet."})
-
-def calculate_pump_duration(cl, pump_time):
-    return int(cl * pump_time)
+    return enqueue_order("recipe", recipe_file, get_plan(recipe_file))
 
 @app.route("/get_recipe_content", methods=["GET"])
 def get_recipe_content():
@@ -388,13 +365,11 @@ def get_recipe_content():
     if not recipe_name:
         return "Rezeptname fehlt.", 400
 
-    recipe_path = os.path.join(RECIPE_FOLDER, recipe_name)
-    if not os.path.exists(recipe_path):
+    if not recipe_store.exists(recipe_name):
         return "Rezeptdatei nicht gefunden.", 404
 
     try:
-        with open(recipe_path, "r") as file:
-            content = file.read()
+        content = recipe_compiler.load(recipe_name).source
         if not content.strip():
             return "Rezeptdatei ist leer.", 400
         return content
@@ -403,8 +378,7 @@ def get_recipe_content():
 
 @app.route("/send_command", methods=["POST"])
 def send_command():
-    global esp_connected
-    if not esp_connected:
+    if not esp_transport.connected:
         return jsonify({"status": "error", "message": "ESP nicht verbunden."}), 400
 
     try:
@@ -420,7 +394,7 @@ def send_command():
             return jsonify({"status": "error", "message": "Ungültiger Befehlstyp oder Wert."}), 400
 
         if command_type == "move":
-            print(f"[DEBUG] Manueller 'move': {value} mm")
+            log.debug("Manueller 'move': %s mm", value)
             resp = send_command_to_esp({"command":"move","position":value})
             if resp.get("status") == "success":
                 return jsonify({"status": "success", "message": f"Plattform zu {value} mm bewegt."})
@@ -428,7 +402,7 @@ def send_command():
                 return jsonify({"status": "error", "message": "ESP hat nicht auf 'move' reagiert."}), 500
 
         elif command_type == "servo":
-            print(f"[DEBUG] Manueller 'servo': {value} ms")
+            log.debug("Manueller 'servo': %s ms", value)
             resp = send_command_to_esp({"command":"servo","delay":value})
             if resp.get("status") == "success":
                 return jsonify({"status": "success", "message": f"Servo mit {value} ms Verzögerung bewegt."})
@@ -438,7 +412,7 @@ def send_command():
         elif command_type == "pump":
             if not pump or not isinstance(pump, int):
                 return jsonify({"status": "error", "message": "Pumpennummer fehlt oder ist ungültig."}), 400
-            print(f"[DEBUG] Manueller 'pump': Pumpe {pump}, Dauer {value} ms")
+            log.debug("Manueller 'pump': Pumpe %s, Dauer %s ms", pump, value)
             resp = send_command_to_esp({"command":"pump","pump":pump,"duration":value})
             if resp.get("status") == "success":
                 # Warte die komplette Pumpenlaufzeit ab, da die Pumpe sofort erfolgreich gemeldet wird
@@ -451,9 +425,63 @@ def send_command():
             return jsonify({"status": "error", "message": f"Unbekannter Befehlstyp: {command_type}."}), 400
 
     except Exception as e:
-        print(f"Error in send_command: {e}")
+        log.error("Error in send_command: %s", e)
         return jsonify({"status": "error", "message": "Serverfehler beim Verarbeiten des Befehls."}), 500
 
+def build_recipe_commands(alcohol_data, config):
+    """
+    Erzeugt die Rezeptzeilen für eine Zutatenliste in fahrwegoptimierter
+    Reihenfolge. Liefert (Zeilen, gesparte ms, Fehlermeldung).
+    """
+    items = []
+    for item in alcohol_data:
+        alcohol = item.get("alcohol")
+        amount_cl = float(item.get("amount", 0))
+        if not alcohol:
+            return None, 0, "Getränkename fehlt."
+        if amount_cl <= 0:
+            return None, 0, "Menge muss größer als 0 sein."
+
+        # "fixed": Reihenfolge dieser Zutat beibehalten (z.B. Schichtgetränke)
+        move_command = f"move {alcohol} fixed" if item.get("fixed") else f"move {alcohol}"
+        is_valid, error_msg = validate_recipe_command(move_command, config)
+        if not is_valid:
+            return None, 0, error_msg
+
+        # Kein "wait move_wait": der ESP bestätigt eine Fahrt erst an ihrem Ende
+        block = [move_command]
+        if pump_for(config, alcohol):
+            # Pumpen laufen ohne Kammer durch, die Menge wird ohnehin zu einem Lauf zusammengefasst
+            portions = [f"servo cl {amount_cl:g}", "wait drip_wait"]
+        else:
+            # Aufteilung nach dem Portionierer der Flasche (Kammergröße, Nachfüllzeit)
+            portions = dispensers.recipe_lines(amount_cl, dispensers.profile(config, alcohol),
+                                               dispensers.proportional(config))
+        for command in portions:
+            is_valid, error_msg = validate_recipe_command(command, config)
+            if not is_valid:
+                return None, 0, error_msg
+            block.append(command)
+
+        items.append((drink_position(config, alcohol), bool(item.get("fixed")), block))
+
+    # Zutaten nach Fahrweg sortieren (inklusive Rückfahrt zur Parkposition)
+    order = order_blocks([pos for pos, _, _ in items], [fixed for _, fixed, _ in items],
+                         config, end_mm=PARK_POSITION)
+
+    def build(indices):
+        lines = ["start"]
+        for idx in indices:
+            lines.extend(items[idx][2])
+        lines.append(f"move {PARK_POSITION}")
+        lines.append("done")
+        return lines
+
+    commands = build(order)
+    saved_ms = (compile_program(parse_recipe("\n".join(build(range(len(items))))), config, plan=False).est_ms
+                - compile_program(parse_recipe("\n".join(commands)), config, plan=False).est_ms)
+    return commands, max(0, saved_ms), None
+
 @app.route("/generate_recipe", methods=["POST"])
 def generate_recipe(data=None):
     try:
@@ -471,395 +499,436 @@ def generate_recipe(data=None):
 
         if not recipe_name.endswith(".txt"):
             recipe_name += ".txt"
-        recipe_path = os.path.join(RECIPE_FOLDER, recipe_name)
-
-        config = load_config()
-        move_wait = config.get("move_wait", 500)
-        refill_wait = config.get("refill_wait", 5000)
-        drip_wait = config.get("drip_wait", 1000)
-        pour_time = config.get("pour_time", 2000)
-
-        commands = ["start"]
-
-        for item in alcohol_data:
-            alcohol = item.get("alcohol")
-            amount_cl = float(item.get("amount", 0))
-            if not alcohol:
-                return jsonify({"status": "error", "message": "Getränkename fehlt."}), 400
-            if amount_cl <= 0:
-                return jsonify({"status": "error", "message": "Menge muss größer als 0 sein."}), 400
-
-            move_command = f"move {alcohol}"
-            is_valid, error_msg = validate_recipe_command(move_command, config)
-            if not is_valid:
-                return jsonify({"status": "error", "message": error_msg}), 400
-            commands.append(move_command)
-            commands.append("wait move_wait")
-
-            remaining_cl = amount_cl
-            while remaining_cl > 2:
-                servo_command = "servo cl 2"
-                is_valid, error_msg = validate_recipe_command(servo_command, config)
-                if not is_valid:
-                    return jsonify({"status": "error", "message": error_msg}), 400
-                commands.append(servo_command)
-                commands.append("wait refill_wait")
-                remaining_cl -= 2
-
-            if remaining_cl > 0:
-                servo_command = f"servo cl {remaining_cl}"
-                is_valid, error_msg = validate_recipe_command(servo_command, config)
-                if not is_valid:
-                    return jsonify({"status": "error", "message": error_msg}), 400
-                commands.append(servo_command)
-                commands.append("wait drip_wait")
-
-        commands.append("move 10")
-        commands.append("done")
+        commands, saved_ms, error_msg = build_recipe_commands(alcohol_data, load_config())
+        if error_msg:
+            return jsonify({"status": "error", "message": error_msg}), 400
 
         try:
-            with open(recipe_path, "w") as file:
-                file.write("\n".join(commands))
-            return jsonify({"status": "success", "message": f"Rezept '{recipe_name}' wurde erfolgreich generiert."})
+            recipe_changed(recipe_name, recipe_store.save(recipe_name, "\n".join(commands)))
+            return jsonify({"status": "success", "message": f"Rezept '{recipe_name}' wurde erfolgreich generiert.",
+                            "saved_seconds": round(saved_ms / 1000, 1)})
         except Exception as e:
-            print(f"Fehler beim Generieren des Rezepts: {e}")
+            log.error("Fehler beim Generieren des Rezepts: %s", e)
             return jsonify({"status": "error", "message": "Fehler beim Generieren des Rezepts."}), 500
     except Exception as e:
-        print(f"Fehler beim Generieren des Rezepts: {e}")
+        log.error("Fehler beim Generieren des Rezepts: %s", e)
         return jsonify({"status": "error", "message": "Fehler beim Generieren des Rezepts."}), 500
 
+def progress_snapshot():
+    """Fortschritt in Prozent und Restzeit in Sekunden, gewichtet nach geschätzter Dauer."""
+    if not is_running:
+        return current_progress, 0
+    if progress_total_ms <= 0:
+        return current_progress, 0
+    in_step = min((clock.now() - progress_step_started) * 1000, progress_step_ms)
+    elapsed = progress_done_ms + in_step
+    progress = min(99, int(elapsed / progress_total_ms * 100))
+    remaining = max(0, round((progress_total_ms - elapsed) / 1000))
+    return progress, remaining
+
 @app.route("/recipe_progress", methods=["GET"])
 def recipe_progress():
-    global current_progress
-    return jsonify({"progress": current_progress})
-
-def execute_recipe(recipe_file, temporary=False, original_recipe_name=None):
-    global active_recipe, is_running, current_progress, current_recipe_notes
-    if original_recipe_name:
-        active_recipe = original_recipe_name
-    else:
-        active_recipe = recipe_file
-    is_running = True
-    current_progress = 0
+    order_id = request.args.get("order", type=int)
+    if order_id is not None:
+        order = order_queue.get(order_id)
+        if order is None:
+            return jsonify({"status": "error", "message": "Bestellung nicht gefunden"}), 404
+        if order["status"] == "queued":
+            position = order_queue.position(order_id, progress_snapshot()[1] * 1000)
+            place, wait_ms = position or (0, 0)
+            return jsonify({"progress": 0, "eta": round((wait_ms + order["est_ms"]) / 1000),
+                            "status": "queued", "position": place})
+        if order["status"] != "running":
+            return jsonify({"progress": 100, "eta": 0, "status": order["status"]})
+        if not is_running:
+            # Bestellung übernommen, Ausführung beginnt gleich
+            return jsonify({"progress": 0, "eta": round(order["est_ms"] / 1000), "status": "running"})
+    progress, remaining = progress_snapshot()
+    return jsonify({"progress": progress, "eta": remaining, "status": "running" if is_running else "idle"})
+
+def order_view(order, position=None, wait_ms=None):
+    view = {key: order[key] for key in ("id", "kind", "recipe", "name", "status", "created",
+                                         "started", "finished", "error")}
+    view["eta"] = round(order["est_ms"] / 1000)
+    if position is not None:
+        view["position"] = position
+        view["starts_in"] = round(wait_ms / 1000)
+    return view
+
+@app.route("/order_queue", methods=["GET", "POST"])
+def order_queue_status():
+    if request.method == "POST":
+        policy = (request.json or {}).get("policy")
+        if policy not in POLICIES:
+            return jsonify({"status": "error", "message": f"Unbekannte Reihenfolge: {policy}"}), 400
+        config_store.update({"queue_policy": policy})
+        return jsonify({"status": "success", "message": f"Reihenfolge der Warteschlange: {policy}"})
+
+    return jsonify(dict(queue_payload(), status="success"))
+
+def queue_payload():
+    """Laufende und wartende Bestellungen mit Platz und Startzeit."""
+    running, queued, history = order_queue.snapshot()
+    waited = progress_snapshot()[1] * 1000 if running else 0
+    queued_views = []
+    for index, order in enumerate(queued):
+        queued_views.append(order_view(order, index + 1, waited))
+        waited += order["est_ms"]
+    return {
+        "policy": config_store.get().get("queue_policy", "fifo"),
+        "running": order_view(running) if running else None,
+        "queued": queued_views,
+        "history": [order_view(order) for order in history[-10:]],
+    }
+
+def publish_progress():
+    running = order_queue.snapshot()[0]
+    progress, remaining = progress_snapshot()
+    events.publish("progress", {
+        "order_id": running["id"] if running else None,
+        "recipe": active_recipe,
+        "progress": progress if is_running else 0,
+        "eta": remaining,
+        "status": "running" if is_running else "idle",
+    })
+
+def on_order_change(action, order):
+    """Warteschlangen-Listener: Änderungen und fertige Bestellungen an alle Clients."""
+    events.publish("queue", queue_payload())
+    if action in ("done", "failed", "cancelled"):
+        view = order_view(order)
+        if action == "done":
+            with current_recipe_notes_lock:
+                view["notes"] = list(current_recipe_notes["notes"])
+        events.publish("order", view)
+    publish_progress()
+
+order_queue.add_listener(on_order_change)
+
+def preposition_move(position):
+    return send_command_to_esp({"command": "move", "position": position}).get("status") == "success"
+
+# Leerlauf-Vorpositionierung: hält während eines Rezepts seine Sperre nicht
+idle_motion = motion.IdleMotion(move=preposition_move,
+                                idle=lambda: not is_running and not order_queue.busy and esp_health.online,
+                                position=lambda: esp_transport.last_position)
+
+def on_queue_idle(action, order):
+    if action in ("done", "failed", "cancelled") and not order_queue.busy:
+        idle_motion.schedule(load_config().get("idle_preposition", True))
+
+order_queue.add_listener(on_queue_idle)
+
+# Messwerte (/metrics) und Traces pro Bestellung (/trace/<id>)
+metrics = Registry()
+esp_roundtrip = metrics.histogram("barbot_esp_roundtrip_seconds", "Zeit vom Senden eines ESP-Befehls bis zur Antwort")
+esp_timeouts = metrics.counter("barbot_esp_timeouts_total", "ESP-Befehle ohne Antwort")
+serial_lock_wait = metrics.histogram("barbot_serial_lock_wait_seconds", "Wartezeit auf serial_lock vor dem Senden",
+                                     buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+step_duration = metrics.histogram("barbot_step_duration_seconds", "Tatsächliche Dauer der Planschritte")
+step_planned = metrics.counter("barbot_step_planned_seconds_total", "Geplante Dauer aller ausgeführten Planschritte")
+step_actual = metrics.counter("barbot_step_actual_seconds_total", "Tatsächliche Dauer aller ausgeführten Planschritte")
+recipe_duration = metrics.histogram("barbot_recipe_duration_seconds", "Dauer der Rezeptausführung")
+orders_total = metrics.counter("barbot_orders_total", "Zustandswechsel von Bestellungen (queued, running, done, ...)")
+queue_wait = metrics.histogram("barbot_queue_wait_seconds", "Wartezeit einer Bestellung bis zum Start")
+travel_saved = metrics.counter("barbot_travel_saved_seconds_total",
+                               "Gesparte Fahrzeit durch ausgelassene Parkfahrten und Vorpositionieren")
+metrics.gauge("barbot_queue_depth", "Wartende Bestellungen", lambda: len(order_queue.snapshot()[1]))
+metrics.gauge("barbot_recipe_running", "1, solange ein Rezept läuft", lambda: int(is_running))
+metrics.gauge("barbot_esp_online", "1, wenn der ESP erreichbar ist", lambda: int(esp_health.online))
+
+def record_step(span):
+    seconds = span["actual_ms"] / 1000.0
+    step_duration.observe(seconds, kind=span["kind"])
+    step_planned.inc(span["planned_ms"] / 1000.0, kind=span["kind"])
+    step_actual.inc(seconds, kind=span["kind"])
+
+tracer = Tracer(on_step=record_step)
+
+def on_esp_timing(kind, command, seconds, started, status):
+    if kind == "lock_wait":
+        serial_lock_wait.observe(seconds)
+    elif kind == "roundtrip":
+        esp_roundtrip.observe(seconds, command=command)
+        tracer.command(command, started, seconds, status)
+    elif kind == "timeout":
+        esp_timeouts.inc(command=command)
+
+esp_transport.add_timing_listener(on_esp_timing)
+
+def count_order(action, order):
+    orders_total.inc(status=action)
+    if action == "running" and order.get("started"):
+        queue_wait.observe(max(0.0, order["started"] - order["created"]))
+
+order_queue.add_listener(count_order)
+
+def publish_esp_health(health):
+    connected = health["online"]
+    events.publish("esp", {"connected": connected, "health": health,
+                           "status": "ESP verbunden" if connected else "ESP nicht verbunden"})
+
+esp_health.add_listener(publish_esp_health)
+
+def event_loop():
+    """Eine Quelle für alle Clients: Fortschritt jede Sekunde während eines Rezepts."""
+    was_running = False
+    while True:
+        if is_running or was_running:
+            publish_progress()
+        was_running = is_running
+        time.sleep(EVENT_TICK_S)
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.route("/traces")
+def list_traces():
+    return jsonify({"status": "success", "traces": tracer.summaries()})
+
+@app.route("/trace/<int:order_id>")
+def download_trace(order_id):
+    """Trace einer Bestellung als Datei; ?format=chrome für chrome://tracing bzw. Perfetto."""
+    trace = tracer.get(order_id)
+    if trace is None:
+        return jsonify({"status": "error", "message": "Kein Trace für diese Bestellung"}), 404
+    data = Tracer.chrome(trace) if request.args.get("format") == "chrome" else trace
+    response = jsonify(data)
+    response.headers["Content-Disposition"] = f'attachment; filename="barbot-trace-{order_id}.json"'
+    return response
+
+@app.route("/logs")
+def recent_logs():
+    """Letzte Log-Einträge; ?since=<seq> liefert nur neuere, ?level= und ?logger= filtern."""
+    level = request.args.get("level", "").upper() or None
+    if level and level not in logs.LEVELS:
+        return jsonify({"status": "error", "message": f"Unbekannte Stufe: {level}"}), 400
+    entries = logs.ring.entries(limit=request.args.get("limit", 200, type=int), level=level,
+                                since=request.args.get("since", type=int),
+                                logger=request.args.get("logger"))
+    return jsonify(dict(logs.status(), status="success", entries=entries))
+
+@app.route("/log_level", methods=["GET", "POST"])
+def log_level():
+    if request.method == "POST":
+        data = request.json or {}
+        level, logger = data.get("level"), data.get("logger")
+        if not logs.set_level(level, logger):
+            return jsonify({"status": "error", "message": f"Unbekannte Stufe: {level}"}), 400
+        log.info("Log-Stufe für %s auf %s gesetzt.", logger or logs.ROOT, str(level).upper())
+    return jsonify({"status": "success", "levels": logs.levels()})
+
+@app.route("/events")
+def event_stream():
+    client = events.subscribe()
+    if client is None:
+        # Alle SSE-Plätze belegt: die Seite fällt auf Polling zurück
+        log.warning("SSE abgelehnt: bereits %s Clients verbunden.", events.client_count)
+        response = jsonify({"status": "error", "message": "Zu viele Live-Verbindungen, bitte Polling verwenden."})
+        response.status_code = 503
+        response.headers["Retry-After"] = "60"
+        return response
+    response = Response(stream_with_context(events.stream(client)), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+@app.route("/order_status", methods=["GET"])
+def order_status():
+    order_id = request.args.get("id", type=int)
+    order = order_queue.get(order_id) if order_id is not None else None
+    if order is None:
+        return jsonify({"status": "error", "message": "Bestellung nicht gefunden"}), 404
+    view = order_view(order)
+    if order["status"] == "queued":
+        position = order_queue.position(order_id, progress_snapshot()[1] * 1000)
+        if position:
+            view["position"], wait_ms = position
+            view["starts_in"] = round(wait_ms / 1000)
+    return jsonify({"status": "success", "order": view})
+
+@app.route("/cancel_order", methods=["POST"])
+def cancel_order():
+    order_id = (request.json or {}).get("id")
+    if not isinstance(order_id, int) or not order_queue.cancel(order_id):
+        return jsonify({"status": "error", "message": "Bestellung kann nicht storniert werden."}), 400
+    return jsonify({"status": "success", "message": f"Bestellung {order_id} storniert."})
+
+@app.route("/recipe_estimate", methods=["GET"])
+def recipe_estimate():
+    recipe_name = request.args.get("recipe")
+    if not recipe_name or not recipe_store.exists(recipe_name):
+        return jsonify({"status": "error", "message": "Rezept nicht gefunden"}), 404
 
     config = load_config()
-    pour_time = config.get("pour_time", 2000)
-    pump_position = config.get("pumpen", 250)
-
-    move_wait = config.get("move_wait", 500)
-    drip_wait = config.get("drip_wait", 1000)
-    refill_wait = config.get("refill_wait", 5000)
-
-    pump_in_progress = False
-    aggregated_pump_duration = 0
-    abtropfzeit = 0
-    current_target = None
-    notes_collected = []
-
-    def trigger_pump_aggregation(pump_number, duration, abtropf):
-        # Pumpe auslösen und auf Pumpenlauf warten
-        resp = send_command_to_esp({"command":"pump","pump":pump_number,"duration":duration})
-        # Pumpe meldet sofort Erfolg, wir warten die Laufzeit ab
-        time.sleep(duration / 1000.0)
-        # Danach Abtropfzeit abwarten
-        time.sleep(abtropf / 1000.0)
-
+    plan = get_plan(recipe_name)
+    estimate = estimate_plan(plan, config, esp_transport.last_position)
+    return jsonify({
+        "status": "success",
+        "total_ms": estimate.total_ms,
+        "breakdown": estimate.breakdown,
+        "saved_ms": plan.saved_ms,
+        "peephole_ms": plan.peephole_ms,
+        "from_position": esp_transport.last_position
+    })
+
+def _set_progress_step(plan, estimate, idx):
+    """Setzt den laufenden Schritt für die zeitgewichtete Fortschrittsanzeige und den Trace."""
+    global current_progress, progress_done_ms, progress_step_ms, progress_step_started
+    step = plan.steps[idx]
+    tracer.step(idx, step.kind, step.target, estimate.step_ms[idx])
+    progress_done_ms = sum(estimate.step_ms[:idx])
+    progress_step_ms = estimate.step_ms[idx]
+    progress_step_started = clock.now()
+    if progress_total_ms > 0:
+        current_progress = int(progress_done_ms / progress_total_ms * 100)
+    events.publish("step", {"recipe": active_recipe, "index": idx, "total": len(estimate.step_ms)})
+
+def _send_step(command, step):
+    """Sendet einen Befehl eines Planschritts; RuntimeError, wenn der ESP ihn nicht bestätigt."""
+    resp = send_command_to_esp(command)
+    if resp.get("status") != "success":
+        label = f"{step.kind} {step.target or ''}".strip()
+        raise RuntimeError(f"ESP-Fehler bei '{label}': {resp.get('message', 'keine Bestätigung')}")
+    return resp
+
+def _run_steps(plan, estimate, start=0, stop=None):
+    """
+    Einzelschritt-Modus: jeder Schritt ist ein eigener Roundtrip zum ESP.
+    Bricht mit RuntimeError ab, wenn der ESP getrennt ist oder einen Befehl nicht bestätigt.
+    """
+    for idx in range(start, len(plan.steps) if stop is None else stop):
+        step = plan.steps[idx]
+        _set_progress_step(plan, estimate, idx)
+        log.debug("Verarbeite Schritt: %s %s, progress: %s%%", step.kind, step.target or '', current_progress)
+
+        if not esp_transport.connected:
+            raise RuntimeError("ESP nicht verbunden, Rezeptausführung abgebrochen.")
+
+        if step.kind == "move":
+            log.debug("Bewege Plattform zu %s mm für '%s'...", step.position, step.target)
+            _send_step({"command":"move","position":step.position}, step)
+
+        elif step.kind == "servo":
+            log.debug("Servo: %s ms Verzögerung.", step.duration)
+            _send_step({"command":"servo","delay":step.duration}, step)
+
+        elif step.kind == "pump":
+            log.debug("Aktiviere Pumpe %s für %s ms, Abtropfzeit %s ms.", step.pump, step.duration, step.drip)
+            _send_step({"command":"pump","pump":step.pump,"duration":step.duration}, step)
+            # Pumpe meldet sofort Erfolg, wir warten die Laufzeit und danach die Abtropfzeit ab
+            clock.sleep(step.duration / 1000.0)
+            clock.sleep(step.drip / 1000.0)
+
+        elif step.kind == "pumps":
+            log.debug("Aktiviere Pumpen (Nr., ms) %s gleichzeitig, längste Laufzeit %s ms, Abtropfzeit %s ms.",
+                      step.pump, step.duration, step.drip)
+            started = clock.now()
+            for pump_number, duration in step.pump:
+                _send_step({"command":"pump","pump":pump_number,"duration":duration}, step)
+            # Die Pumpen laufen auf dem ESP parallel, gewartet wird nur auf die längste
+            remaining = step.duration / 1000.0 - (clock.now() - started)
+            clock.sleep(max(0, remaining))
+            clock.sleep(step.drip / 1000.0)
+
+        elif step.kind == "wait":
+            log.debug("Warte %s ms.", step.duration)
+            clock.sleep(step.duration / 1000.0)
+
+def _run_range(plan, estimate, start, stop, use_batch):
+    """Führt die Schritte start..stop aus; liefert (Status, Fehler) wie der Trace."""
+    if start >= stop:
+        return "ok", None
+    if not use_batch:
+        _run_steps(plan, estimate, start, stop)
+        return "ok", None
+    # Ganzer Abschnitt in einer Nachricht, der ESP meldet den Fortschritt pro Schritt
+    ok, message, started = run_batch(esp_transport, plan.steps[start:stop], estimate.step_ms[start:stop],
+                                     on_step=lambda idx: _set_progress_step(plan, estimate, start + idx))
+    if ok:
+        return "ok", None
+    log.warning("Batch-Ausführung fehlgeschlagen: %s", message)
+    if started:
+        return "error", message
+    log.warning("Falle auf Einzelschritt-Modus zurück.")
+    _run_steps(plan, estimate, start, stop)
+    return "fallback", message
+
+def _skip_park(plan, park, config):
+    """
+    Parkfahrt auslassen, wenn schon die nächste Bestellung bereitsteht; trägt
+    die gesparte Fahrzeit in den Trace ein. Liefert True, wenn ausgelassen.
+    """
+    if not esp_health.online:
+        return False
+    following = order_queue.peek()
+    if following is None:
+        return False
     try:
-        with open(os.path.join(RECIPE_FOLDER, recipe_file), "r") as file:
-            commands = file.readlines()
-            total_commands = len(commands)
-
-            for idx, command in enumerate(commands):
-                command = command.strip()
-                if not command:
-                    continue
-                current_progress = int((idx + 1) / total_commands * 100)
-                print(f"[DEBUG] Verarbeite Befehl: {command}, progress: {current_progress}%")
-
-                if not esp_connected or ser is None or not ser.is_open:
-                    print("[DEBUG] ESP nicht verbunden. Breche Rezept ausführung ab.")
-                    break
-
-                if command.startswith("start"):
-                    print(f"Rezept '{recipe_file}' gestartet.")
-                    continue
-
-                elif command.startswith("move"):
-                    target = command.split()[1]
-
-                    if pump_in_progress:
-                        pump_number = next((i for i in range(1, 5) if config.get(f"pump{i}") == current_target), None)
-                        if pump_number:
-                            print(f"[DEBUG] Aggregation endet. Aktiviere Pumpe {pump_number} für {aggregated_pump_duration} ms.")
-                            trigger_pump_aggregation(pump_number, aggregated_pump_duration, abtropfzeit)
-                        pump_in_progress = False
-                        aggregated_pump_duration = 0
-                        abtropfzeit = 0
-
-                    if target.isdigit():
-                        position = int(target)
-                        current_target = None
-                    elif target in config:
-                        position = config[target]
-                        current_target = target
-                    else:
-                        pump_number = next((i for i in range(1, 5) if config.get(f"pump{i}") == target), None)
-                        if pump_number is None:
-                            print(f"[DEBUG] Fehler: Ziel '{target}' ist nicht in der Konfiguration vorhanden.")
-                            continue
-                        position = config.get(f"pump{pump_number}_position", 250)
-                        current_target = target
-
-                    print(f"[DEBUG] Bewege Plattform zu {position} mm für '{target}'...")
-                    send_command_to_esp({"command":"move","position":position})
-
-                elif command.startswith("servo"):
-                    if not current_target:
-                        print("[DEBUG] Fehler: Kein gültiges Ziel für 'servo' vorhanden.")
-                        continue
-
-                    parts = command.split()
-                    mode, value = parts[1], parts[2]
-                    if mode == "cl":
-                        cl = float(value)
-                        pump_number = next((i for i in range(1, 5) if config.get(f"pump{i}") == current_target), None)
-                        if pump_number:
-                            pump_time_specific = config.get(f"pump{pump_number}_time", 1000)
-                            aggregated_pump_duration += int(cl * pump_time_specific)
-                            pump_in_progress = True
-                            print(f"[DEBUG] Aggregiere Pumpe: Ziel {current_target}, Pumpe {pump_number}, {cl} cl => {aggregated_pump_duration} ms total.")
-                        else:
-                            delay = int((cl / 2) * pour_time)
-                            print(f"[DEBUG] Bewege Servo für {cl} cl mit Verzögerung {delay} ms (kein Pumpenziel).")
-                            send_command_to_esp({"command":"servo","delay":delay})
-
-                    elif mode == "ms":
-                        delay = int(value)
-                        print(f"[DEBUG] Servo ms: {delay} ms Verzögerung.")
-                        send_command_to_esp({"command":"servo","delay":delay})
-
-                elif command.startswith("wait"):
-                    parts = command.split()
-                    if len(parts) != 2:
-                        print(f"[DEBUG] Ungültiger wait-Befehl: {command}")
-                        continue
-                    wait_value = parts[1]
-
-                    if wait_value.isdigit():
-                        duration = int(wait_value)
-                    else:
-                        if wait_value == "move_wait":
-                            duration = move_wait
-                        elif wait_value == "drip_wait":
-                            duration = drip_wait
-                        elif wait_value == "refill_wait":
-                            duration = refill_wait
-                        else:
-                            print(f"[DEBUG] Unbekannter wait-Platzhalter: {wait_value}, Standard 500ms.")
-                            duration = 500
-
-                    if pump_in_progress:
-                        abtropfzeit = duration
-                        print(f"[DEBUG] Setze Abtropfzeit auf {abtropfzeit} ms (Platzhalter: {wait_value}).")
-                    else:
-                        print(f"[DEBUG] Warte {duration} ms (Platzhalter: {wait_value}).")
-                        time.sleep(duration / 1000.0)
-
-                elif command.startswith("note"):
-                    note = command[len("note"):].strip()
-                    if note:
-                        notes_collected.append(note)
-                        print(f"[DEBUG] Hinzugefügte Note: {note}")
-
-                elif command.startswith("done"):
-                    if pump_in_progress:
-                        pump_number = next((i for i in range(1, 5) if config.get(f"pump{i}") == current_target), None)
-                        if pump_number and aggregated_pump_duration > 0:
-                            pump_time_specific = config.get(f"pump{pump_number}_time", 1000)
-                            print(f"[DEBUG] Rezeptende: Aktiviere Pumpe {pump_number} für {aggregated_pump_duration} ms.")
-                            trigger_pump_aggregation(pump_number, aggregated_pump_duration, abtropfzeit)
-                        pump_in_progress = False
-                        aggregated_pump_duration = 0
-                        abtropfzeit = 0
-
-                    print(f"Rezept '{recipe_file}' abgeschlossen.")
-                    break
-
+        next_move = motion.first_move(plan_for_order(following).steps)
     except Exception as e:
-        print(f"[DEBUG] Fehler beim Ausführen des Rezepts: {e}")
-
-    current_progress = 100
-    is_running = False
-    active_recipe = None
-
-    # **Speichere die gesammelten Notizen für das aktuelle Rezept**
-    with current_recipe_notes_lock:
-        current_recipe_notes = {"recipe_name": original_recipe_name or recipe_file, "notes": notes_collected}
-
-    # Lösche die temporäre Rezeptdatei, wenn erforderlich
-    if temporary:
-        try:
-            os.remove(os.path.join(RECIPE_FOLDER, recipe_file))
-            print(f"[DEBUG] Temporäre Rezeptdatei '{recipe_file}' gelöscht.")
-        except Exception as e:
-            print(f"[DEBUG] Fehler beim Löschen der temporären Rezeptdatei '{recipe_file}': {e}")
-
-def execute_custom_recipe(commands, recipe_name):
-    """Execute custom recipe with note collection."""
+        log.warning("Plan der Bestellung %s nicht vorab kompilierbar: %s", following["id"], e)
+        return False
+    if next_move is None:
+        return False
+    here = motion.last_position(plan.steps[:park], esp_transport.last_position)
+    if here is None:
+        return False
+    saved_ms = motion.chain_saving_ms(here, plan.steps[park].position, next_move.position, config)
+    tracer.annotate(park_skipped=True, next_order=following["id"], chain_saved_ms=saved_ms)
+    travel_saved.inc(max(0, saved_ms) / 1000.0, reason="chain")
+    log.info("Bestellung %s steht bereit: Parkfahrt entfällt (ca. %.1f s gespart).",
+             following["id"], saved_ms / 1000)
+    return True
+
+def execute_plan(plan, recipe_name, order_id=None):
+    """Führt einen kompilierten Plan aus und sammelt die Notizen; liefert (Status, Fehler) wie der Trace."""
     global active_recipe, is_running, current_progress, current_recipe_notes
+    global progress_total_ms, progress_done_ms, progress_step_ms, progress_step_started
+
+    config = load_config()
+    estimate = estimate_plan(plan, config, esp_transport.last_position)
+    progress_total_ms = estimate.total_ms
+    progress_done_ms = 0
+    progress_step_ms = 0
+    progress_step_started = clock.now()
     active_recipe = recipe_name
     is_running = True
     current_progress = 0
 
-    config = load_config()
-    pour_time = config.get("pour_time", 2000)
-    move_wait = config.get("move_wait", 500)
-    drip_wait = config.get("drip_wait", 1000)
-    refill_wait = config.get("refill_wait", 5000)
-
-    pump_in_progress = False
-    aggregated_pump_duration = 0
-    abtropfzeit = 0
-    current_target = None
-    notes_collected = []
-
-    def trigger_pump_aggregation(pump_number, duration, abtropf):
-        resp = send_command_to_esp({"command":"pump","pump":pump_number,"duration":duration})
-        time.sleep(duration / 1000.0)
-        time.sleep(abtropf / 1000.0)
-
-    try:
-        total_commands = len(commands)
-        for idx, command in enumerate(commands):
-            command = command.strip()
-            if not command:
-                continue
-            current_progress = int((idx + 1) / total_commands * 100)
-            print(f"[DEBUG] (Custom) Verarbeite Befehl: {command}, progress: {current_progress}%")
-
-            if command.startswith("start"):
-                print(f"Custom Rezept '{recipe_name}' gestartet.")
-                continue
-
-            elif command.startswith("move"):
-                parts = command.split()
-                if len(parts) == 2:
-                    target = parts[1]
-
-                    # Beende laufende Pumpenoperationen, falls vorhanden
-                    if pump_in_progress:
-                        pump_number = next((i for i in range(1, 5) if config.get(f"pump{i}") == current_target), None)
-                        if pump_number and aggregated_pump_duration > 0:
-                            pump_time_specific = config.get(f"pump{pump_number}_time", 1000)
-                            print(f"[DEBUG] (Custom) Aggregation endet bei move. Aktiviere Pumpe {pump_number} für {aggregated_pump_duration} ms.")
-                            trigger_pump_aggregation(pump_number, aggregated_pump_duration, abtropfzeit)
-                        print(f"[DEBUG] (Custom) Pumpenlauf abgeschlossen, warte Abtropfzeit: {abtropfzeit} ms.")
-                        time.sleep(abtropfzeit / 1000.0)
-                        abtropfzeit = 0
-                        aggregated_pump_duration = 0
-                        pump_in_progress = False
-
-                    # Zielposition bestimmen
-                    if target.isdigit():
-                        position = int(target)
-                        current_target = None
-                    elif target in config:
-                        position = config[target]
-                        current_target = target
-                    else:
-                        pump_number = next((i for i in range(1, 5) if config.get(f"pump{i}") == target), None)
-                        if pump_number:
-                            position = config.get(f"pump{pump_number}_position", 250)
-                            current_target = target
-                        else:
-                            print(f"[DEBUG] (Custom) Fehler: Ziel '{target}' nicht in der Konfiguration.")
-                            continue
-
-                    print(f"[DEBUG] (Custom) Bewege Plattform zu {position} mm für '{target}'...")
-                    send_command_to_esp({"command":"move","position":position})
-                else:
-                    print(f"[DEBUG] (Custom) Ungültiger move-Befehl: {command}")
-
-            elif command.startswith("servo"):
-                parts = command.split()
-                if len(parts) >= 3:
-                    mode = parts[1]
-                    value = parts[2]
-                    if mode == "cl":
-                        cl = float(value)
-                        pump_number = next((i for i in range(1, 5) if config.get(f"pump{i}") == current_target), None)
-                        if pump_number:
-                            pump_time_specific = config.get(f"pump{pump_number}_time", 1000)
-                            aggregated_pump_duration += int(cl * pump_time_specific)
-                            pump_in_progress = True
-                            print(f"[DEBUG] (Custom) Aggregiere Pumpe: {cl} cl => {aggregated_pump_duration} ms total für Ziel {current_target}, Pumpe {pump_number}")
-                        else:
-                            delay = int((cl / 2) * pour_time)
-                            print(f"[DEBUG] (Custom) Servo für {cl} cl mit Verzögerung {delay} ms (kein Pumpenziel).")
-                            send_command_to_esp({"command":"servo","delay":delay})
-                    elif mode == "ms":
-                        delay = int(value)
-                        print(f"[DEBUG] (Custom) Servo ms: {delay} ms Verzögerung.")
-                        send_command_to_esp({"command":"servo","delay":delay})
-                    else:
-                        print(f"[DEBUG] (Custom) Unbekannter servo Modus: {mode}")
-                else:
-                    print(f"[DEBUG] (Custom) Ungültiger servo-Befehl: {command}")
-
-            elif command.startswith("wait"):
-                parts = command.split()
-                if len(parts) == 2:
-                    wait_value = parts[1]
-                    if wait_value.isdigit():
-                        duration = int(wait_value)
-                        print(f"[DEBUG] (Custom) Warte {duration} ms (Zahl).")
-                    else:
-                        if wait_value == "move_wait":
-                            duration = move_wait
-                            print(f"[DEBUG] (Custom) Warte {duration} ms (Platzhalter: move_wait).")
-                        elif wait_value == "drip_wait":
-                            duration = drip_wait
-                            print(f"[DEBUG] (Custom) Warte {duration} ms (Platzhalter: drip_wait).")
-                        elif wait_value == "refill_wait":
-                            duration = refill_wait
-                            print(f"[DEBUG] (Custom) Warte {duration} ms (Platzhalter: refill_wait).")
-                        else:
-                            duration = 500
-                            print(f"[DEBUG] (Custom) Unbekannter wait-Platzhalter: {wait_value}, verwende 500 ms.")
-
-                    if pump_in_progress:
-                        abtropfzeit = duration
-                        print(f"[DEBUG] (Custom) Setze Abtropfzeit auf {abtropfzeit} ms.")
-                    else:
-                        time.sleep(duration / 1000.0)
-                else:
-                    print(f"[DEBUG] (Custom) Ungültiger wait-Befehl: {command}")
-
-            elif command.startswith("note"):
-                note = command[len("note"):].strip()
-                if note:
-                    notes_collected.append(note)
-                    print(f"[DEBUG] (Custom) Hinzugefügte Note: {note}")
-
-            elif command.startswith("done"):
-                # Beende laufende Pumpenoperationen
-                if pump_in_progress:
-                    pump_number = next((i for i in range(1, 5) if config.get(f"pump{i}") == current_target), None)
-                    if pump_number and aggregated_pump_duration > 0:
-                        pump_time_specific = config.get(f"pump{pump_number}_time", 1000)
-                        print(f"[DEBUG] (Custom) Rezeptende: Aktiviere Pumpe {pump_number} für {aggregated_pump_duration} ms.")
-                        trigger_pump_aggregation(pump_number, aggregated_pump_duration, abtropfzeit)
-                    print(f"[DEBUG] (Custom) Pumpenlauf abgeschlossen, warte Abtropfzeit: {abtropfzeit} ms.")
-                    time.sleep(abtropfzeit / 1000.0)
-                    abtropfzeit = 0
-                    aggregated_pump_duration = 0
-                    pump_in_progress = False
-
-                print(f"Custom Rezept '{recipe_name}' abgeschlossen.")
-                break
+    use_batch = bool(plan.steps) and config.get("batch_mode", True) and esp_transport.supports_batch
+    # Die abschließende Parkfahrt läuft getrennt, damit sie bei bereitstehender Bestellung entfallen kann
+    park = motion.park_index(plan.steps)
+    if not config.get("chain_orders", True):
+        park = len(plan.steps)
+    status, error = "ok", None
+    idle_motion.cancel()
+    with idle_motion.lock:
+        prepositioned = idle_motion.record(plan.steps)
+        if prepositioned.get("preposition_saved_ms", 0) > 0:
+            travel_saved.inc(prepositioned["preposition_saved_ms"] / 1000.0, reason=prepositioned["preposition"])
+        tracer.begin(order_id, recipe_name, estimate.total_ms, mode="batch" if use_batch else "steps",
+                     steps=len(plan.steps), start_mm=esp_transport.last_position, **prepositioned)
+        try:
+            log.info("Rezept '%s' gestartet (geschätzt %.1f s).", recipe_name, estimate.total_ms / 1000,
+                     extra={"order": order_id})
+            status, error = _run_range(plan, estimate, 0, park, use_batch)
+            if park < len(plan.steps) and status != "error" and not _skip_park(plan, park, config):
+                park_status, park_error = _run_range(plan, estimate, park, len(plan.steps), use_batch)
+                if park_status != "ok":
+                    status, error = park_status, park_error
+            if status == "error":
+                log.error("Rezept '%s' abgebrochen: %s", recipe_name, error, extra={"order": order_id})
+            else:
+                log.info("Rezept '%s' abgeschlossen.", recipe_name, extra={"order": order_id})
+        except Exception as e:
+            log.exception("Fehler beim Ausführen des Rezepts: %s", e, extra={"order": order_id})
+            status, error = "error", str(e)
 
-    except Exception as e:
-        print(f"[DEBUG] Fehler beim Ausführen des Custom Rezepts: {e}")
+        trace = tracer.end(status, error)
+    if trace is not None:
+        recipe_duration.observe(trace["actual_ms"] / 1000.0, status=status)
 
     current_progress = 100
     is_running = False
@@ -867,63 +936,42 @@ def execute_custom_recipe(commands, recipe_name):
 
     # **Speichere die gesammelten Notizen für das aktuelle Rezept**
     with current_recipe_notes_lock:
-        current_recipe_notes = {"recipe_name": recipe_file, "notes": notes_collected}
-
-    # Lösche die temporäre Rezeptdatei, wenn erforderlich
-    if temporary:
-        try:
-            os.remove(os.path.join(RECIPE_FOLDER, recipe_file))
-            print(f"[DEBUG] Temporäre Rezeptdatei '{recipe_file}' gelöscht.")
-        except Exception as e:
-            print(f"[DEBUG] Fehler beim Löschen der temporären Rezeptdatei '{recipe_file}': {e}")
+        current_recipe_notes = {"recipe_name": recipe_name, "notes": list(plan.notes)}
+    return status, error
+
+def speculate_for(plan):
+    """Opt-in: beim Ansehen eines Rezepts schon zu dessen erster Flasche fahren (nur im Leerlauf)."""
+    move = motion.first_move(plan.steps)
+    if (move is None or not load_config().get("speculative_preposition", False)
+            or is_running or order_queue.busy or not esp_health.online):
+        return False
+    idle_motion.speculate(move.target, move.position)
+    return True
 
 @app.route("/get_recipe_ingredients")
 def get_recipe_ingredients():
     recipe_name = request.args.get("recipe")
     if not recipe_name:
         return jsonify({"status": "error", "message": "Kein Rezept angegeben"}), 400
-    recipe_path = os.path.join(RECIPE_FOLDER, recipe_name)
-    if not os.path.exists(recipe_path):
+    if not recipe_store.exists(recipe_name):
         return jsonify({"status": "error", "message": "Rezept nicht gefunden"}), 404
 
     try:
-        with open(recipe_path, "r") as f:
-            lines = f.readlines()
-
-        config = load_config()
-        ingredientAmounts = {}
-        currentIngredient = None
-        notes = []
-        for line in lines:
-            line = line.strip()
-            if line.startswith("move"):
-                args = line.split()
-                if len(args) == 2:
-                    currentIngredient = args[1]
-            elif line.startswith("servo cl") and currentIngredient:
-                val = float(line.split()[2])
-                if currentIngredient not in ingredientAmounts:
-                    ingredientAmounts[currentIngredient] = 0.0
-                ingredientAmounts[currentIngredient] += val
-            elif line.startswith("note"):
-                note = line[len("note"):].strip()
-                if note:
-                    notes.append(note)
-
-        ing_list = []
-        for ing, amt in ingredientAmounts.items():
-            ing_list.append({"name": ing, "amount": amt})
-
-        return jsonify({"status": "success", "ingredients": ing_list, "notes": notes})
+        plan = get_plan(recipe_name)
+        ing_list = [{"name": ing, "amount": amt} for ing, amt in plan.ingredients]
+        return jsonify({"status": "success", "ingredients": ing_list, "notes": list(plan.notes),
+                        "speculating": speculate_for(plan)})
     except Exception as e:
-        print(e)
+        log.error("Fehler beim Lesen der Zutaten von '%s': %s", recipe_name, e)
         return jsonify({"status": "error", "message": "Fehler beim Lesen des Rezepts"}), 500
 
+@app.route("/cancel_speculation", methods=["POST"])
+def cancel_speculation():
+    """Dialog ohne Bestellung geschlossen: noch nicht begonnene spekulative Fahrt verwerfen."""
+    return jsonify({"status": "success", "cancelled": idle_motion.cancel()})
+
 @app.route("/run_custom_recipe", methods=["POST"])
 def run_custom_recipe():
-    global is_running
-    if is_running:
-        return jsonify({"status": "error", "message": "Ein Rezept wird bereits ausgeführt."}), 400
     if not check_esp_connection():
         return jsonify({"status": "error", "message": "ESP ist nicht verbunden."}), 400
 
@@ -933,55 +981,19 @@ def run_custom_recipe():
     if not recipe_name or not ingredients:
         return jsonify({"status": "error", "message": "Rezeptname oder Zutaten fehlen"}), 400
 
-    recipe_path = os.path.join(RECIPE_FOLDER, recipe_name)
-    if not os.path.exists(recipe_path):
+    if not recipe_store.exists(recipe_name):
         return jsonify({"status": "error", "message": "Rezept nicht gefunden"}), 404
 
     try:
-        with open(recipe_path, "r") as f:
-            original_lines = f.readlines()
-
         ing_map = {ing["name"]: ing["amount"] for ing in ingredients}
-        config = load_config()
-
-        currentIngredient = None
-        new_commands = []
-        notes_collected = []
-        for line in original_lines:
-            line = line.strip()
-            if line.startswith("move"):
-                args = line.split()
-                if len(args) == 2:
-                    currentIngredient = args[1]
-                new_commands.append(line)
-            elif line.startswith("servo cl") and currentIngredient:
-                parts = line.split()
-                original_val = float(parts[2])
-                new_val = ing_map.get(currentIngredient, original_val)
-                parts[2] = str(new_val)
-                new_commands.append(" ".join(parts))
-            elif line.startswith("note"):
-                note = line[len("note"):].strip()
-                if note:
-                    notes_collected.append(note)
-                new_commands.append(line)
-            else:
-                new_commands.append(line)
-
-        thread = Thread(target=execute_custom_recipe, args=(new_commands, recipe_name,))
-        thread.start()
-        return jsonify({"status": "success", "message": "Angepasstes Rezept gestartet."})
+        plan = recipe_compiler.variant(recipe_name, load_config(), amount_overrides=ing_map)
+        return enqueue_order("custom", recipe_name, plan, params={"amounts": ing_map})
     except Exception as e:
-        print(e)
+        log.error("Fehler beim Anpassen des Rezepts '%s': %s", recipe_name, e)
         return jsonify({"status": "error", "message": "Fehler beim Anpassen des Rezepts."}), 500
 
 @app.route("/run_recipe_without_missing", methods=["POST"])
 def run_recipe_without_missing():
-    global is_running
-
-    if is_running:
-        return jsonify({"status": "error", "message": "Ein Rezept wird bereits ausgeführt."}), 400
-
     if not check_esp_connection():
         return jsonify({"status": "error", "message": "ESP ist nicht verbunden."}), 400
 
@@ -989,60 +1001,16 @@ def run_recipe_without_missing():
     recipe_name = data.get("recipe")
     missing_ingredients = data.get("missing_ingredients", [])
 
-    if not recipe_name or not os.path.exists(os.path.join(RECIPE_FOLDER, recipe_name)):
+    if not recipe_name or not recipe_store.exists(recipe_name):
         return jsonify({"status": "error", "message": "Ungültiges Rezept."}), 400
 
     try:
-        with open(os.path.join(RECIPE_FOLDER, recipe_name), "r") as f:
-            commands = f.readlines()
-
-        # Filtere Befehle, die mit den fehlenden Zutaten verbunden sind
-        filtered_commands = []
-        skip = False
-        for line in commands:
-            line = line.strip()
-            if not line:
-                continue
-
-            if line.startswith("move"):
-                parts = line.split()
-                if len(parts) != 2:
-                    # Ungültiger move-Befehl, füge ihn hinzu und setze skip zurück
-                    filtered_commands.append(line)
-                    skip = False
-                    continue
-
-                ingredient = parts[1]
-                if ingredient in missing_ingredients:
-                    skip = True
-                else:
-                    skip = False
-
-                filtered_commands.append(line)
-            elif skip:
-                # Überspringe Befehle bis zum nächsten "wait drip_wait"
-                if line.startswith("wait") and "drip_wait" in line:
-                    skip = False
-                    filtered_commands.append(line)  # Füge den "wait drip_wait" Befehl hinzu
-                else:
-                    continue
-            else:
-                filtered_commands.append(line)
-
-        # Erstelle eine temporäre Rezeptdatei ohne die fehlenden Zutaten
-        temp_recipe_name = f"temp_skip_{int(time.time())}.txt"
-        temp_recipe_path = os.path.join(RECIPE_FOLDER, temp_recipe_name)
-        with open(temp_recipe_path, "w") as f:
-            f.write("\n".join(filtered_commands))
-
-        # Führe das temporäre Rezept aus und setze active_recipe auf den Originalrezeptnamen
-        thread = Thread(target=execute_recipe, args=(temp_recipe_name, True, recipe_name))
-        thread.start()
-
-        return jsonify({"status": "success", "message": f"Rezept '{recipe_name}' ohne fehlende Zutaten gestartet."})
+        # Blöcke der fehlenden Zutaten werden beim Kompilieren ausgelassen
+        plan = recipe_compiler.variant(recipe_name, load_config(), skip_targets=set(missing_ingredients))
+        return enqueue_order("without_missing", recipe_name, plan, params={"missing": list(missing_ingredients)})
 
     except Exception as e:
-        print(f"Fehler beim Ausführen des Rezepts ohne fehlende Zutaten: {e}")
+        log.error("Fehler beim Ausführen des Rezepts ohne fehlende Zutaten: %s", e)
         return jsonify({"status": "error", "message": "Fehler beim Ausführen des Rezepts ohne fehlende Zutaten."}), 500
 
 
@@ -1114,6 +1082,32 @@ def calibrate():
         save_config(config)
         return jsonify({"status": "success", "message": "Kalibrierte Werte erfolgreich gespeichert."})
 
+@app.route("/dispensers", methods=["GET", "POST"])
+def dispenser_profiles():
+    """Portionierer-Profile der Flaschen; POST {"bottle", "profile"} setzt eins, profile null entfernt es."""
+    config = load_config()
+    if request.method == "POST":
+        data = request.json or {}
+        bottle = data.get("bottle")
+        if not bottle or bottle not in drink_names(config) or pump_for(config, bottle):
+            return jsonify({"status": "error", "message": f"Unbekannte Flasche: {bottle}"}), 400
+        profiles = dict(config.get("dispensers") or {})
+        if data.get("profile") is None:
+            profiles.pop(bottle, None)
+        else:
+            values, error_msg = dispensers.validate(data["profile"])
+            if error_msg:
+                return jsonify({"status": "error", "message": error_msg}), 400
+            profiles[bottle] = values
+        config_store.update({"dispensers": profiles})
+        config = load_config()
+
+    custom = config.get("dispensers") or {}
+    return jsonify({"status": "success", "dispensers": {
+        bottle: dict(dispensers.profile(config, bottle)._asdict(), custom=bottle in custom)
+        for bottle in drink_names(config) if not pump_for(config, bottle)
+    }})
+
 def validate_recipe_command(command, config):
     command = command.strip()
     if not command:
@@ -1121,7 +1115,7 @@ def validate_recipe_command(command, config):
 
     parts = command.split()
     if parts[0] == "move":
-        if len(parts) != 2:
+        if len(parts) not in (2, 3) or (len(parts) == 3 and parts[2] != "fixed"):
             return False, f"Ungültiger move-Befehl: {command}"
         target = parts[1]
         if not target.isdigit() and target not in config:
@@ -1167,51 +1161,51 @@ def get_last_recipe_notes():
 
 @app.route("/reconnect_esp", methods=["POST"])
 def reconnect_esp():
-    global esp_connected
-
     if is_running:
         return jsonify({
             "status": "error",
             "message": "Rezept läuft gerade. Bitte später erneut versuchen."
         }), 400
 
-    init_serial()
-
-    if esp_connected:
-        return jsonify({
-            "status": "success",
-            "message": "ESP erfolgreich neu verbunden."
-        })
-    else:
-        return jsonify({
-            "status": "error",
-            "message": "Neuverbindung zum ESP fehlgeschlagen."
-        }), 500
-
+    # Nur anstoßen; das Ergebnis kommt über /events bzw. /esp_status
+    esp_connector.trigger(reconnect=True)
+    return jsonify({
+        "status": "pending",
+        "message": "Neuverbindung zum ESP gestartet.",
+        "connector": esp_connector.status()
+    }), 202
+
+
+def ensure_network():
+    """WLAN prüfen; ohne Verbindung Hotspot und WLAN-Portal (wifi.py) starten."""
+    if is_wifi_connected():
+        log.info("WLAN ist verbunden.")
+        return
+    # Hotspot erstellen und Nachricht ausgeben
+    subprocess.run([
+        'sudo', 'nmcli', 'device', 'wifi', 'hotspot',
+        'ssid', 'barbot',
+        'password', '12345678',
+        'ifname', 'wlan0'
+    ], check=True, timeout=60)
+    log.info("Kein WLAN erkannt und Hotspot wurde erstellt.")
+    # Das Portal läuft als eigener Prozess neben der Bar-Oberfläche
+    boot.spawn("wifi_portal", ['sudo', 'python', 'wifi.py'])
 
 if __name__ == "__main__":
-    # 1) Starte den Webserver sofort
-    print("Starte Flask-Server...")
-    Thread(target=init_serial).start()
-
-    # 2) WLAN-Scanner-Start
-    if not is_wifi_connected():
-        # Hotspot erstellen und Nachricht ausgeben
-        subprocess.run([
-            'sudo', 'nmcli', 'device', 'wifi', 'hotspot',
-            'ssid', 'barbot',
-            'password', '12345678',
-            'ifname', 'wlan0'
-        ], check=True)
-        print("Kein WLAN erkannt und Hotspot wurde erstellt.")
-        
-        # wifi.py ausführen
-        subprocess.run([
-            'sudo', 'python', 'wifi.py'
-        ], check=True)
-        print("wifi.py wurde erfolgreich ausgeführt.")
-    else:
-        print("WLAN ist verbunden.")
-
-    # 3) Und nun: Flask-Server läuft (unabhängig vom init_serial())
-    app.run(host="0.0.0.0", port=5001, debug=True)
+    # 1) Die Bar-Oberfläche kommt zuerst; alles andere startet parallel im Hintergrund
+    log.info("Starte Flask-Server...")
+    boot.start("config_watch", config_store.start_watching)
+    boot.start("esp_connector", esp_connector.start)
+    boot.start("esp_health", esp_health.start)
+    boot.start("order_queue", order_queue.start)
+    Thread(target=event_loop, daemon=True).start()
+    publish_esp_health(esp_health.snapshot())
+
+    # 2) WLAN-Prüfung, Hotspot und Portal blockieren den Start nicht mehr
+    boot.start("network", ensure_network)
+    boot.mark("services_started")
+
+    # 3) Mehrthreadiger WSGI-Server; Entwicklungsmodus mit "--dev" oder BARBOT_DEV=1.
+    #    Ohne Reloader, damit ESP-Port und Warteschlange nur einmal existieren
+    serve(app, "0.0.0.0", 5001)
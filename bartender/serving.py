@@ -0,0 +1,91 @@
+"""
+Auslieferung im Betrieb: mehrthreadiger WSGI-Server statt Flask-Entwicklungsserver,
+bedingte GET-Anfragen (ETag/304) und gzip für große Antworten.
+
+Ist waitress installiert, wird es verwendet, sonst der mehrthreadige Server
+von Werkzeug (ohne Debugger und Reloader). Der Entwicklungsmodus (Debugger)
+bleibt über "--dev" oder BARBOT_DEV=1 verfügbar.
+
+Gestreamte Antworten (SSE unter /events) werden weder gepuffert noch
+komprimiert. Jeder SSE-Client belegt dauerhaft einen Thread; SSE_CLIENT_LIMIT
+hält genug Threads für normale Anfragen (u.a. /ready) frei.
+"""
+import os
+import sys
+import gzip
+
+from flask import request
+
+import logs
+
+log = logs.get("serving")
+
+DEV_ENV = "BARBOT_DEV"
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+GZIP_MIMETYPES = ("text/html", "text/css", "text/plain", "application/json", "application/javascript")
+# Jeder SSE-Client belegt einen Thread, daher großzügig bemessen
+WSGI_THREADS = 32
+# Höchstens so viele gleichzeitige SSE-Clients; der Rest des Pools bleibt für Anfragen
+SSE_CLIENT_LIMIT = WSGI_THREADS - 8
+
+
+def dev_mode():
+    return "--dev" in sys.argv or os.environ.get(DEV_ENV) == "1"
+
+
+def install_http_cache(app, endpoints):
+    """
+    ETag + bedingtes GET für die angegebenen Endpunkte, gzip für alle großen
+    Textantworten. Das ETag ist schwach (W/...), damit es für die komprimierte
+    und die unkomprimierte Fassung gleichermaßen gilt.
+    """
+    endpoints = set(endpoints)
+
+    @app.after_request
+    def http_cache(response):
+        if request.method != "GET" or response.status_code != 200:
+            return response
+        if response.is_streamed or response.direct_passthrough:
+            return response
+
+        if request.endpoint in endpoints:
+            response.add_etag(weak=True)
+            response.headers["Cache-Control"] = "no-cache"
+            response.make_conditional(request)
+            if response.status_code == 304:
+                return response
+
+        if ("gzip" in request.headers.get("Accept-Encoding", "")
+                and response.mimetype in GZIP_MIMETYPES
+                and "Content-Encoding" not in response.headers):
+            body = response.get_data()
+            if len(body) >= GZIP_MIN_SIZE:
+                response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL))
+                response.headers["Content-Encoding"] = "gzip"
+                response.vary.add("Accept-Encoding")
+        return response
+
+
+def serve(app, host, port, dev=None, threads=WSGI_THREADS):
+    """Startet den passenden Server und blockiert."""
+    if dev is None:
+        dev = dev_mode()
+    if dev:
+        log.info("Entwicklungsmodus auf %s:%s (Debugger aktiv).", host, port)
+        app.run(host=host, port=port, debug=True, use_reloader=False, threaded=True)
+        return
+
+    try:
+        from waitress import serve as waitress_serve
+    except ImportError:
+        waitress_serve = None
+
+    if waitress_serve is not None:
+        log.info("Produktivmodus mit waitress auf %s:%s (%s Threads).", host, port, threads)
+        waitress_serve(app, host=host, port=port, threads=threads, send_bytes=1)
+        return
+
+    from werkzeug.serving import make_server
+    log.info("Produktivmodus mit Werkzeug (mehrthreadig) auf %s:%s.", host, port)
+    make_server(host, port, app, threaded=True).serve_forever()
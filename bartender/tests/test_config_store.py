@@ -0,0 +1,43 @@
+import json
+
+from config_store import ConfigStore
+
+CONFIG = {"gin": 300, "pour_time": 2000}
+
+
+def store(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps(CONFIG))
+    changes = []
+    config_store = ConfigStore(str(path), debounce=60)
+    config_store.subscribe(lambda changed, old, new: changes.append(changed))
+    return path, config_store, changes
+
+
+def test_reload_picks_up_external_edit(tmp_path):
+    path, config_store, changes = store(tmp_path)
+    path.write_text(json.dumps(dict(CONFIG, gin=350)))
+    assert config_store.reload() == {"gin"}
+    assert config_store.get()["gin"] == 350
+    assert changes == [{"gin"}]
+
+
+def test_partial_write_keeps_previous_config(tmp_path):
+    path, config_store, changes = store(tmp_path)
+    version = config_store.version
+    path.write_text('{"gin": 300, "pour_')
+    assert config_store.reload() == set()
+    assert config_store.get() == CONFIG
+    assert config_store.version == version
+    assert changes == []
+
+    # Sobald die Datei fertig geschrieben ist, wird sie übernommen
+    path.write_text(json.dumps(dict(CONFIG, pour_time=2500)))
+    assert config_store.reload() == {"pour_time"}
+    assert config_store.get()["pour_time"] == 2500
+
+
+def test_broken_file_at_start(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text("{")
+    assert ConfigStore(str(path), debounce=60).get() == {}
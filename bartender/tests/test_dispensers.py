@@ -0,0 +1,35 @@
+import dispensers
+from recipe_compiler import compile_program, parse_recipe
+
+CONFIG = {"gin": 300, "refill_wait": 6000, "drip_wait": 1000, "pour_time": 2000}
+HANDWRITTEN = "move gin\nservo cl 0.5\nwait refill_wait\nservo cl 2\nwait drip_wait\nmove 10"
+
+
+def refill_waits(config):
+    plan = compile_program(parse_recipe(HANDWRITTEN), config, plan=False)
+    return [step.duration for step in plan.steps if step.kind == "wait" and step.target == "refill_wait"]
+
+
+def test_explicit_refill_wait_is_kept_by_default():
+    assert refill_waits(CONFIG) == [6000]
+
+
+def test_proportional_refill_is_opt_in():
+    # 0.5 cl aus einer 2-cl-Kammer: ein Viertel der Nachfüllzeit
+    assert refill_waits(dict(CONFIG, proportional_refill=True)) == [1500]
+
+
+def test_refill_ms():
+    dispenser = dispensers.profile(CONFIG, "gin")
+    assert dispensers.refill_ms(dispenser, 1) == 6000
+    assert dispensers.refill_ms(dispenser, 1, proportional=True) == 3000
+
+
+def test_chunk_fits_capacity():
+    dispenser = dispensers.profile(dict(CONFIG, dispensers={"gin": {"capacity_cl": 3}}), "gin")
+    for proportional in (False, True):
+        portions = dispensers.chunk(7, dispenser, proportional)
+        assert abs(sum(portions) - 7) < 1e-9
+        assert max(portions) <= 3
+        assert len(portions) == 3
+    assert dispensers.chunk(7, dispenser, proportional=True) == [1, 3, 3]
@@ -0,0 +1,39 @@
+from concurrent.futures import Future
+
+from esp_batch import BATCH_TIMEOUT_FACTOR, BATCH_TIMEOUT_MARGIN_MS, encode_steps, run_batch, wire_ms
+from recipe_compiler import Step
+
+PUMPS = Step("pumps", "cola", None, ((1, 3000), (2, 2000), (3, 1000)), 3000, 500)
+STEPS = (Step("move", "cola", 300, None, 0, 0), PUMPS, Step("wait", None, None, None, 1000, 0))
+STEP_MS = [800, 3560, 1000]
+
+
+class FakeTransport:
+    last_position = None
+
+    def __init__(self):
+        self.timeouts = []
+
+    def request(self, command, timeout=None, on_event=None):
+        self.timeouts.append(timeout)
+        future = Future()
+        future.set_result({"status": "success"})
+        return future, timeout
+
+
+def test_each_step_counted_once():
+    wire, index_map = encode_steps(STEPS)
+    assert index_map == [0, 1, 1, 1, 1, 2]
+    costs = wire_ms(index_map, STEP_MS)
+    assert costs == [800, 0, 0, 0, 3560, 1000]
+    assert sum(costs) == sum(STEP_MS)
+
+
+def test_split_step_not_counted_twice():
+    # Die Pumpengruppe wird auf beide Nachrichten verteilt
+    transport = FakeTransport()
+    ok, _, started = run_batch(transport, STEPS, STEP_MS, limit=3)
+    assert ok and started
+    expected = [800, 3560 + 1000]
+    assert transport.timeouts == [(ms * BATCH_TIMEOUT_FACTOR + BATCH_TIMEOUT_MARGIN_MS) / 1000.0 for ms in expected]
+    assert transport.last_position == 300
@@ -0,0 +1,85 @@
+import json
+from collections import namedtuple
+
+import esp_connector
+from esp_connector import BACKOFF_MAX_S, BACKOFF_START_S, PORT_ENV, EspConnector
+
+Port = namedtuple("Port", "device vid pid serial_number manufacturer product description")
+
+
+def port(device, vid=None, pid=None, serial_number=None):
+    return Port(device, vid, pid, serial_number, None, None, device)
+
+
+class FakeTransport:
+    connected = False
+
+    def detach(self, reason=""):
+        self.connected = False
+
+
+def connector(tmp_path, known=None, ports=()):
+    path = tmp_path / "esp_device.json"
+    if known is not None:
+        path.write_text(json.dumps(known))
+    result = EspConnector(FakeTransport(), 115200, device_file=str(path))
+    result._list_ports = lambda: list(ports)
+    return result
+
+
+def test_port_override(tmp_path, monkeypatch):
+    monkeypatch.setenv(PORT_ENV, "/tmp/barbot-esp")
+    assert connector(tmp_path).find_port([port("/dev/ttyUSB0", 0x10C4, 0xEA60)]) == "/tmp/barbot-esp"
+
+
+def test_remembered_device_first(tmp_path, monkeypatch):
+    monkeypatch.delenv(PORT_ENV, raising=False)
+    ports = [port("/dev/ttyUSB0", 0x10C4, 0xEA60, "A"), port("/dev/ttyUSB1", 0x1A86, 0x7523, "B")]
+    known = {"vid": 0x1A86, "pid": 0x7523, "serial_number": "B"}
+    assert connector(tmp_path, known).find_port(ports) == "/dev/ttyUSB1"
+    # Andere Seriennummer: gemerktes Gerät fehlt, erster bekannter Wandler
+    assert connector(tmp_path, dict(known, serial_number="C")).find_port(ports) == "/dev/ttyUSB0"
+    # Ohne gemerkte Seriennummer genügen VID/PID
+    assert connector(tmp_path, dict(known, serial_number=None)).find_port(ports) == "/dev/ttyUSB1"
+    assert connector(tmp_path).find_port([port("/dev/ttyS0")]) is None
+
+
+def test_backoff_doubles_and_resets_on_hotplug(tmp_path, monkeypatch):
+    ports = [port("/dev/ttyS0")]
+    esp = connector(tmp_path, ports=ports)
+    attempts = []
+    esp._connect = lambda found: attempts.append(found) and False
+    now = [1000.0]
+    monkeypatch.setattr(esp_connector.time, "time", lambda: now[0])
+
+    backoff = BACKOFF_START_S
+    delays = []
+    for _ in range(8):
+        backoff, again = esp._poll(backoff)
+        assert not again
+        delays.append(esp._next_attempt - now[0])
+        # Vor Ablauf des Abstands kein neuer Versuch
+        count = len(attempts)
+        assert esp._poll(backoff) == (backoff, False)
+        assert len(attempts) == count
+        now[0] = esp._next_attempt
+    assert delays == [min(BACKOFF_START_S * 2 ** i, BACKOFF_MAX_S) for i in range(8)]
+    assert delays[-1] == BACKOFF_MAX_S
+
+    # Neues Gerät: sofort versuchen, Abstand beginnt von vorn
+    ports.append(port("/dev/ttyUSB0", 0x10C4, 0xEA60))
+    now[0] += 1
+    count = len(attempts)
+    backoff, _ = esp._poll(backoff)
+    assert len(attempts) == count + 1
+    assert esp._next_attempt - now[0] == BACKOFF_START_S
+    assert backoff == 2 * BACKOFF_START_S
+
+
+def test_vanished_port_detaches(tmp_path, monkeypatch):
+    monkeypatch.delenv(PORT_ENV, raising=False)
+    esp = connector(tmp_path, ports=[port("/dev/ttyUSB1")])
+    esp.transport.connected = True
+    esp._port = "/dev/ttyUSB0"
+    assert esp._poll(32) == (BACKOFF_START_S, True)
+    assert not esp.transport.connected
@@ -0,0 +1,54 @@
+import time
+
+from esp_health import STALE_AFTER_S, EspHealthMonitor
+
+
+class FakeTransport:
+    connected = True
+    busy = True
+    last_rx = None
+    pending_deadline = None
+    supports_batch = False
+    last_error = None
+
+    def send(self, command, timeout=None):
+        return {"status": "online", "pumps": []}
+
+
+def silent_monitor():
+    """Online nach einem Heartbeat, danach STALE_AFTER_S lang nichts empfangen."""
+    transport = FakeTransport()
+    monitor = EspHealthMonitor(transport, is_busy=lambda: True)
+    monitor.check_now()
+    assert monitor.online
+    monitor._last_seen -= STALE_AFTER_S + 1
+    return monitor, transport
+
+
+def test_busy_host_is_no_sign_of_life():
+    monitor, _ = silent_monitor()
+    monitor._update_passive()
+    assert not monitor.online
+
+
+def test_received_line_keeps_esp_online():
+    monitor, transport = silent_monitor()
+    transport.last_rx = time.time()
+    monitor._update_passive()
+    assert monitor.online
+    assert monitor.snapshot()["last_seen"] == transport.last_rx
+
+
+def test_running_command_until_deadline():
+    monitor, transport = silent_monitor()
+    transport.pending_deadline = time.time() + 5
+    assert monitor.online
+    transport.pending_deadline = time.time() - 1
+    assert not monitor.online
+
+
+def test_disconnected_is_offline():
+    monitor, transport = silent_monitor()
+    transport.last_rx = time.time()
+    transport.connected = False
+    assert not monitor.online
@@ -0,0 +1,26 @@
+from events import EventBroadcaster
+from serving import SSE_CLIENT_LIMIT, WSGI_THREADS
+
+
+def test_client_limit():
+    events = EventBroadcaster(max_clients=2)
+    first, second = events.subscribe(), events.subscribe()
+    assert first is not None and second is not None
+    assert events.subscribe() is None
+    events.unsubscribe(first)
+    assert events.subscribe() is not None
+    assert events.client_count == 2
+
+
+def test_limit_leaves_threads_for_requests():
+    assert 0 < SSE_CLIENT_LIMIT < WSGI_THREADS
+
+
+def test_new_client_gets_last_state():
+    events = EventBroadcaster()
+    events.publish("esp", {"connected": True})
+    events.publish("step", {"index": 1})
+    client = events.subscribe()
+    assert client.qsize() == 1
+    assert "event: esp" in client.get_nowait()
+    assert events.last("esp") == {"connected": True}
@@ -0,0 +1,93 @@
+import json
+import time
+from threading import Event, Lock
+
+from order_queue import STARVATION_S, OrderQueue
+
+
+def ids(orders):
+    return [order["id"] for order in orders]
+
+
+def test_fifo_and_sjf(tmp_path):
+    policy = {"value": "fifo"}
+    queue = OrderQueue(str(tmp_path / "orders.json"), runner=None, policy=lambda: policy["value"])
+    long = queue.enqueue("recipe", "Long.txt", est_ms=60000)
+    short = queue.enqueue("recipe", "Short.txt", est_ms=10000)
+    medium = queue.enqueue("recipe", "Medium.txt", est_ms=30000)
+    assert ids(queue.snapshot()[1]) == [long["id"], short["id"], medium["id"]]
+
+    policy["value"] = "sjf"
+    assert ids(queue.snapshot()[1]) == [short["id"], medium["id"], long["id"]]
+    assert queue.position(long["id"]) == (3, 40000)
+
+    # Nach STARVATION_S rückt der lange Drink trotz SJF nach vorne
+    queue._queued[0]["created"] -= STARVATION_S
+    assert queue.peek()["id"] == long["id"]
+
+
+def test_cancel_queued_order(tmp_path):
+    events = []
+    queue = OrderQueue(str(tmp_path / "orders.json"), runner=None)
+    queue.add_listener(lambda action, order: events.append((action, order["id"])))
+    first = queue.enqueue("recipe", "A.txt")
+    second = queue.enqueue("recipe", "B.txt")
+
+    assert queue.cancel(first["id"])
+    assert not queue.cancel(first["id"])
+    assert not queue.cancel(999)
+    assert ids(queue.snapshot()[1]) == [second["id"]]
+    assert queue.get(first["id"])["status"] == "cancelled"
+    assert events[-1] == ("cancelled", first["id"])
+
+
+def test_reload_marks_running_order_interrupted(tmp_path):
+    path = tmp_path / "orders.json"
+    running = {"id": 3, "kind": "recipe", "recipe": "A.txt", "name": "A.txt", "params": {}, "est_ms": 0,
+               "status": "running", "created": time.time(), "started": time.time(), "finished": None,
+               "error": None}
+    queued = dict(running, id=4, status="queued", started=None)
+    path.write_text(json.dumps({"next_id": 5, "running": running, "queued": [queued], "history": []}))
+
+    queue = OrderQueue(str(path), runner=None)
+    assert queue.get(3)["status"] == "interrupted"
+    assert ids(queue.snapshot()[1]) == [4]
+    assert queue.enqueue("recipe", "B.txt")["id"] == 5
+    # Der neue Zustand steht sofort wieder in der Datei
+    assert json.loads(path.read_text())["running"] is None
+
+
+def test_single_worker_runs_one_order_at_a_time(tmp_path):
+    lock = Lock()
+    active = {"now": 0, "max": 0}
+    done = Event()
+    finished = []
+
+    def runner(order):
+        with lock:
+            active["now"] += 1
+            active["max"] = max(active["max"], active["now"])
+        time.sleep(0.01)
+        with lock:
+            active["now"] -= 1
+        if order["recipe"] == "Fail.txt":
+            raise RuntimeError("ESP getrennt")
+
+    def listener(action, order):
+        if action in ("done", "failed"):
+            finished.append((order["id"], action))
+            if len(finished) == 5:
+                done.set()
+
+    queue = OrderQueue(str(tmp_path / "orders.json"), runner)
+    queue.add_listener(listener)
+    for name in ("A.txt", "B.txt", "Fail.txt", "C.txt", "D.txt"):
+        queue.enqueue("recipe", name)
+    queue.start()
+    queue.start()
+
+    assert done.wait(5)
+    assert active["max"] == 1
+    assert finished == [(1, "done"), (2, "done"), (3, "failed"), (4, "done"), (5, "done")]
+    assert queue.get(3)["error"] == "ESP getrennt"
+    assert not queue.busy
@@ -0,0 +1,73 @@
+import pytest
+
+import peephole
+from recipe_compiler import Step, parse_recipe, wait_resolver
+
+CONFIG = {"gin": 300, "rum": 500, "pour_time": 2000, "move_wait": 500, "drip_wait": 1000}
+
+# (Quelltext, erwartete Zeilen nach optimize)
+CASES = [
+    # Zweite Fahrt zur selben Flasche
+    ("move gin\nservo cl 1\nmove gin\nservo cl 1",
+     "move gin\nservo cl 1\nservo cl 1"),
+    # move_wait nach einer Fahrt
+    ("move gin\nwait move_wait\nservo cl 1",
+     "move gin\nservo cl 1"),
+    # Derselbe Platzhalter doppelt wartet auf dasselbe Ereignis
+    ("move gin\nservo cl 1\nwait drip_wait\nwait drip_wait",
+     "move gin\nservo cl 1\nwait drip_wait"),
+    # Verschiedene Wartezeiten addieren sich und bleiben
+    ("move gin\nservo cl 1\nwait drip_wait\nwait 2000",
+     "move gin\nservo cl 1\nwait drip_wait\nwait 2000"),
+    # Gleiche Zahlen-waits sind bewusste Pausen
+    ("move gin\nservo ms 500\nwait 2000\nwait 2000",
+     "move gin\nservo ms 500\nwait 2000\nwait 2000"),
+    # Eine Notiz trennt die Wartezeiten nicht
+    ("move gin\nservo cl 1\nwait drip_wait\nnote Umrühren\nwait drip_wait",
+     "move gin\nservo cl 1\nwait drip_wait\nnote Umrühren"),
+    ("move gin\nservo cl 1\nwait drip_wait\nnote Umrühren\nwait 2000",
+     "move gin\nservo cl 1\nwait drip_wait\nnote Umrühren\nwait 2000"),
+    # Fester Punkt nach einer normalen Fahrt bleibt, umgekehrt entfällt die zweite
+    ("move gin\nmove gin fixed\nservo cl 1",
+     "move gin\nmove gin fixed\nservo cl 1"),
+    ("move gin fixed\nmove gin\nservo cl 1",
+     "move gin fixed\nservo cl 1"),
+]
+
+
+def optimized(source, **options):
+    instrs, rewrites = peephole.optimize(parse_recipe(source), wait_resolver(CONFIG), **options)
+    return "\n".join(instr.text for instr in instrs), rewrites
+
+
+@pytest.mark.parametrize("source, expected", CASES)
+def test_optimize(source, expected):
+    text, rewrites = optimized(source)
+    assert text == expected
+    assert len(rewrites) == len(source.splitlines()) - len(expected.splitlines())
+    assert all(rewrite.saved_ms >= 0 for rewrite in rewrites)
+
+
+def test_merge_waits_is_opt_in():
+    source = "move gin\nservo cl 1\nwait drip_wait\nwait 2000"
+    text, rewrites = optimized(source, merge_waits=True)
+    assert text == "move gin\nservo cl 1\nwait 2000"
+    assert [rewrite.saved_ms for rewrite in rewrites] == [1000]
+
+
+def test_drop_idle_moves():
+    steps = (Step("move", "gin", 300, None, 0, 0), Step("servo", "gin", None, None, 500, 0),
+             Step("move", "gin", 300, None, 0, 0), Step("move", "rum", 500, None, 0, 0))
+    result, saved = peephole.drop_idle_moves(steps)
+    assert result == steps[:2] + steps[3:]
+    assert saved > 0
+    assert peephole.drop_idle_moves(result) == (result, 0)
+
+
+def test_diff():
+    instrs = parse_recipe("move gin\nwait move_wait\nservo cl 1")
+    lines = peephole.diff(instrs, peephole.optimize(instrs, wait_resolver(CONFIG))[0], "Gin.txt")
+    assert lines[:2] == ["--- Gin.txt", "+++ Gin.txt (optimiert)"]
+    assert "-wait move_wait" in lines
+    assert not any(line.startswith("+") and not line.startswith("+++") for line in lines)
+    assert peephole.diff(instrs, instrs) == []
@@ -0,0 +1,77 @@
+import itertools
+import random
+
+import pytest
+
+from planner import EXACT_LIMIT, _heuristic_order, _route_cost, best_order, order_blocks, plan_order
+from recipe_compiler import compile_program, parse_recipe
+
+START, END = 10, 10
+
+
+def cost(order, positions):
+    return _route_cost(order, positions, START, END, None)
+
+
+def optimum(positions):
+    return min(cost(list(order), positions) for order in itertools.permutations(range(len(positions))))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_exact_order_is_optimal(seed):
+    positions = random.Random(seed).sample(range(20, 1100, 10), 6)
+    assert cost(best_order(positions, START, END), positions) == optimum(positions)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_heuristic_order_not_worse(seed):
+    rng = random.Random(seed)
+    small = rng.sample(range(20, 1100, 10), 6)
+    assert optimum(small) <= cost(_heuristic_order(small, START, END, None), small) <= cost(list(range(6)), small)
+
+    large = rng.sample(range(20, 1100, 10), EXACT_LIMIT + 4)
+    order = best_order(large, START, END)
+    assert sorted(order) == list(range(len(large)))
+    assert cost(order, large) <= cost(list(range(len(large))), large)
+
+
+def test_barriers_stay_in_place():
+    positions = [900, 100, 500, 800, 200, 700]
+    barriers = [False, False, True, False, False, False]
+    order = order_blocks(positions, barriers, end_mm=END)
+    assert order[2] == 2
+    assert sorted(order[:2]) == [0, 1]
+    assert sorted(order[3:]) == [3, 4, 5]
+    assert order[:2] == [1, 0]
+
+
+CONFIG = {"gin": 900, "rum": 100, "vodka": 500, "tequila": 200, "pour_time": 2000}
+
+
+def targets(source, config=CONFIG):
+    plan = compile_program(parse_recipe(source), config, plan=True)
+    return [step.target for step in plan.steps if step.kind == "move"], plan
+
+
+def test_fixed_move_is_barrier():
+    order, _ = targets("move gin\nservo cl 1\nmove rum\nservo cl 1\nmove vodka fixed\nservo cl 1\n"
+                       "move tequila\nservo cl 1\nmove 10")
+    assert order == ["rum", "gin", "vodka", "tequila", "10"]
+
+
+def test_numeric_move_is_barrier():
+    order, _ = targets("move gin\nservo cl 1\nmove 600\nmove rum\nservo cl 1\nmove tequila\nservo cl 1\nmove 10")
+    assert order[:2] == ["gin", "600"]
+    assert set(order[2:4]) == {"rum", "tequila"}
+    assert order[-1] == "10"
+
+
+def test_saved_ms_not_negative():
+    # Schon optimale Reihenfolge: nichts zu sparen, aber auch kein negativer Wert
+    steps = compile_program(parse_recipe("move rum\nservo cl 1\nmove tequila\nservo cl 1\nmove 10"),
+                            CONFIG, plan=False).steps
+    assert plan_order(steps)[1] == 0
+    _, plan = targets("move gin\nservo cl 1\nmove rum\nservo cl 1\nmove vodka\nservo cl 1\nmove 10")
+    assert plan.saved_ms > 0
+    _, plan = targets("move rum\nservo cl 1\nmove gin\nservo cl 1\nmove 10")
+    assert plan.saved_ms >= 0
@@ -0,0 +1,57 @@
+import json
+
+from config_store import ConfigStore
+from recipe_compiler import RecipeCompiler, touched_keys
+from recipe_store import RecipeStore
+
+CONFIG = {"gin": 300, "rum": 500, "pour_time": 2000, "queue_policy": "fifo"}
+SOURCE = "move gin\nservo cl 2\nwait drip_wait\nmove rum\nservo cl 1\nwait drip_wait\nmove 10"
+
+
+def setup(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps(CONFIG))
+    config_store = ConfigStore(str(path), debounce=60)
+    store = RecipeStore(str(tmp_path / "recipes.db"))
+    store.save("Test.txt", SOURCE)
+    compiler = RecipeCompiler(store)
+    config_store.subscribe(compiler.on_config_change)
+    return config_store, compiler
+
+
+def plan(config_store, compiler):
+    version, config = config_store.snapshot()
+    return compiler.plan("Test.txt", config, version)
+
+
+def test_runtime_setting_keeps_cached_plans(tmp_path):
+    config_store, compiler = setup(tmp_path)
+    before = plan(config_store, compiler)
+    config_store.update({"queue_policy": "sjf", "chain_orders": False})
+    assert plan(config_store, compiler) is before
+
+
+def test_timing_setting_recompiles(tmp_path):
+    config_store, compiler = setup(tmp_path)
+    before = plan(config_store, compiler)
+    config_store.update({"pour_time": 3000})
+    after = plan(config_store, compiler)
+    assert after is not before
+    assert after.est_ms > before.est_ms
+
+
+def test_touched_keys():
+    assert "*" not in touched_keys({"queue_policy", "batch_mode"}, CONFIG, CONFIG)
+    assert "*" in touched_keys({"drip_wait"}, CONFIG, CONFIG)
+    assert touched_keys({"pump1"}, {"pump1": "cola"}, {"pump1": "sprite"}) >= {"cola", "sprite"}
+
+
+def test_stored_recipes_keep_order_by_default(tmp_path):
+    config_store, compiler = setup(tmp_path)
+    config_store.update({"vodka": 900})
+    # vodka, gin, rum fährt hin und her, bleibt aber ohne reorder_recipes so
+    compiler.store.save("Test.txt", "move vodka\nservo cl 1\nmove gin\nservo cl 1\nmove rum\nservo cl 1\nmove 10")
+    moves = lambda: [step.target for step in plan(config_store, compiler).steps if step.kind == "move"]
+    assert moves() == ["vodka", "gin", "rum", "10"]
+    config_store.update({"reorder_recipes": True})
+    assert moves()[:3] in (["gin", "rum", "vodka"], ["vodka", "rum", "gin"])
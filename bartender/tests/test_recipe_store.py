@@ -0,0 +1,103 @@
+import os
+import sqlite3
+import time
+
+from recipe_store import RecipeStore
+
+
+def store_with(tmp_path, *names):
+    store = RecipeStore(str(tmp_path / "recipes.db"))
+    for name in names:
+        store.save(name, "move gin\nservo cl 1")
+    return store
+
+
+def test_schema(tmp_path):
+    store_with(tmp_path).close()
+    db = sqlite3.connect(str(tmp_path / "recipes.db"))
+    tables = {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    indexes = {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    columns = [row[1] for row in db.execute("PRAGMA table_info(recipes)")]
+    assert {"recipes", "recipe_ingredients"} <= tables
+    assert {"recipe_ingredients_by_ingredient", "recipes_by_valid"} <= indexes
+    assert columns == ["name", "source", "revision", "updated", "meta_revision", "valid", "est_ms",
+                       "total_cl", "meta"]
+    # Öffnen einer bestehenden Datenbank legt nichts doppelt an
+    RecipeStore(str(tmp_path / "recipes.db")).close()
+
+
+def test_generation_and_revisions(tmp_path):
+    store = store_with(tmp_path, "A.txt", "B.txt")
+    assert store.generation == 2
+    assert store.revision("A.txt") == 1
+    assert store.save("A.txt", "move rum") == 3
+    assert store.source("A.txt") == (3, "move rum")
+    assert store.delete("B.txt") == 4
+    assert store.delete("B.txt") is None
+    assert store.names() == ["A.txt"]
+
+
+def test_listing_filters(tmp_path):
+    store = store_with(tmp_path, "Gin Tonic.txt", "Cuba Libre.txt", "100%_Rum.txt")
+    store.set_meta("Gin Tonic.txt", 1, True, 20000, [("gin", 4), ("tonic", 10)])
+    store.set_meta("Cuba Libre.txt", 2, True, 30000, [("rum", 4), ("cola", 10), ("rum", 2)])
+    store.set_meta("100%_Rum.txt", 3, False, 0, [("rum", 4)], reasons=["Kein Eintrag für 'rum'"])
+
+    names = lambda **filters: [entry["name"] for entry in store.listing(**filters)]
+    assert names() == ["100%_Rum.txt", "Cuba Libre.txt", "Gin Tonic.txt"]
+    assert names(ingredient="rum") == ["100%_Rum.txt", "Cuba Libre.txt"]
+    assert names(search="gin") == ["Gin Tonic.txt"]
+    # % und _ sind im Suchbegriff keine Platzhalter
+    assert names(search="%_") == ["100%_Rum.txt"]
+    assert names(search="_") == ["100%_Rum.txt"]
+    assert names(valid=True) == ["Cuba Libre.txt", "Gin Tonic.txt"]
+    assert names(valid=False, ingredient="rum") == ["100%_Rum.txt"]
+
+    cuba = store.listing(search="cuba")[0]
+    assert cuba["compiled"] and cuba["est_ms"] == 30000 and cuba["total_cl"] == 16
+    assert {item["name"]: item["amount"] for item in cuba["ingredients"]} == {"rum": 6, "cola": 10}
+    assert store.listing(valid=False)[0]["reasons"] == ["Kein Eintrag für 'rum'"]
+    assert store.ingredients() == {"cola": 1, "gin": 1, "rum": 2, "tonic": 1}
+
+
+def test_set_meta_guarded_by_revision(tmp_path):
+    store = store_with(tmp_path, "A.txt")
+    assert store.set_meta("A.txt", 1, True, 1000, [("gin", 1)])
+    # Gleiche Werte: kein Schreiben
+    assert not store.set_meta("A.txt", 1, True, 1000, [("gin", 1)])
+    assert store.set_meta("A.txt", 1, True, 2000, [("gin", 1)])
+
+    store.save("A.txt", "move rum\nservo cl 2")
+    # Veraltete Revision überschreibt die neue Fassung nicht
+    assert not store.set_meta("A.txt", 1, True, 3000, [("gin", 1)])
+    entry = store.listing()[0]
+    assert not entry["compiled"] and entry["est_ms"] == 2000
+    assert store.set_meta("A.txt", 2, True, 4000, [("rum", 2)])
+    assert store.listing(ingredient="gin") == []
+    assert not store.set_meta("Fehlt.txt", 1, True, 0, [])
+
+
+def test_import_export_and_newer_files(tmp_path):
+    folder = tmp_path / "Rezepte"
+    folder.mkdir()
+    (folder / "A.txt").write_text("move gin")
+    (folder / "notes.md").write_text("kein Rezept")
+    store = RecipeStore(str(tmp_path / "recipes.db"))
+    assert store.import_folder(str(folder)) == 1
+    assert store.newer_files(str(folder)) == []
+
+    later = time.time() + 10
+    (folder / "A.txt").write_text("move rum")
+    os.utime(folder / "A.txt", (later, later))
+    assert store.newer_files(str(folder)) == ["A.txt"]
+    # Ein späteres Speichern eines anderen Rezepts verdeckt die Änderung nicht
+    store.save("B.txt", "move gin")
+    assert store.newer_files(str(folder)) == ["A.txt"]
+    assert store.import_folder(str(folder), overwrite=False) == 0
+    assert store.import_folder(str(folder)) == 1
+    assert store.source("A.txt")[1] == "move rum"
+
+    out = tmp_path / "export"
+    assert store.export_folder(str(out)) == 2
+    assert (out / "A.txt").read_text() == "move rum"
+    assert store.newer_files(str(out)) == []
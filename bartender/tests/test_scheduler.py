@@ -0,0 +1,84 @@
+from estimator import estimate_steps, step_time_ms, PARK_POSITION
+from planner import plan_blocks
+from recipe_compiler import compile_program, parse_recipe
+from scheduler import interleave_refills
+
+REFILL_MS = 5000
+PORTION = ["servo cl 2", "wait refill_wait", "servo cl 2", "wait refill_wait", "servo cl 2", "wait drip_wait"]
+
+
+def config(spacing):
+    return {"gin": 300, "rum": 300 + spacing, "vodka": 300 + 2 * spacing,
+            "pour_time": 2000, "refill_wait": REFILL_MS, "drip_wait": 1000}
+
+
+def source(*moves):
+    lines = []
+    for move in moves:
+        lines.append(f"move {move}")
+        lines.extend(PORTION)
+    lines.append(f"move {PARK_POSITION}")
+    return "\n".join(lines)
+
+
+def schedule(text, config, fixed_targets=()):
+    """(geplante Schritte ohne Verschränkung, Ergebnis des Schedulers)"""
+    steps = compile_program(parse_recipe(text), config, plan=False).steps
+    fixed = {idx for idx, step in enumerate(steps) if step.kind == "move" and step.target in fixed_targets}
+    prefix, blocks = plan_blocks(steps, fixed, config)
+    planned = tuple(prefix) + tuple(step for _, block in blocks for step in block)
+    return planned, interleave_refills(prefix, blocks, config=config)
+
+
+def servo_times(steps, config):
+    """[(Ziel, Start, Ende)] aller servo-Schritte entlang der Schätzung."""
+    t, position, result = 0, PARK_POSITION, []
+    for step in steps:
+        ms, position = step_time_ms(step, position, config)
+        if step.kind == "servo":
+            result.append((step.target, t, t + ms))
+        t += ms
+    return result
+
+
+def test_interleaving_adopted_only_when_faster():
+    close = config(10)
+    planned, result = schedule(source("gin", "rum"), close)
+    assert result != planned
+    assert estimate_steps(result, close).total_ms < estimate_steps(planned, close).total_ms - 5000
+
+    far = config(200)
+    planned, result = schedule(source("gin", "rum"), far)
+    assert result == planned
+
+
+def test_every_portion_poured_once():
+    cfg = config(10)
+    planned, result = schedule(source("gin", "rum", "vodka"), cfg)
+    poured = lambda steps: sorted((step.target, step.duration) for step in steps if step.kind == "servo")
+    assert poured(result) == poured(planned)
+    assert len(poured(result)) == 9
+
+
+def test_refill_time_respected():
+    cfg = config(10)
+    planned, result = schedule(source("gin", "rum", "vodka"), cfg)
+    assert result != planned
+    last_end = {}
+    for target, start, end in servo_times(result, cfg):
+        if target in last_end:
+            assert start - last_end[target] >= REFILL_MS
+        last_end[target] = end
+
+
+def test_fixed_barrier_not_crossed():
+    cfg = config(10)
+    _, result = schedule(source("gin", "rum", "vodka"), cfg, fixed_targets={"rum"})
+    barrier = next(idx for idx, step in enumerate(result) if step.kind == "move" and step.target == "rum")
+    before = {step.target for step in result[:barrier] if step.kind == "servo"}
+    after = {step.target for step in result[barrier:] if step.kind == "servo"}
+    assert before == {"gin"}
+    assert after == {"rum", "vodka"}
+    # Der feste Block selbst bleibt am Stück
+    servos = [step.target for step in result[barrier:] if step.kind == "servo"]
+    assert servos[:3] == ["rum"] * 3
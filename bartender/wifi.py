@@ -1,13 +1,132 @@
 # Credit to this Blog Post for the Idea: https://www.raspberrypi.com/tutorials/host-a-hotel-wifi-hotspot/
 # I changed it a bit, but its pretty much that technique
 
-from flask import Flask, request
+from flask import Flask, request, jsonify, redirect
+from serving import serve
+from html import escape
+from threading import Event, Lock, Thread
 import subprocess
+import time
+
+import logs
+
+logs.setup()
+log = logs.get("wifi")
 
 app = Flask(__name__)
 
 wifi_device = "wlan0"
 
+# Liste aus dem Cache von NetworkManager (ohne Funk-Scan) alle REFRESH_S
+# Sekunden, echter Scan nur alle SCAN_TTL_S Sekunden oder auf Anforderung,
+# damit die Clients am Hotspot nicht ständig gestört werden
+REFRESH_S = 15
+SCAN_TTL_S = 300
+
+
+def split_terse(line):
+    """Zerlegt eine Zeile von 'nmcli -t' (':' getrennt, '\\:' maskiert)."""
+    fields, current, escaped = [], "", False
+    for char in line:
+        if escaped:
+            current += char
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char == ":":
+            fields.append(current)
+            current = ""
+        else:
+            current += char
+    fields.append(current)
+    return fields
+
+
+class WifiScanner:
+    """Hält die SSID-Liste im Speicher und aktualisiert sie im Hintergrund."""
+
+    def __init__(self, device):
+        self.device = device
+        self._lock = Lock()
+        self._wakeup = Event()
+        self._networks = []
+        self._updated = None
+        self._last_scan = 0.0
+        self._scan_requested = True
+        self._scanning = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def rescan(self):
+        """Fordert einen echten Funk-Scan an (kehrt sofort zurück)."""
+        with self._lock:
+            self._scan_requested = True
+        self._wakeup.set()
+
+    def snapshot(self):
+        with self._lock:
+            return {"networks": [dict(n) for n in self._networks], "updated": self._updated,
+                    "scanning": self._scanning or self._scan_requested}
+
+    def _run(self):
+        while True:
+            with self._lock:
+                scan = self._scan_requested or time.time() - self._last_scan >= SCAN_TTL_S
+                self._scan_requested = False
+                self._scanning = scan
+            try:
+                networks = self._list(rescan=scan)
+                with self._lock:
+                    self._networks = networks
+                    self._updated = time.time()
+                    if scan:
+                        self._last_scan = self._updated
+            except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError) as e:
+                log.error("Fehler beim Suchen nach WLAN-Netzen: %s", e)
+            with self._lock:
+                self._scanning = False
+            self._wakeup.wait(REFRESH_S)
+            self._wakeup.clear()
+
+    def _list(self, rescan):
+        output = subprocess.check_output([
+            "nmcli", "--colors", "no", "-t", "-f", "SSID,SIGNAL,SECURITY",
+            "dev", "wifi", "list", "ifname", self.device,
+            "--rescan", "yes" if rescan else "no"
+        ], timeout=30).decode()
+        best = {}
+        for line in output.splitlines():
+            fields = split_terse(line)
+            if len(fields) < 3 or not fields[0].strip():
+                continue
+            ssid = fields[0].strip()
+            signal = int(fields[1]) if fields[1].isdigit() else 0
+            security = fields[2].strip()
+            # Gleiche SSID von mehreren Access Points: nur das stärkste Signal
+            if ssid not in best or signal > best[ssid]["signal"]:
+                best[ssid] = {"ssid": ssid, "signal": signal, "security": security}
+        return sorted(best.values(), key=lambda n: (-n["signal"], n["ssid"].lower()))
+
+
+scanner = WifiScanner(wifi_device)
+
+
+@app.route('/networks', methods=['GET'])
+def networks():
+    return jsonify(scanner.snapshot())
+
+
+@app.route('/rescan', methods=['GET', 'POST'])
+def rescan():
+    scanner.rescan()
+    if request.method == 'POST' and request.is_json:
+        return jsonify({"status": "success", "message": "Suche gestartet."})
+    return redirect('/')
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     message = ""
@@ -33,23 +152,17 @@ def index():
                 result = subprocess.run(connection_command, capture_output=True, text=True, check=True)
                 # Optional: Neustart des Servers nach erfolgreicher Verbindung
                 subprocess.run(['sudo', 'python', 'restart.py'], check=True)
-                print("server.py wurde erfolgreich neu gestartet.")
+                log.info("server.py wurde erfolgreich neu gestartet.")
                 message = f"Erfolg: {result.stdout}"
                 success = True
             except subprocess.CalledProcessError as e:
                 error_message = e.stderr or e.stdout
+                log.warning("Verbindung mit WLAN '%s' fehlgeschlagen: %s", ssid, error_message)
                 message = f"Fehler: Verbindung zum WiFi-Netzwerk fehlgeschlagen: <i>{error_message}</i>"
 
-    try:
-        result = subprocess.check_output([
-            "nmcli", "--colors", "no", "-m", "multiline",
-            "--get-value", "SSID", "dev", "wifi", "list",
-            "ifname", wifi_device
-        ])
-        ssids_list = result.decode().split('\n')
-        ssids = [ssid.removeprefix("SSID:").strip() for ssid in ssids_list if ssid.startswith("SSID:") and ssid.removeprefix("SSID:").strip()]
-    except subprocess.CalledProcessError:
-        ssids = []
+    # Liste kommt aus dem Cache des Hintergrund-Scanners, kein nmcli-Aufruf pro Seitenaufruf
+    scan = scanner.snapshot()
+    wifi_networks = scan["networks"]
 
     # Erstelle das HTML mit reinem Python
     dropdowndisplay = f"""
@@ -73,9 +186,11 @@ def index():
                             <select name="ssid" id="ssid" class="form-select" required>
                                 <option value="" disabled selected>Bitte auswählen</option>
     """
-    for ssid in ssids:
+    for network in wifi_networks:
+        ssid = escape(network["ssid"], quote=True)
+        lock = " 🔒" if network["security"] and network["security"] != "--" else ""
         dropdowndisplay += f"""
-                                <option value="{ssid}">{ssid}</option>
+                                <option value="{ssid}">{ssid} ({network["signal"]}%){lock}</option>
         """
 
     dropdowndisplay += """
@@ -93,6 +208,16 @@ def index():
                         </div>
                         <button type="submit" class="btn btn-primary w-100">Verbinden</button>
                     </form>
+                    <form action="/rescan" method="post" class="mt-2">
+                        <button type="submit" class="btn btn-outline-secondary w-100">Netzwerke neu suchen</button>
+                    </form>
+    """
+    if scan["scanning"] and not wifi_networks:
+        dropdowndisplay += """
+                    <p class="text-muted text-center mt-2">Suche nach Netzwerken läuft...</p>
+                    <meta http-equiv="refresh" content="3">
+    """
+    dropdowndisplay += """
                 </div>
             </div>
     """
@@ -141,4 +266,7 @@ def index():
 
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5002)
+    scanner.start()
+    # Mehrthreadiger Server; Entwicklungsmodus mit "--dev" (immer ohne Reloader,
+    # sonst liefe der Scanner in zwei Prozessen)
+    serve(app, '0.0.0.0', 5002)